@@ -0,0 +1,285 @@
+"""
+Dependency-graph deployer used by deploy_ropsten.py
+
+Contracts and their constructor arguments are described in the "Deployment"
+section of 'deploy.json'. Every argument is a reference to another field of
+that file, e.g. "ContractAddress.joyToken" or "AccountAddress.platformReserve".
+Arguments pointing into "ContractAddress" are the dependencies of a contract.
+Optional "links" map getters of a deployed contract to fields they must
+return, they are verified by deploy_plan.py.
+
+Contracts are submitted as soon as all of their dependencies are mined,
+so independent contracts land in the same block and total deployment time
+is bounded by the longest dependency chain, not by the number of contracts.
+With a local signer all ready contracts are signed at once and sent in one
+eth_sendRawTransaction batch.
+"""
+
+import time
+
+from artifact_cache import default_cache, get_contract_factory
+from rpc_batch import batch_request, poll_receipts, to_int, RPCError
+
+
+CONTRACT_ADDRESS_PREFIX = "ContractAddress."
+
+
+# read value from json_data using dotted path, e.g. "ContractAddress.subscription.ether"
+def get_field(json_data, path):
+    value = json_data
+    for part in path.split("."):
+        value = value[part]
+    return value
+
+
+def address_word(address):
+    return "00" * 12 + address.lower()[2:]
+
+
+def set_field(json_data, path, value):
+    parts = path.split(".")
+    target = json_data
+    for part in parts[:-1]:
+        target = target[part]
+    target[parts[-1]] = value
+
+
+class DeployNode:
+    """Single contract in the deployment graph."""
+
+    def __init__(self, key, contract_name, args, links=None):
+        # key is a path relative to "ContractAddress", e.g. "subscription.ether"
+        self.key = key
+        self.contract_name = contract_name
+        self.args = list(args)
+        self.links = dict(links or {})
+        self.deps = [arg[len(CONTRACT_ADDRESS_PREFIX):] for arg in self.args
+                     if arg.startswith(CONTRACT_ADDRESS_PREFIX)]
+
+    def __repr__(self):
+        return "DeployNode({}, {})".format(self.key, self.contract_name)
+
+
+def load_deploy_graph(json_data):
+    """Build graph of DeployNode objects from "Deployment" section of deploy.json.
+
+    :return: dict key -> DeployNode, in the order given in the file
+    """
+    if "Deployment" not in json_data:
+        raise ValueError("Not found require section: 'Deployment' in your 'deploy.json' file.")
+
+    graph = {}
+    for key, spec in json_data["Deployment"].items():
+        graph[key] = DeployNode(key, spec["contract"], spec.get("args", []), spec.get("links"))
+
+    for node in graph.values():
+        for dep in node.deps:
+            if dep not in graph:
+                raise ValueError("Contract '" + node.key + "' depends on '" + dep
+                    + "' which is not described in 'Deployment' section.")
+
+    # raises on cycles
+    topological_order(graph)
+    return graph
+
+
+def topological_order(graph):
+    """Return keys of graph sorted so that every contract follows its dependencies."""
+    order = []
+    state = {}
+
+    def visit(key, path):
+        if state.get(key) == "done":
+            return
+        if state.get(key) == "visiting":
+            raise ValueError("Cyclic dependency in 'Deployment' section: " + " -> ".join(path + [key]))
+        state[key] = "visiting"
+        for dep in graph[key].deps:
+            visit(dep, path + [key])
+        state[key] = "done"
+        order.append(key)
+
+    for key in graph:
+        visit(key, [])
+    return order
+
+
+def plan_redeploy(graph, given):
+    """Determine which contracts need to be deployed.
+
+    Contract is (re)deployed when its address is not given in deploy.json
+    or when any of its dependencies is going to be redeployed.
+
+    :param given: dict key -> bool, True when a valid address is configured
+    :return: list of keys in topological order
+    """
+    redeploy = set()
+    for key in topological_order(graph):
+        if not given.get(key) or any(dep in redeploy for dep in graph[key].deps):
+            redeploy.add(key)
+    return [key for key in topological_order(graph) if key in redeploy]
+
+
+def critical_path(graph, keys):
+    """Longest dependency chain among given keys (lower bound of confirmation rounds)."""
+    keys = set(keys)
+    depth = {}
+    longest = []
+    for key in topological_order(graph):
+        if key not in keys:
+            continue
+        chain_deps = [depth[dep] for dep in graph[key].deps if dep in keys]
+        depth[key] = max(chain_deps, key=len, default=[]) + [key]
+        if len(depth[key]) > len(longest):
+            longest = depth[key]
+    return longest
+
+
+class ParallelDeployer:
+    """Deploys contracts from the graph, submitting every contract with ready inputs at once.
+
+    Nonces for the owner account are fetched once and handed out locally in the
+    order of submission, so many deploy transactions can wait in the same block
+    without gaps in the nonce sequence. They are fetched again after a
+    transaction could not be sent.
+
+    :param signer: signer.TransactionSigner holding the owner key, the owner need not be unlocked in the node
+    :param artifacts: ArtifactCache with compiled contracts, used with signer
+    """
+
+    def __init__(self, chain, owner, json_data, graph, gas_price=None, poll_interval=1, timeout=600, signer=None,
+                 artifacts=None):
+        self.chain = chain
+        self.web3 = chain.web3
+        self.owner = owner
+        self.json_data = json_data
+        self.graph = graph
+        self.gas_price = gas_price
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.signer = signer
+        self.artifacts = artifacts
+        self.next_nonce = None
+
+    def allocate_nonce(self):
+        if self.next_nonce is None:
+            self.next_nonce = self.web3.eth.getTransactionCount(self.owner, 'pending')
+        nonce = self.next_nonce
+        self.next_nonce += 1
+        return nonce
+
+    def resync_nonce(self):
+        # a transaction was not sent, its nonce would leave a gap in front of later deployments
+        self.next_nonce = None
+
+    def submit(self, key):
+        node = self.graph[key]
+        args = [get_field(self.json_data, arg) for arg in node.args]
+        nonce = self.allocate_nonce()
+
+        print("Deploying " + node.contract_name + " (" + key + ") with nonce " + str(nonce) + "...")
+        transaction = {"from": self.owner, "nonce": nonce}
+        if self.gas_price:
+            transaction["gasPrice"] = self.gas_price
+
+        factory = get_contract_factory(self.chain, node.contract_name)
+        try:
+            txhash = factory.deploy(transaction=transaction, args=args)
+        except Exception:
+            self.resync_nonce()
+            raise
+        print(node.contract_name + " txhash is: ", txhash)
+        return txhash
+
+    def deployment_data(self, key):
+        # constructor arguments in deploy.json are addresses, each one is a single ABI word
+        if self.artifacts is None:
+            self.artifacts = default_cache()
+            self.artifacts.ensure(lambda: self.chain.project.compiled_contract_data)
+        node = self.graph[key]
+        bytecode = self.artifacts.artifact(node.contract_name)["bytecode"]
+        return bytecode + "".join(address_word(get_field(self.json_data, arg)) for arg in node.args)
+
+    def submit_signed(self, keys):
+        """Sign deployments of given contracts locally and send them in one batch.
+
+        :return: list of txhashes in the order of keys
+        """
+        data = [self.deployment_data(key) for key in keys]
+        estimates = batch_request(self.web3, [("eth_estimateGas", [{"from": self.owner, "data": code}])
+                                              for code in data])
+        gas_price = self.gas_price or self.web3.eth.gasPrice
+
+        transactions = []
+        for key, code, estimate in zip(keys, data, estimates):
+            nonce = self.allocate_nonce()
+            print("Deploying " + self.graph[key].contract_name + " (" + key + ") with nonce " + str(nonce) + "...")
+            transactions.append({"from": self.owner, "data": code, "gas": int(to_int(estimate) * 1.2),
+                                 "gasPrice": gas_price, "nonce": nonce})
+
+        try:
+            txhashes = self.signer.send(self.web3, transactions)
+        except Exception:
+            self.resync_nonce()
+            raise
+        if any(isinstance(txhash, RPCError) for txhash in txhashes):
+            self.resync_nonce()
+        for key, txhash in zip(keys, txhashes):
+            if isinstance(txhash, RPCError):
+                raise ValueError("Deployment of " + self.graph[key].contract_name + " can not be sent: "
+                                 + str(txhash.error))
+            print(self.graph[key].contract_name + " txhash is: ", txhash)
+        return txhashes
+
+    def fetch_receipts(self, pending):
+        # one batch request for all pending deployments,
+        # returns dict txhash -> receipt for transactions that are already mined
+        return poll_receipts(self.web3, list(pending))
+
+    def deploy(self, keys):
+        """Deploy contracts given by keys, updating "ContractAddress" fields in json_data.
+
+        :return: dict key -> receipt
+        """
+        remaining = list(keys)
+        pending = {}  # txhash -> key
+        done = {}
+        deadline = time.time() + self.timeout
+
+        print("Critical path: " + " -> ".join(critical_path(self.graph, keys)))
+
+        while remaining or pending:
+            # submit every contract whose dependencies are already deployed
+            ready = [key for key in remaining
+                     if all(dep not in remaining and dep not in pending.values() for dep in self.graph[key].deps)]
+            for key in ready:
+                remaining.remove(key)
+            if self.signer is not None and ready:
+                pending.update(zip(self.submit_signed(ready), ready))
+            else:
+                for key in ready:
+                    pending[self.submit(key)] = key
+
+            if not pending:
+                raise ValueError("Unable to deploy: " + ", ".join(remaining))
+
+            if time.time() > deadline:
+                raise TimeoutError("Timeout waiting for deployment of: " + ", ".join(pending.values()))
+
+            receipts = self.fetch_receipts(pending)
+            if not receipts:
+                time.sleep(self.poll_interval)
+                continue
+
+            for txhash, receipt in receipts.items():
+                key = pending.pop(txhash)
+                node = self.graph[key]
+                print(node.contract_name + " receipt: ", receipt)
+
+                if receipt.get("status") == 0 or not receipt.get("contractAddress"):
+                    raise ValueError("Deployment of " + node.contract_name + " failed, txhash: " + str(txhash))
+
+                set_field(self.json_data, CONTRACT_ADDRESS_PREFIX + key, receipt["contractAddress"])
+                done[key] = receipt
+
+        return done
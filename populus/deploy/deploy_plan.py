@@ -0,0 +1,146 @@
+"""
+Verification of deployed contracts used by 'deploy_ropsten.py plan'
+
+For every contract with an address in deploy.json the code at that address
+is compared with the runtime bytecode of the current build, and getters
+listed in "links" are compared with the fields they must return (e.g.
+m_playersDeposit of the game must be the configured deposit). All checks
+are sent as one JSON-RPC batch, so verifying a healthy deployment costs a
+single round trip. Gas is estimated only for contracts that will be deployed.
+"""
+
+from artifact_cache import default_cache
+from deploy_graph import address_word, get_field, plan_redeploy, topological_order, CONTRACT_ADDRESS_PREFIX
+from rpc_batch import batch_request, to_int, RPCError
+
+
+PLACEHOLDER_ADDRESS = "0x" + "00" * 20
+
+
+def strip_metadata(code):
+    """Remove CBOR metadata appended by solc, it changes with comments and paths but not with code."""
+    code = code[2:] if code.startswith("0x") else code
+    code = code.lower()
+    if len(code) >= 4:
+        metadata_length = int(code[-4:], 16)
+        metadata_start = len(code) - 4 - 2 * metadata_length
+        # metadata is a CBOR map, starting with a1 (solc 0.4) or a2 (newer versions)
+        if metadata_start >= 0 and code[metadata_start:metadata_start + 2] in ("a1", "a2"):
+            return code[:metadata_start]
+    return code
+
+
+def verify_deployment(web3, graph, json_data, artifacts, given):
+    """Check code and links of all contracts with configured addresses in one batch.
+
+    :param artifacts: ArtifactCache with compiled contracts
+    :param given: dict key -> bool, True when a valid address is configured
+    :return: dict key -> list of problems, empty list for a correct contract
+    """
+    problems = {key: [] if given.get(key) else ["address not configured"] for key in graph}
+
+    calls = []
+    checks = []
+    for key, node in graph.items():
+        if not given.get(key):
+            continue
+        address = get_field(json_data, CONTRACT_ADDRESS_PREFIX + key)
+        calls.append(("eth_getCode", [address, "latest"]))
+        checks.append((key, None, None))
+
+        selectors = artifacts.selectors(node.contract_name)
+        for getter, field in node.links.items():
+            calls.append(("eth_call", [{"to": address, "data": selectors[getter + "()"]}, "latest"]))
+            checks.append((key, getter, field))
+
+    results = batch_request(web3, calls, raise_errors=False)
+
+    for (key, getter, field), result in zip(checks, results):
+        if getter is None:
+            if isinstance(result, RPCError):
+                problems[key].append("code not available: {}".format(result.error))
+                continue
+            built = artifacts.artifact(graph[key].contract_name)["bytecode_runtime"]
+            if strip_metadata(result) == "":
+                problems[key].append("no code at address")
+            elif strip_metadata(result) != strip_metadata(built):
+                problems[key].append("code differs from build")
+            continue
+
+        expected = (get_field(json_data, field) or "").lower()
+        actual = None if isinstance(result, RPCError) or len(result) < 42 else "0x" + result[-40:].lower()
+        if actual != expected:
+            problems[key].append("{}() is {}, expected {} ({})".format(getter, actual, field, expected or "empty"))
+
+    return problems
+
+
+def estimate_gas(web3, graph, json_data, artifacts, keys, owner):
+    """Estimate deployment gas of given contracts in one batch.
+
+    Addresses of contracts deployed in the same run are not known yet, a zero
+    address is used instead; estimates of constructors that call into such
+    contracts fail and are returned as None.
+
+    :return: dict key -> gas or None
+    """
+    keys = list(keys)
+    pending = {CONTRACT_ADDRESS_PREFIX + key for key in keys}
+    calls = []
+    for key in keys:
+        node = graph[key]
+        args = [PLACEHOLDER_ADDRESS if arg in pending else get_field(json_data, arg) for arg in node.args]
+        bytecode = artifacts.artifact(node.contract_name)["bytecode"]
+        data = bytecode + "".join(address_word(arg) for arg in args)
+        calls.append(("eth_estimateGas", [{"from": owner, "data": data}]))
+
+    results = batch_request(web3, calls, raise_errors=False)
+    return {key: None if isinstance(result, RPCError) else to_int(result) for key, result in zip(keys, results)}
+
+
+def make_plan(web3, graph, json_data, artifacts, given, owner):
+    """Return (problems, keys to deploy, gas estimates)."""
+    problems = verify_deployment(web3, graph, json_data, artifacts, given)
+    to_deploy = plan_redeploy(graph, {key: not problems[key] for key in graph})
+
+    # contracts redeployed only because of their dependencies
+    for key in to_deploy:
+        if not problems[key]:
+            deps = [dep for dep in graph[key].deps if dep in to_deploy]
+            problems[key].append("depends on redeployed " + ", ".join(deps))
+
+    estimates = estimate_gas(web3, graph, json_data, artifacts, to_deploy, owner) if to_deploy else {}
+    return problems, to_deploy, estimates
+
+
+def print_plan(graph, json_data, given, problems, to_deploy, estimates, gas_price=None):
+    print("Deployment plan:")
+    for key in topological_order(graph):
+        node = graph[key]
+        address = get_field(json_data, CONTRACT_ADDRESS_PREFIX + key) or "-"
+        if key not in to_deploy:
+            print("  = {} ({}) {}: up to date".format(key, node.contract_name, address))
+            continue
+        mark, action = ("~", "redeploy") if given.get(key) else ("+", "deploy")
+        gas = estimates.get(key)
+        print("  {} {} ({}) {}: {}, {}, gas {}".format(mark, key, node.contract_name, address, action,
+                                                     "; ".join(problems[key]), gas if gas is not None else "unknown"))
+
+    if not to_deploy:
+        print("Nothing to deploy.")
+        return
+
+    known = [gas for gas in estimates.values() if gas is not None]
+    summary = "{} contracts to deploy, estimated gas {}".format(len(to_deploy), sum(known))
+    if len(known) < len(to_deploy):
+        summary += " (without {} unknown)".format(len(to_deploy) - len(known))
+    if gas_price:
+        summary += ", about {:.6f} ether at {} wei".format(sum(known) * gas_price / 10 ** 18, gas_price)
+    print(summary)
+
+
+def load_artifacts(chain):
+    """Artifact cache of the project, contracts are compiled only when the cache is cold."""
+    artifacts = default_cache()
+    artifacts.ensure(lambda: chain.project.compiled_contract_data)
+    return artifacts
@@ -1,10 +1,19 @@
+import argparse
 import json
+import os
+import sys
 
-import populus
-from populus.utils.wait import wait_for_transaction_receipt
-from populus.utils.cli import request_account_unlock
-from populus.utils.accounts import is_account_locked
-from web3 import Web3
+# shared helpers from scripts directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from chain_context import open_chain
+from deploy_graph import load_deploy_graph, ParallelDeployer
+from deploy_plan import load_artifacts, make_plan, print_plan
+from gas_oracle import GasPriceOracle
+from rpc_metrics import instrument_from_env
+from signer import keystore_signer
+
+MODES = ("plan", "apply")
 
 # check if field exist in loaded json file,
 # abort when field is missing or when value is not a correct ethereum addres
@@ -68,58 +77,19 @@ def if_account_available(web3, acc_address, acc_purpose):
             i += 1
         exit(1)
 
-def deploy_contract(contractName, chain, contractOwner, *deploy_args):
-    print("Deploying " + contractName + "...")
-    contract = chain.provider.get_contract_factory(contractName)
-    txhash = contract.deploy(transaction={"from":contractOwner}, args=deploy_args)
-    print(contractName + " txhash is: ", txhash)
-    receipt = wait_for_transaction_receipt(chain.web3, txhash)
-    print(contractName + " receipt: ", receipt)
-    return receipt["contractAddress"]
-
-
-# deploy JoyToken and update json_data
-def deploy_JoyToken(chain, contractOwner, json_data):
-    newJoyTokenAddress = deploy_contract("JoyToken", chain, contractOwner)
-    json_data["ContractAddress"]["joyToken"] = newJoyTokenAddress
-
-
-# deploy Deposit and update json_data
-def deploy_Deposit(chain, contractOwner, json_data):
-    JoyTokenAddress = json_data["ContractAddress"]["joyToken"]
-    platformReserve = json_data["AccountAddress"]["platformReserve"]
-    newDepositAddress = deploy_contract("PlatformDeposit", chain, contractOwner, JoyTokenAddress, platformReserve)
-    json_data["ContractAddress"]["deposit"] = newDepositAddress
-
-
-# deploy DemoGame and update json_data
-def deploy_DemoGame(chain, contractOwner, json_data):
-    DepositAddress = json_data["ContractAddress"]["deposit"];
-    gameDeveloper = json_data["AccountAddress"]["gameDeveloper"]
-    newDemoGameAddress = deploy_contract("JoyGameDemo", chain, contractOwner, DepositAddress, gameDeveloper)
-    json_data["ContractAddress"]["demoGame"] = newDemoGameAddress
-
-
-# deploy SubscriptionWithEther and update json_data
-def deploy_EtherSub(chain, contractOwner, json_data):
-    newEtherSubAddress = deploy_contract("SubscriptionWithEther", chain, contractOwner)
-    json_data["ContractAddress"]["subscription"]["ether"] = newEtherSubAddress
-
+# check if contract given by graph key has a valid address in loaded json file
+def check_graph_contract_field(web3, json_data, key):
+    if key.startswith("subscription."):
+        return check_subscription_contract_field(web3, json_data, key[len("subscription."):])
+    return check_contract_field(web3, json_data, key)
 
-# deploy SubscriptionWithJoyToken and update json_data
-def deploy_JoySub(chain, contractOwner, json_data):
-    JoyTokenAddress = json_data["ContractAddress"]["joyToken"]
-    newJoySubAddress = deploy_contract("SubscriptionWithJoyToken", chain, contractOwner, JoyTokenAddress)
-    json_data["ContractAddress"]["subscription"]["joyToken"] = newJoySubAddress
 
+def deployDemoContracts(mode="apply", keystore=None, chain_name='ropsten'):
 
-def deployDemoContracts():
-    project = populus.Project()
-    chain_name = 'ropsten'
-
-    with project.get_chain(chain_name) as chain:
+    with open_chain(chain_name) as chain:
 
         web3 = chain.web3
+        instrument_from_env(web3)
         print("Web3 provider is", web3.providers)
 
         # loading config file for custom deployment
@@ -130,47 +100,41 @@ def deployDemoContracts():
             require_address(web3, json_data, "platformReserve")
             require_address(web3, json_data, "gameDeveloper")
 
-            # checking if contract owner is one of the available addresses in web3 provider
-            # otherwise there will be not possibile to deploy any contract, and script will be aborted
             contractsOwner = json_data["AccountAddress"]["contractsOwner"]
-            if_account_available(web3, contractsOwner, "contracts owner")
-
-            # get other accounts
-            platformReserve = json_data["AccountAddress"]["platformReserve"]
-            gameDeveloper = json_data["AccountAddress"]["gameDeveloper"]
-
 
             # Determine which contracts will be deployed
-            givenJoyToken = check_contract_field(web3, json_data, "joyToken")
-            givenDeposit = check_contract_field(web3, json_data, "deposit")
-            givenDemoGame = check_contract_field(web3, json_data, "demoGame")
-
-            givenEtherSub = check_subscription_contract_field(web3, json_data, "ether")
-            givenJoySub = check_subscription_contract_field(web3, json_data, "joyToken")
-
-            print("Contracts status in deploy.json file:"
-                + "\n\tJoyToken: " + str(givenJoyToken)
-                + "\n\tDeposit: " + str(givenDeposit)
-                + "\n\tDemoGame: " + str(givenDemoGame)
-                + "\n\tSubscription with Ether: " + str(givenEtherSub)
-                + "\n\tSubscription with JoyToken: " + str(givenJoySub))
-
-
-            if not givenJoyToken:
-                deploy_JoyToken(chain, contractsOwner, json_data);
-                deploy_Deposit(chain, contractsOwner, json_data);
-                deploy_DemoGame(chain, contractsOwner, json_data);
-            elif not givenDeposit:
-                deploy_Deposit(chain, contractsOwner, json_data);
-                deploy_DemoGame(chain, contractsOwner, json_data);
-            elif not givenDemoGame:
-                deploy_DemoGame(chain, contractsOwner, json_data);
-
-            if not givenEtherSub:
-                deploy_EtherSub(chain, contractsOwner, json_data);
-
-            if not givenJoySub:
-                deploy_JoySub(chain, contractsOwner, json_data);
+            graph = load_deploy_graph(json_data)
+            given = {key: check_graph_contract_field(web3, json_data, key) for key in graph}
+
+            # configured contracts are verified on chain: code must match the build and links must match deploy.json,
+            # contracts failing any check are redeployed along with everything that depends on them
+            artifacts = load_artifacts(chain)
+            problems, to_deploy, estimates = make_plan(web3, graph, json_data, artifacts, given, contractsOwner)
+
+            gasPrice = GasPriceOracle(web3).suggest("fast") if to_deploy else None
+            print_plan(graph, json_data, given, problems, to_deploy, estimates, gasPrice)
+
+            if mode == "plan":
+                return
+
+            if to_deploy:
+                signer = None
+                if keystore:
+                    # transactions are signed locally, the node does not need the owner account
+                    signer = keystore_signer([keystore], workers=1)
+                    if web3.toChecksumAddress(signer.addresses[0]) != web3.toChecksumAddress(contractsOwner):
+                        print("Keystore " + keystore + " does not belong to contracts owner " + contractsOwner
+                            + ". Aborting..")
+                        exit(1)
+                else:
+                    # checking if contract owner is one of the available addresses in web3 provider
+                    # otherwise there will be not possibile to deploy any contract, and script will be aborted
+                    if_account_available(web3, contractsOwner, "contracts owner")
+
+                print("Gas Price: " + str(gasPrice))
+                deployer = ParallelDeployer(chain, contractsOwner, json_data, graph, gas_price=gasPrice,
+                                            signer=signer, artifacts=artifacts)
+                deployer.deploy(to_deploy)
 
             # saving genrated address to a convenient config.json file (update given deploy.json)
             print("Writing updated changes and generated contract addresses in 'deploy/config.json' file...")
@@ -178,5 +142,15 @@ def deployDemoContracts():
                 json.dump(json_data, fp, indent=4)
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Deploy contracts described in 'deploy/deploy.json'.")
+    # 'plan' only prints what would be deployed, 'apply' (default) deploys it
+    parser.add_argument("mode", nargs="?", choices=MODES, default="apply")
+    parser.add_argument("--keystore", help="keystore file of contracts owner, transactions are signed locally")
+    parser.add_argument("--chain", default="ropsten", help="populus chain name")
+    args = parser.parse_args()
+    deployDemoContracts(args.mode, args.keystore, args.chain)
+
+
 if __name__ == "__main__":
-    deployDemoContracts()
+    main()
@@ -1,38 +1,36 @@
-import populus
-from populus.utils.wait import wait_for_transaction_receipt
-from web3 import Web3
+import argparse
 
 import utils
+from chain_context import open_chain
+from gas_oracle import GasPriceOracle
 
 
 
-def performTransfer():
+def performTransfer(chain_name='ropsten', input_addr=None, input_amount=None):
 
-    project = populus.Project()
-
-    chain_name = 'ropsten'
-
-    with project.get_chain(chain_name) as chain:
+    with open_chain(chain_name) as chain:
 
         web3 = chain.web3
 
         DToken = chain.provider.get_contract('DToken')
 
         print("This script will perform transfer of DTokens, if you don't want to transfer tokens, please abort program")
-        input_addr = input("Specify address: ")
-        input_amount = input ("Specify amount: ")
+        if input_addr is None:
+            input_addr = input("Specify address: ")
+        if input_amount is None:
+            input_amount = input ("Specify amount: ")
 
         print("Token will be send: ")
         print("From: {}".format(web3.eth.defaultAccount))
         print("To: {}".format(input_addr))
         print("Value: {}".format(input_amount))
 
-        defaultGasPrice = web3.eth.gasPrice
-        print("Default Gas Price: " + str(defaultGasPrice))
+        # gas price expected to be mined within a block, based on recent blocks
+        gasPrice = GasPriceOracle(web3).suggest("fast")
+        print("Gas Price: " + str(gasPrice))
 
         # call Token transfer as transaction
-        # multiple gas price to get fast confirmations
-        txhash = DToken.transact({'gasPrice': (defaultGasPrice*5)}).transfer(input_addr,int(input_amount))
+        txhash = DToken.transact({'gasPrice': gasPrice}).transfer(input_addr,int(input_amount))
 
         print("Transaction hash: {}".format(txhash))
 
@@ -40,5 +38,14 @@ def performTransfer():
         print("Transaction was confirmed")
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Transfer DTokens from the default account.")
+    parser.add_argument("--chain", default="ropsten", help="populus chain name")
+    parser.add_argument("--to", help="receiver address, asked for when not given")
+    parser.add_argument("--amount", help="amount of tokens, asked for when not given")
+    args = parser.parse_args()
+    performTransfer(args.chain, args.to, args.amount)
+
+
 if __name__ == "__main__":
-    performTransfer()
+    main()
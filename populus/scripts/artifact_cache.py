@@ -0,0 +1,197 @@
+"""
+Content-hashed cache of compiled contract artifacts
+
+The cache key is a hash of all contract sources and compiler settings
+(populus.json, package.json with the pinned openzeppelin version, the solc
+version and the populus version, which provides default settings). Paths
+are hashed relative to the project directory, so the key does not depend on
+the directory a script was started from. On a
+hit the scripts get ABI and bytecode straight from the cache directory, so
+populus never compiles nor loads the whole build at startup. Every contract
+is stored in its own file and read only when it is requested; a small index
+holds precomputed function selectors and event topics of all contracts.
+
+    factory = get_contract_factory(chain, "JoyToken")
+"""
+
+import functools
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+
+
+DEFAULT_SOURCE_DIRS = ["contracts", os.path.join("..", "contracts")]
+DEFAULT_SETTINGS_FILES = ["populus.json", os.path.join("..", "package.json")]
+DEFAULT_CACHE_DIR = ".artifact_cache"
+
+
+@functools.lru_cache(maxsize=None)
+def _solc_version(binary, modified):
+    try:
+        return subprocess.check_output([binary, "--version"], stderr=subprocess.STDOUT, timeout=60).decode()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def compiler_version():
+    """'solc --version' of the binary populus compiles with (SOLC_BINARY), populus version.
+
+    solc is run again only when its binary changes.
+    """
+    binary = shutil.which(os.environ.get("SOLC_BINARY", "solc"))
+    solc = _solc_version(binary, os.stat(binary).st_mtime) if binary else ""
+    try:
+        from importlib import metadata
+
+        populus = metadata.version("populus")
+    except ImportError:
+        # PackageNotFoundError is an ImportError
+        populus = ""
+    return "solc {}\npopulus {}".format(solc.strip(), populus)
+
+
+def sources_hash(source_dirs=DEFAULT_SOURCE_DIRS, settings_files=DEFAULT_SETTINGS_FILES, project_dir=None):
+    """Hash of contract sources and compiler settings.
+
+    :param project_dir: directory of the populus project, source_dirs and settings_files are relative to it;
+                        the current directory by default, as for populus.Project()
+    """
+    project_dir = os.path.abspath(project_dir or os.getcwd())
+    digest = hashlib.sha256()
+    digest.update(compiler_version().encode("utf-8") + b"\0")
+    paths = []
+    for source_dir in source_dirs:
+        paths.extend(glob.glob(os.path.join(project_dir, source_dir, "**", "*.sol"), recursive=True))
+    paths.extend(os.path.join(project_dir, path) for path in settings_files
+                 if os.path.exists(os.path.join(project_dir, path)))
+
+    for path in sorted(set(os.path.normpath(path) for path in paths)):
+        name = os.path.relpath(path, project_dir).replace(os.sep, "/")
+        digest.update(name.encode("utf-8") + b"\0")
+        with open(path, "rb") as source:
+            digest.update(source.read())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def abi_signature(abi_entry):
+    return abi_entry["name"] + "(" + ",".join(i["type"] for i in abi_entry["inputs"]) + ")"
+
+
+def precompute_hashes(abi):
+    """Return (function selectors, event topics) dicts keyed by canonical signature."""
+    from eth_utils import encode_hex, event_abi_to_log_topic, function_abi_to_4byte_selector
+
+    selectors = {abi_signature(entry): encode_hex(function_abi_to_4byte_selector(entry))
+                 for entry in abi if entry.get("type") == "function"}
+    topics = {abi_signature(entry): encode_hex(event_abi_to_log_topic(entry))
+              for entry in abi if entry.get("type") == "event"}
+    return selectors, topics
+
+
+class ArtifactCache:
+    """Compiled contracts stored under cache_dir/<sources hash>/."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, source_dirs=DEFAULT_SOURCE_DIRS,
+                 settings_files=DEFAULT_SETTINGS_FILES, project_dir=None):
+        self.project_dir = os.path.abspath(project_dir or os.getcwd())
+        self.key = sources_hash(source_dirs, settings_files, self.project_dir)
+        self.path = os.path.join(self.project_dir, cache_dir, self.key)
+        self._index = None
+        self._artifacts = {}
+        self._factories = {}  # (id of web3, name) -> (web3, factory)
+
+    def is_warm(self):
+        return os.path.exists(os.path.join(self.path, "index.json"))
+
+    def store(self, compiled_contracts):
+        """Write artifacts of compiled contracts (populus 'compiled_contract_data' format)."""
+        os.makedirs(self.path, exist_ok=True)
+        index = {}
+        for name, data in compiled_contracts.items():
+            artifact = {
+                "abi": data["abi"],
+                "bytecode": data.get("bytecode", ""),
+                "bytecode_runtime": data.get("bytecode_runtime", ""),
+            }
+            selectors, topics = precompute_hashes(data["abi"])
+            index[name] = {"selectors": selectors, "topics": topics}
+
+            with open(os.path.join(self.path, name + ".json"), "w") as fp:
+                json.dump(artifact, fp)
+
+        # index is written last, its presence marks a complete cache entry
+        tmp_path = os.path.join(self.path, "index.json.tmp")
+        with open(tmp_path, "w") as fp:
+            json.dump(index, fp)
+        os.replace(tmp_path, os.path.join(self.path, "index.json"))
+        self._index = index
+
+    def ensure(self, compile_contracts):
+        """Fill the cache using compile_contracts() when it is cold."""
+        if not self.is_warm():
+            print("Artifact cache miss, compiling contracts...")
+            self.store(compile_contracts())
+
+    def index(self):
+        if self._index is None:
+            with open(os.path.join(self.path, "index.json"), "r") as fp:
+                self._index = json.load(fp)
+        return self._index
+
+    def contract_names(self):
+        return sorted(self.index())
+
+    def artifact(self, name):
+        """ABI and bytecode of a single contract, loaded on first use."""
+        if name not in self._artifacts:
+            if name not in self.index():
+                raise KeyError("Contract {} not found in artifact cache".format(name))
+            with open(os.path.join(self.path, name + ".json"), "r") as fp:
+                self._artifacts[name] = json.load(fp)
+        return self._artifacts[name]
+
+    def selectors(self, name):
+        return self.index()[name]["selectors"]
+
+    def topics(self, name):
+        return self.index()[name]["topics"]
+
+    def contract_factory(self, web3, name):
+        """Contract factory of web3, created once per web3 instance."""
+        key = (id(web3), name)
+        if key not in self._factories:
+            artifact = self.artifact(name)
+            factory = web3.eth.contract(abi=artifact["abi"], bytecode=artifact["bytecode"],
+                                        bytecode_runtime=artifact["bytecode_runtime"])
+            # web3 is kept with its factory, so its id can not be reused by another instance
+            self._factories[key] = (web3, factory)
+        return self._factories[key][1]
+
+
+_default_cache = None
+
+
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ArtifactCache()
+    return _default_cache
+
+
+def refresh_default_cache():
+    """Start a new default cache when contract sources changed, for long running processes."""
+    global _default_cache
+    if _default_cache is not None and _default_cache.key != sources_hash():
+        _default_cache = None
+    return default_cache()
+
+
+def get_contract_factory(chain, name, cache=None):
+    """Drop-in replacement of chain.provider.get_contract_factory backed by the artifact cache."""
+    cache = cache or default_cache()
+    cache.ensure(lambda: chain.project.compiled_contract_data)
+    return cache.contract_factory(chain.web3, name)
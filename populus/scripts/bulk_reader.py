@@ -0,0 +1,145 @@
+"""
+Bulk reader of contract state
+
+Reads results of many constant contract functions with chunked JSON-RPC
+batches of eth_call, all pinned to the same block number, so the results are
+consistent and cost one round trip per chunk instead of one per call.
+
+    reader = BulkReader(web3)
+    balances = reader.read([(JoyToken, "balanceOf", [holder]) for holder in holders])
+"""
+
+import json
+
+from eth_abi import decode_abi, encode_abi
+from eth_utils import decode_hex, encode_hex, function_abi_to_4byte_selector
+
+from rpc_batch import batch_request, chunked, RPCError
+
+
+class ContractFunction:
+    """Precomputed selector and ABI types of a single contract function."""
+
+    def __init__(self, fn_abi):
+        self.name = fn_abi["name"]
+        self.selector = function_abi_to_4byte_selector(fn_abi)
+        self.input_types = [i["type"] for i in fn_abi["inputs"]]
+        self.output_types = [o["type"] for o in fn_abi["outputs"]]
+
+    def encode(self, args):
+        return encode_hex(self.selector + encode_abi(self.input_types, args))
+
+    def decode(self, result):
+        values = decode_abi(self.output_types, decode_hex(result))
+        values = [value.decode("utf-8") if abi_type == "string" and isinstance(value, bytes) else value
+                  for abi_type, value in zip(self.output_types, values)]
+        if len(values) == 1:
+            return values[0]
+        return tuple(values)
+
+
+def contract_target(contract):
+    """Return (abi, address) of contract instance or (contract factory, address) tuple."""
+    if isinstance(contract, tuple):
+        factory, address = contract
+        return factory.abi, address
+    return contract.abi, contract.address
+
+
+class BulkReader:
+    """Executes many eth_call reads in JSON-RPC batches pinned to one block.
+
+    :param block: block number to read from, current head is used when not given
+    :param batch_size: number of calls sent in one batch request
+    :param cache: optional call_cache.CallCache, only calls missing in the cache are sent
+    """
+
+    def __init__(self, web3, block=None, batch_size=500, cache=None):
+        self.web3 = web3
+        self.block = block
+        self.batch_size = batch_size
+        self.cache = cache
+        self.functions = {}  # function ABI as JSON -> ContractFunction
+        # (id(abi), name, number of arguments) -> (abi, ContractFunction), the kept ABI keeps its id unique
+        self.resolved = {}
+
+    def function(self, abi, name, args):
+        key = (id(abi), name, len(args))
+        entry = self.resolved.get(key)
+        if entry is not None:
+            return entry[1]
+
+        # overloaded functions are distinguished by number of arguments
+        candidates = [fn for fn in abi if fn.get("type") == "function"
+                      and fn["name"] == name and len(fn["inputs"]) == len(args)]
+        if len(candidates) != 1:
+            raise ValueError("Cannot find unique function {} with {} arguments".format(name, len(args)))
+        # keyed by content, equal functions of different ABI objects share the computed selector
+        content = json.dumps(candidates[0], sort_keys=True)
+        if content not in self.functions:
+            self.functions[content] = ContractFunction(candidates[0])
+        self.resolved[key] = (abi, self.functions[content])
+        return self.functions[content]
+
+    def pin_block(self):
+        if self.block is None:
+            self.block = int(batch_request(self.web3, [("eth_blockNumber", [])])[0], 16)
+        return self.block
+
+    def read(self, calls, raise_errors=True):
+        """Execute calls given as (contract, method, args) tuples.
+
+        :param raise_errors: raise RPCError for the first reverted call,
+                             otherwise RPCError instances are returned in place of results
+        :return: list of decoded results in order of calls
+        """
+        block = hex(self.pin_block())
+
+        encoded = []
+        for contract, method, args in calls:
+            abi, address = contract_target(contract)
+            function = self.function(abi, method, args)
+            encoded.append((function, {"to": address, "data": function.encode(args)}))
+
+        results = [None] * len(encoded)
+        missing = []
+        for position, (function, transaction) in enumerate(encoded):
+            cached = self.cache.lookup(transaction, block) if self.cache is not None else None
+            if cached is None:
+                missing.append(position)
+            else:
+                results[position] = function.decode(cached)
+
+        for chunk in chunked(missing, self.batch_size):
+            responses = batch_request(self.web3, [("eth_call", [encoded[position][1], block]) for position in chunk],
+                                      raise_errors=raise_errors)
+            for position, response in zip(chunk, responses):
+                function, transaction = encoded[position]
+                if isinstance(response, RPCError):
+                    results[position] = response
+                    continue
+                if self.cache is not None:
+                    self.cache.store(transaction, block, response)
+                results[position] = function.decode(response)
+        return results
+
+    def read_one(self, contract, method, *args):
+        return self.read([(contract, method, list(args))])[0]
+
+
+def balances_of(web3, token, holders, block=None, batch_size=500):
+    """Read balanceOf of all holders at the same block.
+
+    :return: dict holder -> balance
+    """
+    reader = BulkReader(web3, block=block, batch_size=batch_size)
+    return dict(zip(holders, reader.read([(token, "balanceOf", [holder]) for holder in holders])))
+
+
+def deposit_balances_of(web3, deposit, players, block=None, batch_size=500):
+    """Read balanceOfPlayer of all players from PlatformDeposit at the same block.
+
+    :return: dict player -> deposit balance
+    """
+    reader = BulkReader(web3, block=block, batch_size=batch_size)
+    return dict(zip(players, reader.read([(deposit, "balanceOfPlayer", [player]) for player in players])))
@@ -0,0 +1,463 @@
+"""
+Resumable bulk token transfer
+
+Recipients are streamed from a CSV file with rows 'address,amount[,data]'.
+Transfers are submitted with locally managed nonces, keeping up to
+'max_in_flight' transactions waiting for confirmation at the same time. With a
+local signer, rows filling all free slots are signed and sent in one batch.
+
+Every submission and confirmation is appended to a journal file (JSON lines)
+before moving on, so after a crash the tool can be started again with the same
+arguments. Rows are never sent with a new nonce once a nonce was assigned to
+them: resubmitting with the same nonce either sends the original transaction
+again or is rejected by the node, so one row can not be paid twice.
+
+Supported modes:
+ - transfer        JoyToken transfer(to, value)
+ - erc223          JoyTokenUpgraded transfer(to, value, data)
+ - transferToGame  JoyTokenUpgraded transferToGame(deposit, game, value, data), csv address is a game
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+
+from artifact_cache import get_contract_factory
+from chain_context import open_chain
+from rpc_batch import poll_receipts, batch_request, to_int, RPCError
+from rpc_metrics import instrument_from_env
+from signer import keystore_signer
+from utils import is_successful_receipt
+from gas_oracle import GasPriceOracle, STRATEGIES, rebid_stuck
+
+
+MODES = ("transfer", "erc223", "transferToGame")
+
+# send errors meaning that a transaction with the nonce is already pending or mined
+NONCE_USED = ("nonce too low", "already known", "known transaction", "replacement transaction underpriced")
+
+
+class JournalMismatch(Exception):
+    """Journal was written for different recipients file or sender."""
+
+
+class NonceGap(Exception):
+    """A row could not be sent and its unused nonce blocks all transactions sent after it."""
+
+
+def nonce_used(error):
+    return any(text in str(error).lower() for text in NONCE_USED)
+
+
+def read_recipients(csv_path):
+    """Stream rows of recipients file as (row number, address, amount, data)."""
+    with open(csv_path, "r", newline="") as csv_file:
+        for row_number, row in enumerate(csv.reader(csv_file)):
+            if not row or row[0].startswith("#"):
+                continue
+            data = row[2] if len(row) > 2 else ""
+            yield row_number, row[0].strip(), int(row[1]), data
+
+
+class TransferJournal:
+    """Append-only journal of submitted and confirmed transfers."""
+
+    def __init__(self, path):
+        self.path = path
+        self.submitted = {}  # row -> submit record
+        self.confirmed = {}  # row -> confirm record
+
+        if os.path.exists(path):
+            with open(path, "r") as journal:
+                for line in journal:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record["type"] == "submit":
+                        self.submitted[record["row"]] = record
+                    elif record["type"] == "confirm":
+                        self.confirmed[record["row"]] = record
+
+        self.file = open(path, "a")
+
+    def append(self, record):
+        self.file.write(json.dumps(record, sort_keys=True) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def record_submit(self, row, address, amount, data, nonce, txhash):
+        record = {"type": "submit", "row": row, "to": address, "value": str(amount), "data": data,
+                  "nonce": nonce, "txhash": txhash}
+        self.submitted[row] = record
+        self.append(record)
+
+    def record_confirm(self, row, txhash, receipt):
+        record = {"type": "confirm", "row": row, "txhash": txhash, "status": int(is_successful_receipt(receipt)),
+                  "block": receipt["blockNumber"]}
+        self.confirmed[row] = record
+        self.append(record)
+
+    def check_row(self, row, address, amount):
+        record = self.submitted.get(row)
+        if record and (record["to"].lower() != address.lower() or record["value"] != str(amount)):
+            raise JournalMismatch("Row {} differs from journal: {} {} vs {} {}".format(
+                row, address, amount, record["to"], record["value"]))
+
+    def unconfirmed(self):
+        return [record for row, record in sorted(self.submitted.items()) if row not in self.confirmed]
+
+    def max_nonce(self):
+        return max((record["nonce"] for record in self.submitted.values()), default=-1)
+
+    def close(self):
+        self.file.close()
+
+
+class BulkTransfer:
+    """Pipelined token transfers from one sender account.
+
+    :param token_factory: populus contract factory of the token
+    :param token_address: address of deployed token
+    :param deposit: GameDeposit address, required in 'transferToGame' mode
+    :param oracle: GasPriceOracle used when gas_price is not given
+    :param rebid_after: replace transactions not mined within that many blocks
+    :param signer: signer.TransactionSigner holding the sender key, transactions are signed locally
+    :param timeout: seconds without any confirmation before the run gives up, the journal allows to resume it
+    """
+
+    def __init__(self, web3, token_factory, token_address, sender, journal, mode="transfer", deposit=None,
+                 max_in_flight=50, gas=None, gas_price=None, oracle=None, gas_strategy="standard",
+                 rebid_after=None, signer=None, timeout=1800):
+        if mode not in MODES:
+            raise ValueError("Unsupported mode: " + mode)
+        if mode == "transferToGame" and not deposit:
+            raise ValueError("transferToGame mode requires deposit address")
+
+        self.web3 = web3
+        self.token_factory = token_factory
+        self.token_address = token_address
+        self.sender = sender
+        self.journal = journal
+        self.mode = mode
+        self.deposit = deposit
+        self.max_in_flight = max_in_flight
+        self.gas = gas
+        self.gas_price = gas_price
+        self.oracle = oracle
+        self.gas_strategy = gas_strategy
+        self.rebid_after = rebid_after
+        self.signer = signer
+        self.timeout = timeout
+        # replaced transactions keep their old hashes here, either of them can be mined
+        self.in_flight = {}  # txhash -> row
+        self.submitted_block = {}  # txhash -> head block at submission
+        self.next_nonce = None
+        self.failed = []
+        self.review = []
+        self.unsent = {}  # nonce -> row whose resubmission failed, the nonce is not used
+
+    def transaction(self, nonce):
+        transaction = {"from": self.sender, "to": self.token_address, "nonce": nonce}
+        if self.gas:
+            transaction["gas"] = self.gas
+        if self.gas_price:
+            transaction["gasPrice"] = self.gas_price
+        elif self.oracle:
+            transaction["gasPrice"] = self.oracle.suggest(self.gas_strategy)
+        return transaction
+
+    def arguments(self, address, amount, data):
+        if self.mode == "transfer":
+            return "transfer", [address, amount]
+        if self.mode == "erc223":
+            return "transfer", [address, amount, data]
+        return "transferToGame", [self.deposit, address, amount, data]
+
+    def send_signed(self, rows):
+        """Sign transfers of (nonce, address, amount, data) rows and send them in one batch.
+
+        :return: list of txhash or RPCError
+        """
+        transactions = []
+        for nonce, address, amount, data in rows:
+            fn_name, args = self.arguments(address, amount, data)
+            transaction = self.transaction(nonce)
+            transaction["data"] = self.token_factory.encodeABI(fn_name=fn_name, args=args)
+            transactions.append(transaction)
+        if self.gas is None:
+            # rows resubmitted by resume() are sent before run() estimates gas, the signer needs it
+            estimate = batch_request(self.web3, [("eth_estimateGas", [{"from": self.sender, "to": self.token_address,
+                                                                       "data": transactions[0]["data"]}])])[0]
+            self.gas = int(to_int(estimate) * 1.2)
+        gas_price = None
+        for transaction in transactions:
+            transaction["gas"] = self.gas
+            if "gasPrice" not in transaction:
+                gas_price = gas_price or self.web3.eth.gasPrice
+                transaction["gasPrice"] = gas_price
+        return self.signer.send(self.web3, transactions)
+
+    def send(self, nonce, address, amount, data):
+        if self.signer is not None:
+            result = self.send_signed([(nonce, address, amount, data)])[0]
+            if isinstance(result, RPCError):
+                raise result
+            return result
+        token = self.token_factory.transact(self.transaction(nonce))
+        if self.mode == "transfer":
+            return token.transfer(address, amount)
+        if self.mode == "erc223":
+            return token.transfer(address, amount, data)
+        return token.transferToGame(self.deposit, address, amount, data)
+
+    def estimate_gas(self, address, amount, data):
+        # all rows cost about the same, estimate once instead of per transaction
+        if self.gas is None:
+            token = self.token_factory.estimateGas({"from": self.sender, "to": self.token_address})
+            if self.mode == "transfer":
+                estimate = token.transfer(address, amount)
+            elif self.mode == "erc223":
+                estimate = token.transfer(address, amount, data)
+            else:
+                estimate = token.transferToGame(self.deposit, address, amount, data)
+            self.gas = int(estimate * 1.2)
+
+    def wait_for_slot(self, limit):
+        # block until less than limit transactions are waiting for confirmation
+        interval = 0.5
+        deadline = time.time() + self.timeout
+        while len(set(self.in_flight.values())) >= max(limit, 1):
+            self.check_gaps()
+            if time.time() > deadline:
+                raise TimeoutError("No transaction confirmed in {} seconds, rows in flight: {}".format(
+                    self.timeout, sorted(set(self.in_flight.values()))))
+            receipts = poll_receipts(self.web3, list(self.in_flight))
+            if receipts:
+                deadline = time.time() + self.timeout
+            for txhash, receipt in receipts.items():
+                row = self.in_flight[txhash]
+                self.forget_row(row)
+                self.journal.record_confirm(row, txhash, receipt)
+                if not is_successful_receipt(receipt):
+                    self.failed.append(row)
+                    print("Transfer in row {} failed, txhash: {}".format(row, txhash))
+            if not receipts:
+                self.rebid()
+                time.sleep(interval)
+                interval = min(interval * 1.5, 8)
+
+    def check_gaps(self):
+        """Fail when an unused nonce lies below a nonce in flight, nothing after it can be mined."""
+        if not self.unsent or not self.in_flight:
+            return
+        highest = max(self.journal.submitted[row]["nonce"] for row in set(self.in_flight.values()))
+        gaps = sorted(nonce for nonce in self.unsent if nonce < highest)
+        if gaps:
+            raise NonceGap("Rows {} were not sent, their nonces {} block the transactions after them; "
+                           "fix the cause and run again to resend them".format([self.unsent[nonce] for nonce in gaps],
+                                                                               gaps))
+
+    def forget_row(self, row):
+        for txhash in [txhash for txhash, in_flight_row in self.in_flight.items() if in_flight_row == row]:
+            del self.in_flight[txhash]
+            self.submitted_block.pop(txhash, None)
+
+    def rebid(self):
+        # replace transactions stuck for too long, using the same nonce and higher gas price
+        if not self.rebid_after or not self.oracle:
+            return
+
+        latest = {}
+        for txhash, row in self.in_flight.items():
+            if self.submitted_block.get(txhash, -1) >= self.submitted_block.get(latest.get(row), -1):
+                latest[row] = txhash
+
+        replaced, dropped = rebid_stuck(self.oracle, list(latest.values()), self.submitted_block, self.rebid_after,
+                                        signer=self.signer)
+        for old_txhash, new_txhash in replaced.items():
+            row = self.in_flight[old_txhash]
+            record = self.journal.submitted[row]
+            self.journal.record_submit(row, record["to"], int(record["value"]), record["data"], record["nonce"],
+                                       new_txhash)
+            self.in_flight[new_txhash] = row
+            self.submitted_block[new_txhash] = self.oracle.head
+
+        for txhash in dropped:
+            row = self.in_flight.pop(txhash)
+            self.submitted_block.pop(txhash, None)
+            record = self.journal.submitted[row]
+            try:
+                new_txhash = self.submit(row, record["to"], int(record["value"]), record["data"], record["nonce"])
+            except ValueError as error:
+                if row in self.in_flight.values():
+                    # an older transaction of the row keeps the nonce, its receipt is awaited
+                    continue
+                if not nonce_used(error):
+                    print("Row {} can not be resent (nonce {}): {}".format(row, record["nonce"], error))
+                    self.unsent[record["nonce"]] = row
+                else:
+                    # nonce was used by a transaction we do not know about
+                    print("Row {} needs manual review (nonce {}): {}".format(row, record["nonce"], error))
+                    self.review.append(row)
+                continue
+            print("Row {}: dropped, resent with nonce {}, txhash: {}".format(row, record["nonce"], new_txhash))
+
+    def submit(self, row, address, amount, data, nonce):
+        # nonce is reserved in the journal before sending, so a crash during send can not lead to a second nonce
+        self.journal.record_submit(row, address, amount, data, nonce, None)
+        txhash = self.send(nonce, address, amount, data)
+        self.journal.record_submit(row, address, amount, data, nonce, txhash)
+        self.in_flight[txhash] = row
+        if self.oracle:
+            self.submitted_block[txhash] = self.oracle.head
+        return txhash
+
+    def submit_window(self, rows):
+        """Sign (row, address, amount, data, nonce) rows and send them in one batch.
+
+        Rows sent before the first failed one stay in flight, the error is raised after them.
+        """
+        for row, address, amount, data, nonce in rows:
+            self.journal.record_submit(row, address, amount, data, nonce, None)
+        results = self.send_signed([(nonce, address, amount, data) for row, address, amount, data, nonce in rows])
+
+        error = None
+        for (row, address, amount, data, nonce), result in zip(rows, results):
+            if isinstance(result, RPCError):
+                error = error or result
+                continue
+            self.journal.record_submit(row, address, amount, data, nonce, result)
+            self.in_flight[result] = row
+            if self.oracle:
+                self.submitted_block[result] = self.oracle.head
+            print("Row {}: {} -> {} (nonce {}), txhash: {}".format(row, amount, address, nonce, result))
+        if error is not None:
+            raise error
+
+    def resume(self):
+        """Handle rows submitted before crash but not confirmed."""
+        unconfirmed = self.journal.unconfirmed()
+        if not unconfirmed:
+            return
+
+        sent = [record for record in unconfirmed if record["txhash"]]
+        known = batch_request(self.web3, [("eth_getTransactionByHash", [record["txhash"]]) for record in sent])
+        known = {record["row"]: transaction for record, transaction in zip(sent, known)}
+
+        for record in unconfirmed:
+            if known.get(record["row"]) is not None:
+                # still pending or mined, just wait for it
+                self.in_flight[record["txhash"]] = record["row"]
+                if self.oracle:
+                    self.submitted_block[record["txhash"]] = self.oracle.head or 0
+                continue
+
+            # transaction was dropped or its hash was not saved, send it again with the same nonce
+            try:
+                txhash = self.submit(record["row"], record["to"], int(record["value"]), record["data"],
+                                     record["nonce"])
+            except ValueError as error:
+                if not nonce_used(error):
+                    print("Row {} can not be resent (nonce {}): {}".format(record["row"], record["nonce"], error))
+                    self.unsent[record["nonce"]] = record["row"]
+                    continue
+                # nonce already used, can not tell if this payment went through
+                print("Row {} needs manual review (nonce {}): {}".format(record["row"], record["nonce"], error))
+                self.review.append(record["row"])
+                continue
+            print("Row {}: resubmitted with nonce {}, txhash: {}".format(record["row"], record["nonce"], txhash))
+
+    def new_rows(self, recipients):
+        """Rows of recipients not present in the journal, every row is checked against it."""
+        for row, address, amount, data in recipients:
+            self.journal.check_row(row, address, amount)
+            if row not in self.journal.submitted:
+                yield row, address, amount, data
+
+    def run(self, recipients):
+        """Transfer tokens to all recipients, skipping rows already present in the journal."""
+        if self.oracle:
+            self.oracle.refresh(force=True)
+        self.resume()
+
+        pending_nonce = self.web3.eth.getTransactionCount(self.sender, 'pending')
+        self.next_nonce = max(pending_nonce, self.journal.max_nonce() + 1)
+
+        rows = self.new_rows(recipients)
+        while True:
+            self.wait_for_slot(self.max_in_flight)
+            size = 1
+            if self.signer is not None:
+                # sign and send rows for all free slots at once
+                size = max(self.max_in_flight - len(set(self.in_flight.values())), 1)
+            window = [(row, address, amount, data, self.next_nonce + offset)
+                      for offset, (row, address, amount, data) in enumerate(itertools.islice(rows, size))]
+            if not window:
+                break
+
+            self.estimate_gas(*window[0][1:4])
+            self.next_nonce += len(window)
+            if self.signer is not None:
+                self.submit_window(window)
+                continue
+            row, address, amount, data, nonce = window[0]
+            txhash = self.submit(row, address, amount, data, nonce)
+            print("Row {}: {} -> {} (nonce {}), txhash: {}".format(row, amount, address, nonce, txhash))
+
+        self.wait_for_slot(1)
+
+        succeeded = sum(record["status"] for record in self.journal.confirmed.values())
+        print("Confirmed: {}, failed in this run: {}, needs review: {}, not sent: {}".format(
+            succeeded, len(self.failed), len(self.review), len(self.unsent)))
+        return self.failed, self.review
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transfer JoyTokens to many recipients listed in CSV file.")
+    parser.add_argument("recipients", help="CSV file with 'address,amount[,data]' rows")
+    parser.add_argument("--chain", default="ropsten", help="populus chain name")
+    parser.add_argument("--mode", choices=MODES, default="transfer")
+    parser.add_argument("--token", required=True, help="token contract address")
+    parser.add_argument("--deposit", help="GameDeposit address for transferToGame mode")
+    parser.add_argument("--sender", help="sender account, web3 default account when not given")
+    parser.add_argument("--journal", help="journal file, '<recipients>.journal' by default")
+    parser.add_argument("--in-flight", type=int, default=50, help="maximum number of unconfirmed transactions")
+    parser.add_argument("--timeout", type=int, default=1800,
+                        help="seconds without any confirmation before giving up, run again to resume")
+    parser.add_argument("--gas", type=int, help="gas limit of every transaction")
+    parser.add_argument("--gas-price", type=int, help="gas price in wei, suggested from recent blocks when not given")
+    parser.add_argument("--gas-strategy", choices=sorted(STRATEGIES), default="standard")
+    parser.add_argument("--rebid-after", type=int, metavar="BLOCKS",
+                        help="replace transactions not mined within given number of blocks")
+    parser.add_argument("--keystore", help="keystore file of the sender, transactions are signed locally")
+    args = parser.parse_args()
+
+    with open_chain(args.chain) as chain:
+        web3 = chain.web3
+        instrument_from_env(web3)
+        contract_name = "JoyToken" if args.mode == "transfer" else "JoyTokenUpgraded"
+        token_factory = get_contract_factory(chain, contract_name)
+
+        signer = keystore_signer([args.keystore]) if args.keystore else None
+        sender = args.sender or (signer.addresses[0] if signer else web3.eth.defaultAccount)
+
+        journal = TransferJournal(args.journal or args.recipients + ".journal")
+        try:
+            bulk = BulkTransfer(web3, token_factory, args.token, sender, journal,
+                                mode=args.mode, deposit=args.deposit, max_in_flight=args.in_flight,
+                                gas=args.gas, gas_price=args.gas_price, oracle=GasPriceOracle(web3),
+                                gas_strategy=args.gas_strategy, rebid_after=args.rebid_after, signer=signer,
+                                timeout=args.timeout)
+            failed, review = bulk.run(read_recipients(args.recipients))
+        finally:
+            journal.close()
+
+        if failed or review:
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Block-aware cache of eth_call responses
+
+Two tiers:
+
+- immutable tier: getters that never change after deployment (token name,
+  symbol, decimals and the addresses linked in constructors). Keyed by
+  (contract, call data) and kept for the life of the process. owner() is not
+  one of them, GameDeposit and JoyGamePlatform can transferOwnership. An empty
+  "0x" result (no code at the address yet) is not kept.
+- state tier: every other read, e.g. balanceOf, balanceOfPlayer or
+  openSessions. LRU keyed by (block number, contract, call data, caller)
+  within a memory budget. Calls at "latest" are keyed by the current head and
+  dropped when a new head arrives; calls at an explicit block number stay
+  until they are evicted.
+
+The head is taken from eth_blockNumber responses seen by the cache and
+refreshed at most once per head_ttl seconds, so a burst of calls costs one
+eth_blockNumber instead of one request per call. A sent transaction makes
+the next call at "latest" ask for the head again, a receipt of a newer block
+moves the head. Calls at "pending" and error responses are never cached.
+
+    cache = install(web3)
+    ...
+    print(cache.stats())
+
+chain_context.open_chain installs a cache on every chain it opens when
+JOY_CALL_CACHE is set (JOY_CALL_CACHE_MB sets the state tier budget), under
+the joy daemon the cache of a warm chain is kept between commands.
+"""
+
+import collections
+import json
+import os
+import weakref
+import threading
+import time
+
+
+# selector -> signature of getters that do not change after deployment
+IMMUTABLE_GETTERS = {
+    "0x06fdde03": "name()",
+    "0x95d89b41": "symbol()",
+    "0x313ce567": "decimals()",
+    "0x938a37ed": "gameDev()",
+    "0x5d827459": "m_playersDeposit()",
+    "0xb602bf01": "m_supportedToken()",
+    "0x42277097": "platformReserve()",
+    "0xedc5a672": "m_JoyToken()",
+}
+
+# methods after which state read at "latest" may change
+SEND_METHODS = ("eth_sendTransaction", "eth_sendRawTransaction")
+
+# approximate bytes taken by a cached entry besides its key and result strings
+ENTRY_OVERHEAD = 200
+
+
+def block_key(block_identifier):
+    """Block number of explicit block identifier, None for tags."""
+    if isinstance(block_identifier, int):
+        return block_identifier
+    if isinstance(block_identifier, str) and block_identifier.startswith("0x"):
+        return int(block_identifier, 16)
+    return None
+
+
+class CallCache:
+    """Thread safe two tier cache of eth_call results.
+
+    :param max_bytes: memory budget of the state tier
+    :param head_ttl: seconds the known head is trusted before eth_blockNumber is asked again
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, head_ttl=1.0, immutable_selectors=IMMUTABLE_GETTERS):
+        self.immutable_selectors = set(immutable_selectors)
+        self.immutable = {}  # (to, data) -> result
+        self.state = collections.OrderedDict()  # (block, to, data, other fields) -> (result, size), LRU order
+        self.latest_keys = set()  # state keys cached for "latest", dropped on new head
+        self.max_bytes = max_bytes
+        self.state_bytes = 0
+        self.head = None
+        self.head_time = 0.0
+        self.head_ttl = head_ttl
+        self.lock = threading.Lock()
+
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+        self.evictions = 0
+
+    def add_immutable(self, selectors):
+        """Mark more getters as immutable, selectors is a dict signature -> selector (as in ArtifactCache)."""
+        self.immutable_selectors.update(selector.lower() for selector in selectors.values())
+
+    # ---------------------------------------- head ----------------------------------------
+
+    def new_head(self, number):
+        """Drop state cached for "latest" when the head moves."""
+        with self.lock:
+            self.head_time = time.monotonic()
+            if number == self.head:
+                return
+            self.head = number
+            for key in self.latest_keys:
+                entry = self.state.pop(key, None)
+                if entry is not None:
+                    self.state_bytes -= entry[1]
+            self.latest_keys.clear()
+
+    def head_is_fresh(self):
+        return self.head is not None and time.monotonic() - self.head_time < self.head_ttl
+
+    def expire_head(self):
+        """Ask for the head before the next state lookup, e.g. after a transaction was sent."""
+        with self.lock:
+            self.head_time = 0.0
+
+    # ---------------------------------------- lookups ----------------------------------------
+
+    def key(self, transaction, block_identifier):
+        """Return (tier, key) of the call, tier is None for calls that are not cached."""
+        if not isinstance(transaction, dict) or not transaction.get("to"):
+            return None, None
+        data = transaction.get("data") or "0x"
+        if isinstance(data, (bytes, bytearray)):
+            data = "0x" + bytes(data).hex()
+        to = transaction["to"].lower()
+        data = data.lower()
+
+        if data[:10] in self.immutable_selectors and len(data) == 10:
+            return "immutable", (to, data)
+
+        block = block_key(block_identifier)
+        if block is None:
+            if block_identifier not in (None, "latest") or self.head is None:
+                return None, None
+            block = self.head
+        # everything else in the transaction (caller, gas, value) can change the result
+        extra = json.dumps({k: v for k, v in transaction.items() if k not in ("to", "data")},
+                           sort_keys=True, default=str)
+        return "state", (block, to, data, extra)
+
+    def get(self, tier, key):
+        with self.lock:
+            if tier == "immutable":
+                result = self.immutable.get(key)
+            else:
+                entry = self.state.get(key)
+                result = None
+                if entry is not None:
+                    self.state.move_to_end(key)
+                    result = entry[0]
+            if result is None:
+                self.misses[tier] += 1
+            else:
+                self.hits[tier] += 1
+            return result
+
+    def put(self, tier, key, result, latest=False):
+        with self.lock:
+            if tier == "immutable":
+                if result != "0x":
+                    self.immutable[key] = result
+                return
+            if latest and key[0] != self.head:
+                # head moved while the call was in flight
+                return
+
+            size = ENTRY_OVERHEAD + len(key[1]) + len(key[2]) + len(key[3]) + len(result)
+            if size > self.max_bytes:
+                return
+            previous = self.state.pop(key, None)
+            if previous is not None:
+                self.state_bytes -= previous[1]
+            self.state[key] = (result, size)
+            self.state_bytes += size
+            if latest:
+                self.latest_keys.add(key)
+
+            while self.state_bytes > self.max_bytes:
+                old_key, (_, old_size) = self.state.popitem(last=False)
+                self.latest_keys.discard(old_key)
+                self.state_bytes -= old_size
+                self.evictions += 1
+
+    def lookup(self, transaction, block_identifier):
+        """Cached result of eth_call with given params, None on a miss."""
+        tier, key = self.key(transaction, block_identifier)
+        return None if tier is None else self.get(tier, key)
+
+    def store(self, transaction, block_identifier, result):
+        tier, key = self.key(transaction, block_identifier)
+        if tier is not None:
+            self.put(tier, key, result, latest=block_key(block_identifier) is None)
+
+    def clear(self):
+        """Drop the state tier, e.g. after a chain reorganization."""
+        with self.lock:
+            self.state.clear()
+            self.latest_keys.clear()
+            self.state_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "immutable": {"entries": len(self.immutable), "hits": self.hits["immutable"],
+                              "misses": self.misses["immutable"]},
+                "state": {"entries": len(self.state), "bytes": self.state_bytes, "max_bytes": self.max_bytes,
+                          "hits": self.hits["state"], "misses": self.misses["state"],
+                          "evictions": self.evictions},
+                "head": self.head,
+            }
+
+    # ---------------------------------------- web3 ----------------------------------------
+
+    def observe_head(self, response):
+        """Take the head from eth_blockNumber response."""
+        if response.get("result") is not None:
+            self.new_head(block_key(response["result"]))
+        return response
+
+    def middleware(self, make_request, web3):
+        """web3 middleware answering eth_call from the cache."""
+        def middleware(method, params):
+            if method == "eth_blockNumber":
+                return self.observe_head(make_request(method, params))
+
+            if method in SEND_METHODS:
+                self.expire_head()
+                return make_request(method, params)
+
+            if method == "eth_getTransactionReceipt":
+                response = make_request(method, params)
+                receipt = response.get("result")
+                if isinstance(receipt, dict) and receipt.get("blockNumber") is not None:
+                    number = block_key(receipt["blockNumber"])
+                    if self.head is None or number > self.head:
+                        self.new_head(number)
+                return response
+
+            if method != "eth_call" or not params:
+                return make_request(method, params)
+
+            block_identifier = params[1] if len(params) > 1 else "latest"
+            latest = block_key(block_identifier) is None
+            tier, key = self.key(params[0], block_identifier)
+            if tier != "immutable" and block_identifier in (None, "latest") and not self.head_is_fresh():
+                # immutable results do not depend on the head, only state lookups refresh it
+                self.observe_head(make_request("eth_blockNumber", []))
+                tier, key = self.key(params[0], block_identifier)
+            if tier is None:
+                return make_request(method, params)
+
+            result = self.get(tier, key)
+            if result is not None:
+                return {"jsonrpc": "2.0", "id": -1, "result": result}
+
+            response = make_request(method, params)
+            if "error" not in response and isinstance(response.get("result"), str):
+                self.put(tier, key, response["result"], latest=latest)
+            return response
+        return middleware
+
+
+def remove_cache(web3):
+    """Remove the cache middleware installed by install()."""
+    stack = getattr(web3, "middleware_stack", None)
+    if stack is not None:
+        if "call_cache" in stack:
+            stack.remove("call_cache")
+        return
+    # web3 v3 has no named middlewares, cache middleware is a bound method of CallCache
+    middlewares = web3.manager.middlewares
+    middlewares[:] = [middleware for middleware in middlewares
+                      if not isinstance(getattr(middleware, "__self__", None), CallCache)]
+
+
+def install(web3, cache=None):
+    """Answer eth_call requests of web3 from cache (a new CallCache by default).
+
+    Installing again, e.g. on a warm web3 of the joy daemon, replaces the previous cache.
+    """
+    cache = cache or CallCache()
+    remove_cache(web3)
+    stack = getattr(web3, "middleware_stack", None)
+    if stack is not None:
+        stack.add(cache.middleware, name="call_cache")
+    else:
+        web3.add_middleware(cache.middleware)
+    return cache
+
+
+_env_caches = weakref.WeakKeyDictionary()  # web3 -> CallCache installed by install_from_env
+
+
+def install_from_env(web3):
+    """Install a cache on web3 when JOY_CALL_CACHE is set, remove it otherwise.
+
+    A web3 that already has its cache keeps it, so warm chains of the joy daemon
+    answer repeated reads across commands.
+    :return: CallCache or None when disabled
+    """
+    if os.environ.get("JOY_CALL_CACHE", "") in ("", "0"):
+        if _env_caches.pop(web3, None) is not None:
+            remove_cache(web3)
+        return None
+    if web3 not in _env_caches:
+        megabytes = float(os.environ.get("JOY_CALL_CACHE_MB", "32"))
+        _env_caches[web3] = install(web3, CallCache(max_bytes=int(megabytes * 1024 * 1024)))
+    return _env_caches[web3]
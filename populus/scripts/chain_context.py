@@ -0,0 +1,91 @@
+"""
+Populus chain shared by the tools
+
+Tools open their chain with 'open_chain(name)' instead of building
+'populus.Project()' and entering 'project.get_chain(name)' themselves. A
+standalone run does exactly that; inside the joy daemon (scripts/joy.py) the
+project is loaded once and every chain stays open after the first command
+that used it, so later commands skip configuration, connection and artifact
+loading. When JOY_RPC_ENDPOINTS lists nodes, opened chains send their
+requests through the process wide pooled provider of these nodes
+(provider_pool.py). When JOY_CALL_CACHE is set, contract reads of opened
+chains are answered from a call cache (call_cache.py), kept with the chain
+while it stays warm.
+
+    with open_chain(args.chain) as chain:
+        web3 = chain.web3
+"""
+
+import contextlib
+import threading
+
+import call_cache
+import provider_pool
+
+
+class WarmChains:
+    """Populus project and chains kept open for the lifetime of the process."""
+
+    def __init__(self):
+        self.project = None
+        self.chains = {}  # name -> entered chain
+        self.lock = threading.Lock()
+
+    def get(self, chain_name):
+        with self.lock:
+            if chain_name not in self.chains:
+                if self.project is None:
+                    import populus
+
+                    self.project = populus.Project()
+                chain = self.project.get_chain(chain_name).__enter__()
+                provider_pool.install_from_env(chain.web3)
+                self.chains[chain_name] = chain
+            return self.chains[chain_name]
+
+    def names(self):
+        return sorted(self.chains)
+
+    def close(self):
+        with self.lock:
+            for chain in self.chains.values():
+                chain.__exit__(None, None, None)
+            self.chains.clear()
+
+
+# set in the daemon process, None in standalone runs
+_warm = None
+
+
+def keep_warm():
+    """Keep chains opened by open_chain for the rest of the process."""
+    global _warm
+    if _warm is None:
+        _warm = WarmChains()
+    return _warm
+
+
+def release_warm():
+    global _warm
+    if _warm is not None:
+        _warm.close()
+        _warm = None
+
+
+@contextlib.contextmanager
+def open_chain(chain_name):
+    """Context with the populus chain of given name, a warm one when the process keeps them."""
+    if _warm is not None:
+        chain = _warm.get(chain_name)
+        # JOY_CALL_CACHE of this command
+        call_cache.install_from_env(chain.web3)
+        yield chain
+        return
+
+    import populus
+
+    project = populus.Project()
+    with project.get_chain(chain_name) as chain:
+        provider_pool.install_from_env(chain.web3)
+        call_cache.install_from_env(chain.web3)
+        yield chain
@@ -0,0 +1,298 @@
+"""
+Reorg-aware tracking of transaction confirmations
+
+One tracker per process follows new heads with a single poll loop and
+resolves every tracked transaction, each with its own confirmation depth,
+against the blocks it sees: each new block
+is fetched once (transaction hashes only) and matched with the pending set,
+so the RPC load does not grow with the number of tracked transactions.
+Receipts are fetched only for transactions that reached the requested number
+of confirmations, in one batch.
+
+Hashes of recent blocks are remembered. When a new head does not build on
+them, blocks of the abandoned branch are forgotten and transactions included
+in them go back to pending; on_reorg callback tells the caller, who may
+resubmit. A transaction included again in the new branch is confirmed as
+usual.
+
+    tracker = shared_tracker(web3)
+    future = tracker.track(txhash, confirmations=12, on_reorg=lambda txhash, block: ...)
+    receipt = future.result(timeout=600)
+
+Node errors of the poll loop are retried on the next tick and logged through
+the "confirmation_tracker" logger, configured by the calling tool.
+"""
+
+import concurrent.futures
+import logging
+import threading
+import time
+
+from rpc_batch import batch_request, chunked, format_receipt, to_int
+
+
+logger = logging.getLogger(__name__)
+
+
+class ReorgError(Exception):
+    """Chain reorganization deeper than the number of remembered blocks."""
+
+
+class Tracked:
+    """Transaction waiting for confirmations."""
+
+    def __init__(self, txhash, confirmations, on_reorg=None):
+        self.txhash = txhash
+        self.confirmations = confirmations
+        self.future = concurrent.futures.Future()
+        self.on_reorg = on_reorg
+        self.block_number = None
+        self.block_hash = None
+        self.checked = False  # receipt was looked up once, later inclusions are found in new blocks
+
+
+class ConfirmationTracker:
+    """Resolves futures of tracked transactions with their receipts after their confirmation depth.
+
+    :param confirmations: default depth, blocks on top of the including one, 1 resolves as soon as the receipt exists
+    :param reorg_depth: number of blocks below the confirmation depth that are remembered
+    :param max_blocks: blocks fetched in one batch while catching up
+    """
+
+    def __init__(self, web3, confirmations=12, reorg_depth=64, poll_interval=1.0, max_blocks=128):
+        self.web3 = web3
+        self.confirmations = max(confirmations, 1)
+        self.reorg_depth = reorg_depth
+        self.poll_interval = poll_interval
+        self.max_blocks = max_blocks
+
+        self.pending = {}  # txhash -> Tracked
+        self.included = {}  # block number -> set of tracked txhashes included in that block
+        self.hashes = {}  # block number -> block hash of the remembered canonical chain
+        self.head = None
+
+        self.lock = threading.RLock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    # ---------------------------------------- api ----------------------------------------
+
+    def track(self, txhash, on_reorg=None, confirmations=None):
+        """Start tracking a transaction.
+
+        :param on_reorg: called with (txhash, block number) when the including block leaves the chain
+        :param confirmations: depth of this transaction, the tracker default when not given;
+                              a transaction tracked again waits for the deeper one
+        :return: concurrent.futures.Future resolved with the receipt
+        """
+        txhash = txhash.lower()
+        confirmations = max(confirmations or self.confirmations, 1)
+        with self.lock:
+            tracked = self.pending.get(txhash)
+            if tracked is None:
+                tracked = self.pending[txhash] = Tracked(txhash, confirmations, on_reorg)
+            tracked.confirmations = max(tracked.confirmations, confirmations)
+            return tracked.future
+
+    def forget(self, txhash):
+        """Stop tracking, e.g. after the transaction was replaced."""
+        with self.lock:
+            tracked = self.pending.pop(txhash.lower(), None)
+            if tracked is not None and tracked.block_number is not None:
+                self.included.get(tracked.block_number, set()).discard(tracked.txhash)
+
+    def start(self):
+        """Run the poll loop in a daemon thread."""
+        with self.lock:
+            if self.thread is None:
+                self.stopped.clear()
+                self.thread = threading.Thread(target=self.run, name="confirmation-tracker", daemon=True)
+                self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.step()
+            except Exception as error:
+                # node hiccups are retried on the next tick, a deep reorg fails everything pending
+                if isinstance(error, ReorgError):
+                    self.fail_pending(error)
+                else:
+                    logger.warning("Confirmation tracker: %s", error)
+            self.stopped.wait(self.poll_interval)
+
+    def fail_pending(self, error):
+        with self.lock:
+            for tracked in self.pending.values():
+                tracked.future.set_exception(error)
+            self.pending.clear()
+            self.included.clear()
+            self.hashes.clear()
+            self.head = None
+
+    # ---------------------------------------- steps ----------------------------------------
+
+    def step(self):
+        """Process new blocks and resolve confirmed transactions.
+
+        :return: current head
+        """
+        with self.lock:
+            head = to_int(batch_request(self.web3, [("eth_blockNumber", [])])[0])
+            self.check_new_transactions()
+            self.advance(head)
+            self.confirm()
+            return self.head
+
+    def check_new_transactions(self):
+        """Transactions could be mined before they were tracked, look up their receipts once."""
+        new = [tracked for tracked in self.pending.values() if not tracked.checked]
+        for chunk in chunked(new, 500):
+            receipts = batch_request(self.web3, [("eth_getTransactionReceipt", [tracked.txhash]) for tracked in chunk])
+            for tracked, receipt in zip(chunk, receipts):
+                tracked.checked = True
+                if receipt is not None:
+                    self.include(tracked, to_int(receipt["blockNumber"]), receipt["blockHash"])
+
+    def fetch_blocks(self, numbers):
+        return batch_request(self.web3, [("eth_getBlockByNumber", [hex(number), False]) for number in numbers])
+
+    def advance(self, head):
+        """Apply canonical blocks up to head, going back first when the remembered chain was reorganized."""
+        if self.head is None:
+            self.head = head - 1
+
+        # remembered head is fetched again with new blocks, a different hash means reorg
+        number = min(self.head, head)
+        while number <= head:
+            numbers = list(range(number, min(number + self.max_blocks, head + 1)))
+            for block in self.fetch_blocks(numbers):
+                if block is None:
+                    # node is not there yet, continue on the next tick
+                    self.prune()
+                    return
+                block_number = to_int(block["number"])
+                known = self.hashes.get(block_number)
+                if known is not None and known != block["hash"]:
+                    number = self.rollback(self.find_fork(block_number))
+                    break
+                parent = self.hashes.get(block_number - 1)
+                if parent is not None and parent != block["parentHash"]:
+                    number = self.rollback(self.find_fork(block_number - 1))
+                    break
+                self.apply_block(block_number, block)
+                number = block_number + 1
+
+        self.prune()
+
+    def find_fork(self, number):
+        """Return the highest remembered block still in the canonical chain, starting from 'number'."""
+        remembered = sorted((n for n in self.hashes if n <= number), reverse=True)
+        for chunk in chunked(remembered, 16):
+            for n, block in zip(chunk, self.fetch_blocks(chunk)):
+                if block is not None and block["hash"] == self.hashes[n]:
+                    return n
+        if remembered:
+            raise ReorgError("Reorganization deeper than {} remembered blocks at block {}"
+                             .format(len(remembered), number))
+        return number - 1
+
+    def rollback(self, fork):
+        """Forget blocks above fork, their transactions are pending again.
+
+        :return: first block number to fetch
+        """
+        for number in sorted(n for n in self.hashes if n > fork):
+            del self.hashes[number]
+            for txhash in self.included.pop(number, ()):
+                tracked = self.pending[txhash]
+                tracked.block_number = tracked.block_hash = None
+                if tracked.on_reorg is not None:
+                    tracked.on_reorg(txhash, number)
+        self.head = fork
+        return fork + 1
+
+    def apply_block(self, number, block):
+        self.hashes[number] = block["hash"]
+        self.head = max(self.head, number)
+        for txhash in block.get("transactions") or ():
+            tracked = self.pending.get(txhash.lower())
+            if tracked is not None:
+                self.include(tracked, number, block["hash"])
+
+    def include(self, tracked, number, block_hash):
+        if tracked.block_number is not None:
+            self.included.get(tracked.block_number, set()).discard(tracked.txhash)
+        tracked.block_number = number
+        tracked.block_hash = block_hash
+        self.included.setdefault(number, set()).add(tracked.txhash)
+
+    def confirm(self):
+        """Resolve transactions with enough confirmations, their receipts are fetched in one batch."""
+        ready = [self.pending[txhash] for number in sorted(self.included) for txhash in self.included[number]
+                 if number <= self.head - self.pending[txhash].confirmations + 1]
+
+        for chunk in chunked(ready, 500):
+            receipts = batch_request(self.web3, [("eth_getTransactionReceipt", [tracked.txhash]) for tracked in chunk])
+            for tracked, receipt in zip(chunk, receipts):
+                if receipt is None:
+                    # chain changed after the block was seen, next tick sorts it out
+                    continue
+                if receipt["blockHash"] != tracked.block_hash:
+                    # included again in another block, wait for its confirmations
+                    self.include(tracked, to_int(receipt["blockNumber"]), receipt["blockHash"])
+                    continue
+                self.included[tracked.block_number].discard(tracked.txhash)
+                del self.pending[tracked.txhash]
+                tracked.future.set_result(format_receipt(receipt))
+
+        for number in [n for n, txhashes in self.included.items() if not txhashes]:
+            del self.included[number]
+
+    def prune(self):
+        deepest = max([self.confirmations] + [tracked.confirmations for tracked in self.pending.values()])
+        oldest = self.head - deepest - self.reorg_depth
+        for number in [n for n in self.hashes if n < oldest]:
+            del self.hashes[number]
+
+    def wait(self, txhashes, timeout=600, confirmations=None):
+        """Track transactions and wait for all of them, return dict txhash -> receipt.
+
+        :param timeout: seconds to wait for all transactions together
+        """
+        futures = {txhash: self.track(txhash, confirmations=confirmations) for txhash in txhashes}
+        if self.thread is None:
+            # no loop running, poll from this thread
+            deadline = time.time() + timeout
+            while not all(future.done() for future in futures.values()):
+                if time.time() > deadline:
+                    raise TimeoutError("Transactions not confirmed in {} seconds".format(timeout))
+                self.step()
+                if not all(future.done() for future in futures.values()):
+                    time.sleep(self.poll_interval)
+        else:
+            _, not_done = concurrent.futures.wait(futures.values(), timeout=timeout)
+            if not_done:
+                raise TimeoutError("{} transactions not confirmed in {} seconds".format(len(not_done), timeout))
+        return {txhash: future.result() for txhash, future in futures.items()}
+
+
+# web3 -> running tracker, the poll loop keeps its web3 alive anyway
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_tracker(web3, **kwargs):
+    """Process wide running tracker of given web3 instance, kwargs are used when it is created."""
+    with _shared_lock:
+        tracker = _shared.get(web3)
+        if tracker is None:
+            tracker = _shared[web3] = ConfirmationTracker(web3, **kwargs).start()
+        return tracker
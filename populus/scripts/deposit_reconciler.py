@@ -0,0 +1,291 @@
+"""
+Reconciliation of GameDeposit accounting invariants over the whole history
+
+Checked invariants:
+
+ - balance: JoyToken balance of the deposit == sum of deposits + sum of lockedFunds
+ - reserve: wins paid by accountGameResult never exceed the platformReserve deposit
+ - deposit: no deposit goes below zero (a replay that needs it is missing events)
+
+Logs are fetched with LogFetcher and cut into segments of consecutive blocks.
+Every segment is replayed by PlayerLedger rules in a pool of worker processes
+without knowing the state before it: deposits and locked funds are kept as
+deltas, and the only effect that depends on the previous state - the
+win/loss split of the first accountGameResult of a session in the segment -
+is recorded and resolved when segments are merged in block order. The merge
+is a short sequential pass, so the replay scales with the number of workers.
+
+    python scripts/deposit_reconciler.py --token ... --upgraded-token ... --deposit ... --game ... --from-block N
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import os
+
+from chain_context import open_chain
+from joy_events import EVENT_TOPICS
+from log_fetcher import LogFetcher
+from player_ledger import PlayerLedger, LedgerFollower, LEDGER_EVENTS
+from rpc_batch import batch_request, to_int
+
+
+BALANCE_OF = "0x70a08231"  # balanceOf(address)
+
+
+class RangeLedger(PlayerLedger):
+    """PlayerLedger replaying a block range from an unknown starting state.
+
+    'deposits' and 'locked_funds' hold changes made in the range. Locked funds
+    of sessions settled in the range ('settled') are absolute, because
+    accountGameResult sets them regardless of the previous value. Deposits of
+    platformReserve and game developers depend on the previous locked funds of
+    settled sessions, their changes are kept in order in 'ops'.
+    """
+
+    def __init__(self, token, upgraded_token, deposit, platform_reserve, game_devs):
+        super().__init__(token, upgraded_token, deposit, platform_reserve, game_devs)
+        self.ordered = {self.platform_reserve} | set(self.game_devs.values())
+        self.settled = set()  # (player, game) with absolute locked funds
+        self.minima = {}  # player -> [(deposit change, block)] at every new lowest change, in block order
+        self.ops = []  # ("delta", block, account, value, settling) or ("settle", block, player, game, locked, final)
+        self.imbalance = collections.Counter()  # block -> token balance change - accounted change
+        self.total = 0  # change of deposits + locked funds
+        self.settling = False
+
+    def add_deposit(self, player, value):
+        self.total += value
+        if player in self.ordered:
+            self.ops.append(("delta", self.block_number, player, value, self.settling))
+        else:
+            self.deposits[player] = self.deposits.get(player, 0) + value
+
+    def sub_deposit(self, player, value):
+        self.total -= value
+        if player in self.ordered:
+            self.ops.append(("delta", self.block_number, player, -value, self.settling))
+            return
+        balance = self.deposits.get(player, 0) - value
+        self.deposits[player] = balance
+        minima = self.minima.setdefault(player, [])
+        if balance < (minima[-1][0] if minima else 0):
+            minima.append((balance, self.block_number))
+
+    def set_locked(self, player, game, value):
+        self.total += value - self.player_locked_funds(player, game)
+        super().set_locked(player, game, value)
+
+    def account_game_result(self, player, game, remain_balance, final_balance):
+        key = (player, game)
+        if key in self.settled:
+            self.settling = True
+            super().account_game_result(player, game, remain_balance, final_balance)
+            self.settling = False
+            return
+
+        # locked funds before this call are unknown, the win/loss split is resolved by the merge;
+        # deposits + locked funds do not change, the split only moves funds between them
+        self.ops.append(("settle", self.block_number, player, game, self.player_locked_funds(player, game),
+                         final_balance))
+        self.settled.add(key)
+        self.locked_funds[key] = final_balance
+        if final_balance != 0 and remain_balance != final_balance:
+            self.add_deposit(player, final_balance - remain_balance)
+            self.set_locked(player, game, remain_balance)
+
+    def apply_transaction(self, events):
+        self.block_number = events[0]["blockNumber"]
+        total = self.total
+        super().apply_transaction(events)
+
+        tokens = 0
+        for event in events:
+            if event["event"] == "Transfer" and event["address"] == self.token:
+                if event["args"]["to"] == self.deposit:
+                    tokens += event["args"]["value"]
+                if event["args"]["from"] == self.deposit:
+                    tokens -= event["args"]["value"]
+        if tokens != self.total - total:
+            self.imbalance[self.block_number] += tokens - (self.total - total)
+
+
+def replay_range(config, logs, senders):
+    """Replay raw logs of consecutive blocks in a worker process.
+
+    :param config: (token, upgraded_token, deposit, platform_reserve, game_devs)
+    :param senders: dict txhash -> sender of payOut transactions
+    """
+    ledger = RangeLedger(*config)
+    ledger.tx_sender = lambda txhash: senders[txhash].lower()
+    ledger.apply_logs(logs)
+    ledger.tx_sender = None
+    return ledger
+
+
+class Reconciler:
+    """Replays history in parallel segments and merges them checking the invariants.
+
+    :param follower: LedgerFollower of the deposit and games, its addresses and payOut senders are reused
+    :param workers: replay processes
+    :param segment_logs: logs replayed by one task
+    :param chunk_size: initial blocks per eth_getLogs
+    """
+
+    def __init__(self, follower, workers=None, segment_logs=20000, chunk_size=2000, fetch_workers=4):
+        self.follower = follower
+        self.web3 = follower.web3
+        ledger = follower.ledger
+        self.config = (ledger.token, ledger.upgraded_token, ledger.deposit, ledger.platform_reserve,
+                       ledger.game_devs)
+        self.platform_reserve = ledger.platform_reserve
+        self.game_devs = ledger.game_devs
+        self.workers = workers or os.cpu_count() or 1
+        self.segment_logs = segment_logs
+        self.chunk_size = chunk_size
+        self.fetch_workers = fetch_workers
+
+        self.deposits = {}
+        self.locked_funds = {}
+        self.imbalance = 0
+        self.violations = []  # (block, invariant, description)
+        self.segments = 0
+        self.logs = 0
+
+    def violation(self, block, invariant, description):
+        self.violations.append((block, invariant, description))
+
+    def change_deposit(self, block, account, value, win=False):
+        balance = self.deposits.get(account, 0)
+        if balance + value < 0:
+            if win:
+                self.violation(block, "reserve", "win of {} exceeds platformReserve deposit {}".format(-value, balance))
+            else:
+                self.violation(block, "deposit", "deposit of {} goes to {}".format(account, balance + value))
+        self.deposits[account] = balance + value
+
+    def settle(self, block, player, game, locked_change, final_balance):
+        locked = self.locked_funds.get((player, game), 0) + locked_change
+        if final_balance > locked:
+            self.change_deposit(block, self.platform_reserve, locked - final_balance, win=True)
+        elif final_balance < locked:
+            loss = locked - final_balance
+            self.change_deposit(block, self.game_devs[game], loss // 2)
+            self.change_deposit(block, self.platform_reserve, loss - loss // 2)
+
+    def merge(self, segment):
+        """Apply replayed segment to the state at its first block."""
+        for player, minima in segment.minima.items():
+            balance = self.deposits.get(player, 0)
+            # first block where the deposit goes below zero
+            crossing = next(((change, block) for change, block in minima if balance + change < 0), None)
+            if crossing is not None:
+                change, block = crossing
+                self.violation(block, "deposit", "deposit of {} goes to {}".format(player, balance + change))
+
+        # settlements read locked funds from before the segment, so ops go first
+        for op in segment.ops:
+            if op[0] == "delta":
+                _, block, account, value, settling = op
+                self.change_deposit(block, account, value, win=settling and value < 0)
+            else:
+                self.settle(*op[1:])
+
+        for player, change in segment.deposits.items():
+            self.deposits[player] = self.deposits.get(player, 0) + change
+
+        for key in segment.settled:
+            self.locked_funds[key] = 0
+        for key, value in segment.locked_funds.items():
+            self.locked_funds[key] = value if key in segment.settled else self.locked_funds.get(key, 0) + value
+        for key in [key for key, value in self.locked_funds.items() if value == 0]:
+            del self.locked_funds[key]
+
+        for block in sorted(segment.imbalance):
+            imbalance = self.imbalance + segment.imbalance[block]
+            if imbalance and not self.imbalance:
+                self.violation(block, "balance", "token balance differs from deposits + locked funds by {}"
+                               .format(imbalance))
+            self.imbalance = imbalance
+        self.segments += 1
+
+    def run(self, from_block, to_block):
+        """Replay [from_block, to_block], from_block is the deployment of the deposit.
+
+        :return: violations sorted by block
+        """
+        follower = self.follower
+        fetcher = LogFetcher(self.web3, follower.addresses, [[EVENT_TOPICS[name] for name in LEDGER_EVENTS]],
+                             workers=self.fetch_workers, initial_range=self.chunk_size)
+        pending = collections.deque()
+        segment = []
+
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as pool:
+            for _, end, logs in fetcher.ranges(from_block, to_block):
+                segment.extend(logs)
+                if len(segment) < self.segment_logs and end < to_block:
+                    continue
+
+                # payOut senders are fetched here, workers have no connection
+                follower.prefetch_senders(segment)
+                pending.append(pool.submit(replay_range, self.config, segment, dict(follower.senders)))
+                follower.senders.clear()
+                self.logs += len(segment)
+                segment = []
+                while len(pending) > 2 * self.workers:
+                    self.merge(pending.popleft().result())
+
+            while pending:
+                self.merge(pending.popleft().result())
+
+        self.check_balance(to_block)
+        self.violations.sort(key=lambda violation: violation[0])
+        return self.violations
+
+    def check_balance(self, block):
+        """Compare replayed totals with balanceOf(deposit) at the last block."""
+        data = BALANCE_OF + "00" * 12 + self.config[2][2:]
+        balance = to_int(batch_request(self.web3, [("eth_call", [{"to": self.config[0], "data": data},
+                                                                 hex(block)])])[0])
+        accounted = sum(self.deposits.values()) + sum(self.locked_funds.values())
+        if balance != accounted:
+            self.violation(block, "balance", "balanceOf(deposit) is {}, deposits + locked funds {}"
+                           .format(balance, accounted))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check GameDeposit accounting invariants over its history.")
+    parser.add_argument("--chain", default="ropsten", help="populus chain name")
+    parser.add_argument("--token", required=True, help="underlying ERC20 JoyToken address")
+    parser.add_argument("--upgraded-token", required=True, help="ERC223 JoyTokenUpgraded address")
+    parser.add_argument("--deposit", required=True, help="GameDeposit address")
+    parser.add_argument("--game", action="append", required=True, help="JoyGamePlatform address")
+    parser.add_argument("--from-block", type=int, default=0, help="deployment block of the deposit")
+    parser.add_argument("--to-block", type=int, help="latest block by default")
+    parser.add_argument("--workers", type=int, help="replay processes, number of CPUs by default")
+    parser.add_argument("--segment-logs", type=int, default=20000, help="logs replayed by one task")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="initial blocks per eth_getLogs")
+    args = parser.parse_args()
+
+    with open_chain(args.chain) as chain:
+        web3 = chain.web3
+        follower = LedgerFollower.from_chain(web3, args.token, args.upgraded_token, args.deposit, args.game)
+        to_block = args.to_block
+        if to_block is None:
+            to_block = to_int(batch_request(web3, [("eth_blockNumber", [])])[0])
+
+        reconciler = Reconciler(follower, workers=args.workers, segment_logs=args.segment_logs,
+                                chunk_size=args.chunk_size)
+        violations = reconciler.run(args.from_block, to_block)
+
+    print("Replayed {} logs in {} segments, blocks {}-{}".format(reconciler.logs, reconciler.segments,
+                                                                  args.from_block, to_block))
+    for block, invariant, description in violations:
+        print("Block {} [{}]: {}".format(block, invariant, description))
+    if violations:
+        print("First violation at block {}".format(violations[0][0]))
+        exit(1)
+    print("All invariants hold")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Checkpointed indexer of Joy Platform events into SQLite
+
+Logs are fetched with eth_getLogs in adaptive block ranges by parallel workers
+(log_fetcher.py) and stored in one table per event, so dashboards can query
+history without rescanning the chain.
+Each chunk is written in a single SQLite transaction together with the
+checkpoint, so the indexer can be stopped at any time and resumed later.
+
+Hashes of the most recent 'confirmations' blocks are remembered. When the node
+reports a different hash for any of them, rows from the reorganized blocks are
+rolled back and indexed again from the new chain.
+"""
+
+import argparse
+import json
+import sqlite3
+import time
+
+from chain_context import open_chain
+from log_fetcher import LogFetcher
+from rpc_batch import batch_request
+from joy_events import EVENTS_BY_NAME, EVENT_TOPICS, decode_log
+
+
+INDEXED_EVENTS = ["NewGameSession", "RefreshGameSession", "EndGameInfo",
+                  "ERC223Transfer", "CustomDeposit", "newSubscription"]
+
+# avoid SQL keywords in column names
+COLUMN_NAMES = {"from": "from_addr", "to": "to_addr"}
+
+SQL_TYPES = {"address": "TEXT", "uint256": "TEXT", "bytes32": "TEXT", "bytes": "BLOB"}
+
+
+class ReorgError(Exception):
+    """Chain reorganization deeper than the number of remembered blocks."""
+
+
+def column_name(event_arg):
+    return COLUMN_NAMES.get(event_arg["name"], event_arg["name"])
+
+
+def table_name(event_name):
+    return "event_" + event_name
+
+
+def column_value(abi_type, value):
+    # uint256 does not fit into sqlite INTEGER, store exact decimal representation
+    if abi_type == "uint256":
+        return str(value)
+    if abi_type == "bytes32":
+        return "0x" + value.hex()
+    return value
+
+
+def create_schema(db, events=INDEXED_EVENTS):
+    db.execute("CREATE TABLE IF NOT EXISTS indexer_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS indexed_blocks (number INTEGER PRIMARY KEY, hash TEXT NOT NULL)")
+
+    for event_name in events:
+        event_abi = EVENTS_BY_NAME[event_name]
+        table = table_name(event_name)
+        columns = ["{} {}".format(column_name(i), SQL_TYPES[i["type"]]) for i in event_abi["inputs"]]
+        db.execute("CREATE TABLE IF NOT EXISTS {} ("
+                   "block_number INTEGER NOT NULL, "
+                   "log_index INTEGER NOT NULL, "
+                   "block_hash TEXT NOT NULL, "
+                   "tx_hash TEXT NOT NULL, "
+                   "address TEXT NOT NULL, "
+                   "{}, "
+                   "PRIMARY KEY (block_number, log_index))".format(table, ", ".join(columns)))
+
+        db.execute("CREATE INDEX IF NOT EXISTS {0}_tx_hash ON {0} (tx_hash)".format(table))
+        db.execute("CREATE INDEX IF NOT EXISTS {0}_address ON {0} (address, block_number)".format(table))
+        # indexed event arguments are the ones dashboards filter by
+        for event_arg in event_abi["inputs"]:
+            if event_arg["indexed"]:
+                db.execute("CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} ({1}, block_number)"
+                           .format(table, column_name(event_arg)))
+
+
+class EventIndexer:
+    """Streams Joy Platform logs from the node into SQLite database."""
+
+    def __init__(self, web3, db_path, addresses, start_block=0, chunk_size=2000, confirmations=12,
+                 events=INDEXED_EVENTS, workers=4):
+        self.web3 = web3
+        self.db = sqlite3.connect(db_path)
+        self.addresses = [address.lower() for address in addresses]
+        self.start_block = start_block
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.confirmations = confirmations
+        self.events = list(events)
+        self.topics = [EVENT_TOPICS[event_name] for event_name in self.events]
+        create_schema(self.db, self.events)
+        self.db.commit()
+
+    # ------------------------------------ checkpoint ------------------------------------
+
+    def checkpoint(self):
+        """Last fully indexed block number."""
+        row = self.db.execute("SELECT value FROM indexer_state WHERE key = 'checkpoint'").fetchone()
+        if row is None:
+            return self.start_block - 1
+        return int(row[0])
+
+    def set_checkpoint(self, block_number):
+        self.db.execute("INSERT OR REPLACE INTO indexer_state (key, value) VALUES ('checkpoint', ?)",
+                        (str(block_number),))
+
+    # --------------------------------------- reorg ---------------------------------------
+
+    def fetch_block_hashes(self, numbers):
+        blocks = batch_request(self.web3, [("eth_getBlockByNumber", [hex(number), False]) for number in numbers])
+        return {number: block["hash"] if block else None for number, block in zip(numbers, blocks)}
+
+    def find_reorg(self):
+        """Return lowest remembered block number that is no longer in the canonical chain."""
+        stored = self.db.execute("SELECT number, hash FROM indexed_blocks ORDER BY number").fetchall()
+        if not stored:
+            return None
+
+        current = self.fetch_block_hashes([number for number, _ in stored])
+        for number, block_hash in stored:
+            if current[number] != block_hash:
+                if number == stored[0][0]:
+                    raise ReorgError("Reorganization deeper than {} remembered blocks at block {}"
+                                     .format(len(stored), number))
+                return number
+        return None
+
+    def rollback(self, block_number):
+        """Remove all data indexed from given block (inclusive)."""
+        print("Chain reorganization detected, rolling back to block {}".format(block_number - 1))
+        with self.db:
+            for event_name in self.events:
+                self.db.execute("DELETE FROM {} WHERE block_number >= ?".format(table_name(event_name)),
+                                (block_number,))
+            self.db.execute("DELETE FROM indexed_blocks WHERE number >= ?", (block_number,))
+            self.set_checkpoint(block_number - 1)
+
+    # -------------------------------------- indexing -------------------------------------
+
+    def log_fetcher(self):
+        # chunk_size is only the initial range, ranges grow in sparse and shrink in dense history
+        return LogFetcher(self.web3, self.addresses, [self.topics], workers=self.workers,
+                          initial_range=self.chunk_size)
+
+    def store_logs(self, logs):
+        for log in logs:
+            decoded = decode_log(log)
+            if decoded is None or decoded["event"] not in self.events:
+                continue
+
+            event_abi = EVENTS_BY_NAME[decoded["event"]]
+            columns = ["block_number", "log_index", "block_hash", "tx_hash", "address"]
+            values = [decoded["blockNumber"], decoded["logIndex"], decoded["blockHash"],
+                      decoded["transactionHash"], decoded["address"]]
+            for event_arg in event_abi["inputs"]:
+                columns.append(column_name(event_arg))
+                values.append(column_value(event_arg["type"], decoded["args"][event_arg["name"]]))
+
+            self.db.execute("INSERT OR REPLACE INTO {} ({}) VALUES ({})".format(
+                table_name(decoded["event"]), ", ".join(columns), ", ".join("?" * len(values))), values)
+
+    def index_range(self, from_block, to_block, head, logs):
+        # remember hashes of blocks that still may be reorganized
+        unconfirmed = list(range(max(from_block, head - self.confirmations + 1), to_block + 1))
+        hashes = self.fetch_block_hashes(unconfirmed) if unconfirmed else {}
+
+        # logs from the other branch mean reorg happened in the meantime, try again later
+        for log in logs:
+            number = int(log["blockNumber"], 16)
+            if number in hashes and hashes[number] != log["blockHash"]:
+                return False
+
+        with self.db:
+            self.store_logs(logs)
+            self.db.executemany("INSERT OR REPLACE INTO indexed_blocks (number, hash) VALUES (?, ?)",
+                                [(number, block_hash) for number, block_hash in hashes.items() if block_hash])
+            self.db.execute("DELETE FROM indexed_blocks WHERE number <= ? AND number < ?",
+                            (head - self.confirmations, to_block))
+            self.set_checkpoint(to_block)
+        return True
+
+    def run_once(self):
+        """Index everything up to the current head.
+
+        :return: number of the last indexed block
+        """
+        reorg_block = self.find_reorg()
+        if reorg_block is not None:
+            self.rollback(reorg_block)
+
+        head = int(batch_request(self.web3, [("eth_blockNumber", [])])[0], 16)
+        from_block = self.checkpoint() + 1
+
+        ranges = self.log_fetcher().ranges(from_block, head)
+        try:
+            for range_start, range_end, logs in ranges:
+                if not self.index_range(range_start, range_end, head, logs):
+                    break
+                print("Indexed blocks {} - {}".format(range_start, range_end))
+        finally:
+            ranges.close()
+
+        return self.checkpoint()
+
+    def run_forever(self, poll_interval=15):
+        while True:
+            self.run_once()
+            time.sleep(poll_interval)
+
+
+def load_addresses(config_path):
+    # contract addresses from config.json written by deploy/deploy_ropsten.py
+    with open(config_path, "r") as conf_json:
+        json_data = json.load(conf_json)
+
+    contracts = json_data["ContractAddress"]
+    # ERC223Transfer and CustomDeposit are emitted by JoyTokenUpgraded,
+    # config files written before it was deployed have no address for it
+    addresses = [contracts["joyToken"], contracts.get("joyTokenUpgraded"), contracts["demoGame"],
+                 contracts["deposit"], contracts["subscription"]["ether"], contracts["subscription"]["joyToken"]]
+    return [address for address in addresses if address]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index Joy Platform events into SQLite database.")
+    parser.add_argument("--chain", default="ropsten", help="populus chain name")
+    parser.add_argument("--db", default="events.sqlite", help="path to SQLite database")
+    parser.add_argument("--config", default="deploy/config.json", help="deployed contracts addresses")
+    parser.add_argument("--address", action="append", default=[], help="additional contract address to index")
+    parser.add_argument("--from-block", type=int, default=0)
+    parser.add_argument("--chunk-size", type=int, default=2000, help="initial blocks per eth_getLogs")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent eth_getLogs requests")
+    parser.add_argument("--confirmations", type=int, default=12)
+    parser.add_argument("--poll-interval", type=int, default=15)
+    parser.add_argument("--once", action="store_true", help="exit after reaching current head")
+    args = parser.parse_args()
+
+    with open_chain(args.chain) as chain:
+        addresses = load_addresses(args.config) + args.address
+        indexer = EventIndexer(chain.web3, args.db, addresses, start_block=args.from_block,
+                               chunk_size=args.chunk_size, confirmations=args.confirmations,
+                               workers=args.workers)
+        if args.once:
+            indexer.run_once()
+        else:
+            indexer.run_forever(args.poll_interval)
+
+
+if __name__ == "__main__":
+    main()
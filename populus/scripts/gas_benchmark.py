@@ -0,0 +1,211 @@
+"""
+Gas and latency benchmark of platform hot paths
+
+Deploys JoyToken, JoyTokenUpgraded, GameDeposit, JoyGamePlatform and both
+subscription contracts on the local tester chain, then runs every benchmarked
+transaction several times, recording gas used and wall time (submission until
+receipt). Receipts are polled, so --chain may also name a chain that does
+not mine on every transaction, whose accounts are unlocked and funded with
+ether. Results are written as JSON; when a baseline file is given, the run
+fails if gas of any benchmark grew more than the allowed threshold.
+
+Run from the populus directory:
+
+    python scripts/gas_benchmark.py --output gas.json
+    python scripts/gas_benchmark.py --baseline gas.json --threshold 0.02
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+from artifact_cache import get_contract_factory
+from chain_context import open_chain
+from utils import is_successful_receipt, wait_for_receipts
+
+
+BIG_ALLOWANCE = 2 ** 255
+PLAYER_FUNDS = 10 ** 24
+RESERVE_FUNDS = 10 ** 26
+
+
+class Platform:
+    """Contracts of the platform deployed on a local chain."""
+
+    def __init__(self, chain):
+        self.chain = chain
+        self.web3 = chain.web3
+        accounts = self.web3.eth.accounts
+        self.owner = accounts[0]
+        self.reserve = accounts[1]
+        self.game_dev = accounts[2]
+        self.players = accounts[3:]
+
+        self.token = self.deploy("JoyToken")
+        self.upgraded = self.deploy("JoyTokenUpgraded", self.token.address)
+        self.deposit = self.deploy("GameDeposit", self.token.address, self.reserve)
+        self.game = self.deploy("JoyGamePlatform", self.deposit.address, self.game_dev)
+        self.ether_sub = self.deploy("SubscriptionWithEther")
+        self.joy_sub = self.deploy("SubscriptionWithJoyToken", self.token.address)
+
+        self.fund(self.reserve, RESERVE_FUNDS)
+        self.wait(self.upgraded.transact({"from": self.reserve}).transfer(self.deposit.address, RESERVE_FUNDS))
+        for player in self.players:
+            self.fund(player, PLAYER_FUNDS)
+
+    def deploy(self, name, *args):
+        factory = get_contract_factory(self.chain, name)
+        receipt = self.wait(factory.deploy(transaction={"from": self.owner}, args=list(args)))
+        return factory(address=receipt["contractAddress"])
+
+    def fund(self, account, value):
+        self.wait(self.token.transact({"from": self.owner}).transfer(account, value))
+        self.wait(self.token.transact({"from": account}).approve(self.upgraded.address, BIG_ALLOWANCE))
+
+    def wait(self, txhash, timeout=300):
+        # short poll interval, the wait is part of the measured latency
+        _, receipt = next(wait_for_receipts(self.web3, [txhash], timeout=timeout, poll_interval=0.05,
+                                            max_poll_interval=1))
+        if not is_successful_receipt(receipt):
+            raise ValueError("Transaction {} failed".format(txhash))
+        return receipt
+
+
+def measure(platform, name, send, prepare=None, rounds=5):
+    """Run send() several times, prepare() is executed before every round and not measured.
+
+    :return: dict with gas and timing statistics
+    """
+    gas = []
+    times = []
+    for round_number in range(rounds):
+        if prepare is not None:
+            prepare(round_number)
+        start = time.perf_counter()
+        receipt = platform.wait(send(round_number))
+        times.append(time.perf_counter() - start)
+        gas.append(receipt["gasUsed"])
+
+    print("{:<32} gas {:>8}  time {:8.2f} ms".format(name, max(gas), statistics.median(times) * 1000))
+    return {
+        "gas": max(gas),
+        "gas_min": min(gas),
+        "time_ms_median": statistics.median(times) * 1000,
+        "time_ms_max": max(times) * 1000,
+        "rounds": rounds,
+    }
+
+
+def run_benchmarks(platform, rounds=5):
+    results = {}
+    game = platform.game.address
+    deposit = platform.deposit.address
+    upgraded = platform.upgraded
+    stake = 10 ** 18
+
+    def player(round_number):
+        return platform.players[round_number % len(platform.players)]
+
+    locked = {}
+
+    def deposit_and_lock(round_number):
+        current = player(round_number)
+        platform.wait(upgraded.transact({"from": current}).transferToGame(deposit, game, stake, b""))
+        locked[round_number] = platform.game.call().playerLockedFunds(current)
+
+    def settle(final_balance, pay_out=False):
+        # final_balance is a function of funds locked in the game
+        def send(round_number):
+            settlement = platform.game.transact({"from": platform.owner})
+            method = settlement.payOutGameResult if pay_out else settlement.accountGameResult
+            process_id = round_number.to_bytes(32, "big")
+            return method(player(round_number), 0, final_balance(locked[round_number]), process_id, b"\x01" * 32)
+        return send
+
+    results["erc223_transfer_with_data"] = measure(
+        platform, "ERC223 transfer with data",
+        lambda r: upgraded.transact({"from": player(r)}).transfer(player(r + 1), stake, b"simple_data"),
+        rounds=rounds)
+
+    results["erc223_deposit"] = measure(
+        platform, "ERC223 transfer to deposit",
+        lambda r: upgraded.transact({"from": player(r)}).transfer(deposit, stake),
+        rounds=rounds)
+
+    results["deposit_transfer_to_game"] = measure(
+        platform, "GameDeposit.transferToGame",
+        lambda r: platform.deposit.transact({"from": player(r)}).transferToGame(game, stake // 10),
+        rounds=rounds)
+
+    results["custom_deposit"] = measure(
+        platform, "customDeposit (transferToGame)",
+        lambda r: upgraded.transact({"from": player(r)}).transferToGame(deposit, game, stake, b""),
+        rounds=rounds)
+
+    # settlements of fresh sessions, every round locks new stake first
+    results["settle_win"] = measure(platform, "accountGameResult win", settle(lambda funds: funds * 2),
+                                    prepare=deposit_and_lock, rounds=rounds)
+    results["settle_loss"] = measure(platform, "accountGameResult loss", settle(lambda funds: funds // 3),
+                                     prepare=deposit_and_lock, rounds=rounds)
+    results["settle_neutral"] = measure(platform, "accountGameResult neutral", settle(lambda funds: funds),
+                                        prepare=deposit_and_lock, rounds=rounds)
+    results["payout_win"] = measure(platform, "payOutGameResult win", settle(lambda funds: funds * 2, pay_out=True),
+                                    prepare=deposit_and_lock, rounds=rounds)
+
+    ether_price = platform.ether_sub.call().subscriptionPrice()
+    results["subscribe_ether"] = measure(
+        platform, "SubscriptionWithEther.subscribe",
+        lambda r: platform.ether_sub.transact({"from": player(r), "value": ether_price * 3600}).subscribe(3600),
+        rounds=rounds)
+
+    joy_price = platform.joy_sub.call().subscriptionPrice()
+    results["subscribe_joy_token"] = measure(
+        platform, "SubscriptionWithJoyToken subscribe",
+        lambda r: upgraded.transact({"from": player(r)}).transfer(platform.joy_sub.address, joy_price * 3600,
+                                                                    (3600).to_bytes(2, "big")),
+        rounds=rounds)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return list of benchmarks that use more gas than baseline allows."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        allowed = baseline[name]["gas"] * (1 + threshold)
+        if result["gas"] > allowed:
+            regressions.append((name, baseline[name]["gas"], result["gas"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure gas and latency of platform transactions.")
+    parser.add_argument("--chain", default="tester", help="populus chain name, local chain by default")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--output", help="write results to JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare gas with")
+    parser.add_argument("--threshold", type=float, default=0.01, help="allowed relative gas increase")
+    args = parser.parse_args()
+
+    with open_chain(args.chain) as chain:
+        results = run_benchmarks(Platform(chain), rounds=args.rounds)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump({"results": results}, fp, indent=4, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, "r") as fp:
+            baseline = json.load(fp)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for name, expected, actual in regressions:
+            print("Gas regression in {}: {} -> {} (+{:.1%})".format(name, expected, actual, actual / expected - 1))
+        if regressions:
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Gas price oracle based on recently mined blocks
+
+The lowest gas price accepted in a block tells what was enough to get
+included in that block. The oracle keeps those minimum prices for a window
+of recent blocks (fetched once, then only new blocks are added) and picks the
+percentile that gives the requested probability of inclusion within the
+target confirmation time:
+
+    P(included within N blocks) = 1 - (1 - p) ** N
+
+where p is the fraction of blocks whose minimum price is not higher than ours.
+"""
+
+import math
+import time
+
+from rpc_batch import batch_request, to_int, RPCError
+
+
+# target confirmation times in seconds
+STRATEGIES = {
+    "fast": 15,
+    "standard": 60,
+    "slow": 300,
+}
+
+# geth accepts a replacement paying at least 10% more, parity at least 12.5%
+REPLACEMENT_BUMP = 1.125
+
+
+class DroppedTransaction(ValueError):
+    """Transaction is neither pending nor mined, the node dropped it."""
+
+
+class GasPriceOracle:
+    """Suggests gas prices from percentiles of recent blocks minimum prices.
+
+    :param window: number of recent blocks used for statistics
+    :param refresh_interval: seconds between checks for new blocks
+    """
+
+    def __init__(self, web3, window=40, refresh_interval=5, min_price=1000000000):
+        self.web3 = web3
+        self.window = window
+        self.refresh_interval = refresh_interval
+        self.min_price = min_price
+        self.blocks = {}  # number -> (timestamp, minimum gas price or None for empty block)
+        self.head = None
+        self.last_refresh = 0
+        self.sorted_prices = []
+
+    def fetch_blocks(self, numbers):
+        blocks = batch_request(self.web3, [("eth_getBlockByNumber", [hex(number), True]) for number in numbers])
+        for number, block in zip(numbers, blocks):
+            if block is None:
+                continue
+            prices = [to_int(tx["gasPrice"]) for tx in block["transactions"]]
+            self.blocks[number] = (to_int(block["timestamp"]), min(prices) if prices else None)
+
+    def refresh(self, force=False):
+        """Fetch blocks mined since the last refresh, cached blocks are not fetched again."""
+        if not force and time.time() - self.last_refresh < self.refresh_interval:
+            return
+
+        head = int(batch_request(self.web3, [("eth_blockNumber", [])])[0], 16)
+        self.last_refresh = time.time()
+        if head == self.head:
+            return
+
+        first = max(0, head - self.window + 1)
+        missing = [number for number in range(first, head + 1) if number not in self.blocks]
+        if missing:
+            self.fetch_blocks(missing)
+
+        for number in [number for number in self.blocks if number < first]:
+            del self.blocks[number]
+
+        self.head = head
+        self.sorted_prices = sorted(price for _, price in self.blocks.values() if price is not None)
+
+    def block_time(self):
+        timestamps = sorted(timestamp for timestamp, _ in self.blocks.values())
+        if len(timestamps) < 2:
+            return 15.0
+        return max(1.0, (timestamps[-1] - timestamps[0]) / (len(timestamps) - 1))
+
+    def percentile(self, fraction):
+        prices = self.sorted_prices
+        index = min(len(prices) - 1, max(0, int(math.ceil(fraction * len(prices))) - 1))
+        return prices[index]
+
+    def suggest(self, strategy="standard", target_seconds=None, confidence=0.9):
+        """Gas price that should be mined within target time with given confidence.
+
+        :param strategy: one of STRATEGIES, used when target_seconds is not given
+        :return: gas price in wei
+        """
+        self.refresh()
+        if not self.sorted_prices:
+            # no transactions in recent blocks, fall back to node suggestion
+            return max(self.web3.eth.gasPrice, self.min_price)
+
+        if target_seconds is None:
+            target_seconds = STRATEGIES[strategy]
+        target_blocks = max(1, int(target_seconds // self.block_time()))
+
+        block_probability = 1 - (1 - confidence) ** (1.0 / target_blocks)
+        return max(self.percentile(block_probability), self.min_price)
+
+    def rebid(self, txhash, strategy="fast", confidence=0.9, signer=None):
+        """Replace pending transaction with the same one paying more for gas.
+
+        :param signer: signer.TransactionSigner, the replacement is signed locally instead of by the node
+
+        :return: hash of the replacement, or None when transaction is already mined
+        :raises DroppedTransaction: node does not know the transaction, it has to be sent again
+        """
+        transaction = batch_request(self.web3, [("eth_getTransactionByHash", [txhash])])[0]
+        if transaction is None:
+            raise DroppedTransaction("Unknown transaction: " + txhash)
+        if transaction.get("blockNumber") is not None:
+            return None
+
+        old_price = to_int(transaction["gasPrice"])
+        new_price = max(self.suggest(strategy, confidence=confidence), int(math.ceil(old_price * REPLACEMENT_BUMP)))
+
+        replacement = {
+            "from": transaction["from"],
+            "to": transaction["to"],
+            "value": to_int(transaction["value"]),
+            "gas": to_int(transaction["gas"]),
+            "gasPrice": new_price,
+            "nonce": to_int(transaction["nonce"]),
+            "data": transaction["input"],
+        }
+        if replacement["to"] is None:
+            del replacement["to"]
+        if signer is not None:
+            result = signer.send(self.web3, [replacement])[0]
+            if isinstance(result, RPCError):
+                raise result
+            return result
+        return self.web3.eth.sendTransaction(replacement)
+
+
+def rebid_stuck(oracle, txhashes, submitted_blocks, max_wait_blocks=10, strategy="fast", signer=None):
+    """Replace transactions that were not mined within max_wait_blocks.
+
+    :param submitted_blocks: dict txhash -> block number at the time of submission
+    :return: (dict old txhash -> replacement txhash, list of dropped txhashes the caller has to send again)
+    """
+    oracle.refresh(force=True)
+    replaced = {}
+    dropped = []
+    for txhash in txhashes:
+        if oracle.head - submitted_blocks[txhash] >= max_wait_blocks:
+            try:
+                new_txhash = oracle.rebid(txhash, strategy, signer=signer)
+            except DroppedTransaction:
+                print("Transaction {} was dropped".format(txhash))
+                dropped.append(txhash)
+                continue
+            if new_txhash is not None:
+                print("Transaction {} replaced with {}".format(txhash, new_txhash))
+                replaced[txhash] = new_txhash
+    return replaced, dropped
@@ -0,0 +1,296 @@
+"""
+Snapshot of JoyToken holder balances at a given block
+
+Balances are folded from Transfer logs of the underlying ERC20 JoyToken,
+streamed from the deployment block (or from a previous snapshot) up to block
+N. Transfers made through JoyTokenUpgraded also emit ERC223Transfer, but
+always next to the Transfer of the underlying token in the same transaction,
+so folding both would count them twice; only Transfer is folded. The
+constructor assigns the whole supply to the creator without an event, the
+creator is credited explicitly when starting from the deployment.
+
+The snapshot file is columnar, sorted by address:
+
+    magic "JOYBAL01" | block number (int64) | holders (uint64)
+    | holders x 20 bytes address | holders x 32 bytes big-endian amount
+
+and is read through mmap, so a balance lookup is a binary search over the
+address column without loading the file. A snapshot is extended to a later
+block by folding only the newer logs and merging changed holders with the
+old columns.
+
+    python scripts/holder_snapshot.py --token ... --block 3500000 --output joy.balances
+    python scripts/holder_snapshot.py --token ... --block 3600000 --previous joy.balances --output joy.balances
+"""
+
+import argparse
+import mmap
+import os
+import random
+import struct
+
+from chain_context import open_chain
+from log_fetcher import LogFetcher
+from rpc_batch import batch_request, chunked, to_int
+from joy_events import EVENT_TOPICS
+
+
+SNAPSHOT_MAGIC = b"JOYBAL01"
+HEADER = struct.Struct(">8sqQ")
+ADDRESS_SIZE = 20
+AMOUNT_SIZE = 32
+
+BALANCE_OF = "0x70a08231"  # balanceOf(address)
+TOTAL_SUPPLY = "0x18160ddd"  # totalSupply()
+
+
+def address_bytes(address):
+    return bytes.fromhex(address[-40:])
+
+
+def address_hex(key):
+    return "0x" + key.hex()
+
+
+class HolderSnapshot:
+    """Read only view of a snapshot file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fp:
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.block_number, self.holders = HEADER.unpack_from(self.data, 0)
+        if magic != SNAPSHOT_MAGIC:
+            self.data.close()
+            raise ValueError("Not a holder balance snapshot: " + path)
+        self.amounts_offset = HEADER.size + ADDRESS_SIZE * self.holders
+
+    def __len__(self):
+        return self.holders
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.data.close()
+
+    def key(self, position):
+        start = HEADER.size + ADDRESS_SIZE * position
+        return self.data[start:start + ADDRESS_SIZE]
+
+    def amount(self, position):
+        start = self.amounts_offset + AMOUNT_SIZE * position
+        return int.from_bytes(self.data[start:start + AMOUNT_SIZE], "big")
+
+    def find(self, key):
+        """Position of 20 byte address key, None when it holds nothing."""
+        low, high = 0, self.holders
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < self.holders and self.key(low) == key else None
+
+    def balance(self, key):
+        position = self.find(key)
+        return 0 if position is None else self.amount(position)
+
+    def balance_of(self, address):
+        return self.balance(address_bytes(address))
+
+    def items(self):
+        """(20 byte key, amount) of every holder in address order."""
+        for position in range(self.holders):
+            yield self.key(position), self.amount(position)
+
+    def total(self):
+        return sum(amount for _, amount in self.items())
+
+
+def write_snapshot(path, block_number, items):
+    """Write (key, amount) items sorted by key, holders with zero balance are skipped.
+
+    The amount column is spooled to a side file, so items can be a stream of unknown length.
+    """
+    tmp_path = path + ".tmp"
+    amounts_path = path + ".amounts.tmp"
+    holders = 0
+    with open(tmp_path, "wb") as snapshot, open(amounts_path, "w+b") as amounts:
+        snapshot.write(HEADER.pack(SNAPSHOT_MAGIC, block_number, 0))
+        previous = None
+        for key, amount in items:
+            if amount == 0:
+                continue
+            if previous is not None and key <= previous:
+                raise ValueError("Snapshot items must be sorted by address")
+            snapshot.write(key)
+            amounts.write(amount.to_bytes(AMOUNT_SIZE, "big"))
+            previous = key
+            holders += 1
+
+        amounts.seek(0)
+        while True:
+            chunk = amounts.read(1 << 20)
+            if not chunk:
+                break
+            snapshot.write(chunk)
+        snapshot.seek(0)
+        snapshot.write(HEADER.pack(SNAPSHOT_MAGIC, block_number, holders))
+
+    os.remove(amounts_path)
+    os.replace(tmp_path, path)
+    return holders
+
+
+def merge_items(base, changes):
+    """Holders of base snapshot (may be None) with amounts of changed holders replaced, sorted by key."""
+    changed = sorted(changes.items())
+    base_items = base.items() if base is not None else iter(())
+    base_item = next(base_items, None)
+    for key, amount in changed:
+        while base_item is not None and base_item[0] < key:
+            yield base_item
+            base_item = next(base_items, None)
+        if base_item is not None and base_item[0] == key:
+            base_item = next(base_items, None)
+        yield key, amount
+    while base_item is not None:
+        yield base_item
+        base_item = next(base_items, None)
+
+
+class BalanceFolder:
+    """Balances changed since the base snapshot, unchanged holders are read from it on demand."""
+
+    def __init__(self, base=None):
+        self.base = base
+        self.changes = {}  # 20 byte key -> amount
+
+    def balance(self, key):
+        amount = self.changes.get(key)
+        if amount is None:
+            amount = self.base.balance(key) if self.base is not None else 0
+        return amount
+
+    def credit(self, key, amount):
+        self.changes[key] = self.balance(key) + amount
+
+    def debit(self, key, amount):
+        balance = self.balance(key) - amount
+        if balance < 0:
+            raise ValueError("Negative balance of {}, logs are incomplete".format(address_hex(key)))
+        self.changes[key] = balance
+
+    def apply_logs(self, logs):
+        """Fold raw Transfer logs, transfers from the zero address mint tokens."""
+        for log in logs:
+            topics = log["topics"]
+            if len(topics) != 3 or topics[0] != EVENT_TOPICS["Transfer"]:
+                continue
+            sender, receiver = address_bytes(topics[1]), address_bytes(topics[2])
+            value = to_int(log["data"])
+            if any(sender):
+                self.debit(sender, value)
+            self.credit(receiver, value)
+
+
+def export(web3, token, block_number, path, previous=None, from_block=0, creator=None, chunk_size=5000, workers=4):
+    """Write snapshot of token balances at block_number.
+
+    :param previous: path of an older snapshot to extend, logs before its block are not fetched again
+    :param from_block: first block to fetch when there is no previous snapshot (token deployment)
+    :param creator: address that received the initial supply in the constructor
+    :return: number of holders
+    """
+    base = HolderSnapshot(previous) if previous else None
+    try:
+        if base is not None:
+            if base.block_number > block_number:
+                raise ValueError("Snapshot {} is already at block {}".format(previous, base.block_number))
+            from_block = base.block_number + 1
+
+        folder = BalanceFolder(base)
+        if base is None and creator:
+            supply = to_int(batch_request(web3, [("eth_call", [{"to": token, "data": TOTAL_SUPPLY},
+                                                               hex(block_number)])])[0])
+            folder.credit(address_bytes(creator), supply)
+
+        fetcher = LogFetcher(web3, token, [EVENT_TOPICS["Transfer"]], workers=workers, initial_range=chunk_size)
+        for _, _, logs in fetcher.ranges(from_block, block_number):
+            folder.apply_logs(logs)
+
+        # the new file may replace the previous one, write it aside before the base is closed
+        tmp_path = path + ".new"
+        holders = write_snapshot(tmp_path, block_number, merge_items(base, folder.changes))
+    finally:
+        if base is not None:
+            base.close()
+    os.replace(tmp_path, path)
+    return holders
+
+
+def verify(web3, token, snapshot, sample_size=100, seed=None, batch_size=500):
+    """Compare sampled balances and the sum of all balances with the chain at the snapshot block.
+
+    :return: list of (description, snapshot value, chain value) for mismatches
+    """
+    block = hex(snapshot.block_number)
+    rng = random.Random(seed)
+    positions = sorted(rng.sample(range(len(snapshot)), min(sample_size, len(snapshot))))
+
+    mismatches = []
+    for chunk in chunked(positions, batch_size):
+        calls = [("eth_call", [{"to": token, "data": BALANCE_OF + "00" * 12 + snapshot.key(position).hex()}, block])
+                 for position in chunk]
+        for position, result in zip(chunk, batch_request(web3, calls)):
+            expected, actual = snapshot.amount(position), to_int(result)
+            if expected != actual:
+                mismatches.append(("balanceOf " + address_hex(snapshot.key(position)), expected, actual))
+
+    supply = to_int(batch_request(web3, [("eth_call", [{"to": token, "data": TOTAL_SUPPLY}, block])])[0])
+    total = snapshot.total()
+    if total != supply:
+        mismatches.append(("totalSupply", total, supply))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export JoyToken holder balances at a block to a columnar file.")
+    parser.add_argument("--chain", default="ropsten", help="populus chain name")
+    parser.add_argument("--token", required=True, help="underlying ERC20 JoyToken address")
+    parser.add_argument("--block", type=int, help="snapshot block, latest block by default")
+    parser.add_argument("--output", default="joy.balances")
+    parser.add_argument("--previous", help="snapshot to extend, logs before its block are not fetched again")
+    parser.add_argument("--from-block", type=int, default=0, help="token deployment block")
+    parser.add_argument("--creator", help="token creator, receives the initial supply")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="initial blocks per eth_getLogs")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent eth_getLogs requests")
+    parser.add_argument("--verify", type=int, default=100, metavar="N", help="check N sampled balances")
+    args = parser.parse_args()
+
+    with open_chain(args.chain) as chain:
+        web3 = chain.web3
+        block = args.block
+        if block is None:
+            block = to_int(batch_request(web3, [("eth_blockNumber", [])])[0])
+
+        holders = export(web3, args.token, block, args.output, previous=args.previous, from_block=args.from_block,
+                         creator=args.creator, chunk_size=args.chunk_size, workers=args.workers)
+        print("{} holders at block {} written to {}".format(holders, block, args.output))
+
+        if args.verify:
+            with HolderSnapshot(args.output) as snapshot:
+                mismatches = verify(web3, args.token, snapshot, args.verify)
+            for description, expected, actual in mismatches:
+                print("Mismatch {}: snapshot {}, chain {}".format(description, expected, actual))
+            if not mismatches:
+                print("Verification OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Single entry point of the populus tools
+
+    python scripts/joy.py <command> [arguments of the tool]
+    python scripts/joy.py transfer recipients.csv --token 0x...
+    python scripts/joy.py daemon start --chain ropsten
+
+The tool module of a command is imported only when the command runs, so
+listing commands or talking to the daemon needs nothing but the standard
+library. 'daemon start' launches a background process keeping populus,
+web3, the opened chains (chain_context.open_chain) and contract factories
+loaded; while it runs, commands are sent to it over a Unix socket and their
+output and exit status are passed back, so a repeated command starts without
+import and connection costs. The daemon runs one command at a time in the
+working directory of the client. Commands read no input from the client
+terminal: the keystore password has to be given in JOY_KEYSTORE_PASSWORD,
+which is forwarded with the other JOY_* variables. '--local' runs a command
+in this process even when the daemon is up.
+"""
+
+import argparse
+import collections
+import contextlib
+import importlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEPLOY_DIR = os.path.join(SCRIPTS_DIR, "..", "deploy")
+
+DEFAULT_SOCKET = os.environ.get("JOY_DAEMON_SOCKET", ".joy.sock")
+DAEMON_LOG = ".joy.log"
+
+# command -> (module, description), modules provide main() parsing sys.argv
+COMMANDS = collections.OrderedDict([
+    ("stats", ("web3_stats", "check node and populus chain properties")),
+    ("deploy", ("deploy_ropsten", "deploy contracts described in deploy/deploy.json")),
+    ("deploy-demo", ("testnet_deployDemo", "deploy demo token, deposit and game contracts")),
+    ("deploy-subscription", ("testnet_deploySubscription", "deploy subscription contract")),
+    ("dtoken-transfer", ("DToken_transact", "transfer DToken to the demo account")),
+    ("transfer", ("bulk_transfer", "pipelined token transfers from a CSV file")),
+    ("settle", ("settlement_submitter", "settle game sessions from a CSV file")),
+    ("index", ("event_indexer", "index events into SQLite")),
+    ("ledger", ("player_ledger", "follow GameDeposit balances")),
+    ("subscriptions", ("subscription_index", "index subscription periods")),
+    ("snapshot", ("holder_snapshot", "export JoyToken holder balances")),
+    ("reconcile", ("deposit_reconciler", "check GameDeposit accounting invariants")),
+    ("gas-benchmark", ("gas_benchmark", "measure gas of the main flows")),
+    ("load", ("load_generator", "generate synthetic player load")),
+    ("test", ("parallel_tests", "run tests in worker processes")),
+])
+
+
+def exit_code(error):
+    """Exit status of SystemExit raised by a tool."""
+    if error.code is None:
+        return 0
+    if isinstance(error.code, int):
+        return error.code
+    print(error.code, file=sys.stderr)
+    return 1
+
+
+def run_command(command, args):
+    """Import tool module of command and run its main() with args, return exit status."""
+    if command not in COMMANDS:
+        raise KeyError("Unknown command: " + command)
+    for path in (SCRIPTS_DIR, DEPLOY_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    module = importlib.import_module(COMMANDS[command][0])
+    saved_argv = sys.argv
+    sys.argv = ["joy.py " + command] + list(args)
+    try:
+        module.main()
+    except SystemExit as error:
+        return exit_code(error)
+    finally:
+        sys.argv = saved_argv
+    return 0
+
+
+# ---------------------------------------- daemon ----------------------------------------
+
+def send_message(connection, message):
+    connection.sendall((json.dumps(message) + "\n").encode())
+
+
+class SocketStream:
+    """Text stream forwarding writes of a command to the client."""
+
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+
+    def write(self, text):
+        if text:
+            send_message(self.connection, {self.name: text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+@contextlib.contextmanager
+def client_environment(cwd, env):
+    """Working directory and JOY_* variables of the client for the duration of a command."""
+    saved_cwd = os.getcwd()
+    saved_env = {name: value for name, value in os.environ.items() if name.startswith("JOY_")}
+    os.chdir(cwd)
+    for name in saved_env:
+        del os.environ[name]
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        os.chdir(saved_cwd)
+        for name in [name for name in os.environ if name.startswith("JOY_")]:
+            del os.environ[name]
+        os.environ.update(saved_env)
+
+
+class Daemon:
+    """Runs commands sent to the Unix socket in this process, keeping chains warm between them."""
+
+    def __init__(self, socket_path, chains=()):
+        self.socket_path = os.path.abspath(socket_path)
+        self.preload = list(chains)
+        self.started = time.time()
+        self.commands = 0
+        self.warm = None
+        self.stopped = threading.Event()
+        self.ready = threading.Event()
+
+    def status(self):
+        return {"pid": os.getpid(), "uptime": time.time() - self.started, "commands": self.commands,
+                "chains": self.warm.names() if self.warm else []}
+
+    def handle(self, connection):
+        request = json.loads(connection.makefile("r").readline())
+        if request.get("stop"):
+            self.stopped.set()
+            send_message(connection, {"status": self.status()})
+            return
+        if request.get("status"):
+            send_message(connection, {"status": self.status()})
+            return
+
+        import artifact_cache
+        import rpc_metrics
+
+        stdout, stderr = SocketStream(connection, "stdout"), SocketStream(connection, "stderr")
+        with client_environment(request["cwd"], request.get("env", {})):
+            # sources may have changed since the previous command
+            artifact_cache.refresh_default_cache()
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                try:
+                    try:
+                        code = run_command(request["argv"][0], request["argv"][1:])
+                    finally:
+                        # JOY_RPC_METRICS of this command, the daemon exits much later
+                        rpc_metrics.dump_env_metrics()
+                except Exception:
+                    traceback.print_exc()
+                    code = 1
+        self.commands += 1
+        send_message(connection, {"exit": code})
+
+    def serve(self):
+        import chain_context
+
+        self.warm = chain_context.keep_warm()
+        for chain_name in self.preload:
+            self.warm.get(chain_name)
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen(8)
+        server.settimeout(0.5)
+        self.ready.set()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    continue
+                with connection:
+                    connection.settimeout(None)
+                    try:
+                        self.handle(connection)
+                    except (BrokenPipeError, ConnectionResetError):
+                        # client went away, the command output is lost
+                        pass
+        finally:
+            server.close()
+            os.remove(self.socket_path)
+            chain_context.release_warm()
+
+
+def request_daemon(socket_path, request, stdout=None, stderr=None):
+    """Send request to a running daemon, echo output of the command.
+
+    :return: final reply (dict with "exit" or "status"), None when no daemon listens on socket_path
+    """
+    if not os.path.exists(socket_path):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        connection.close()
+        return None
+
+    streams = {"stdout": stdout or sys.stdout, "stderr": stderr or sys.stderr}
+    with connection:
+        send_message(connection, request)
+        for line in connection.makefile("r"):
+            message = json.loads(line)
+            for name, stream in streams.items():
+                if name in message:
+                    stream.write(message[name])
+                    stream.flush()
+            if "exit" in message or "status" in message:
+                return message
+    raise ConnectionError("Daemon closed connection without exit status")
+
+
+def command_request(argv):
+    return {"argv": list(argv), "cwd": os.getcwd(),
+            "env": {name: value for name, value in os.environ.items() if name.startswith("JOY_")}}
+
+
+def start_daemon(socket_path, chains, timeout=120):
+    if request_daemon(socket_path, {"status": True}) is not None:
+        print("Daemon is already running")
+        return 0
+
+    arguments = [sys.executable, os.path.abspath(__file__), "--socket", socket_path, "daemon", "serve"]
+    for chain_name in chains:
+        arguments += ["--chain", chain_name]
+    with open(DAEMON_LOG, "a") as log:
+        process = subprocess.Popen(arguments, stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                                   start_new_session=True)
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        reply = request_daemon(socket_path, {"status": True})
+        if reply is not None:
+            print("Daemon started, pid {}".format(reply["status"]["pid"]))
+            return 0
+        if process.poll() is not None:
+            print("Daemon exited with status {}, see {}".format(process.returncode, DAEMON_LOG))
+            return 1
+        time.sleep(0.1)
+    print("Daemon did not start in {} seconds, see {}".format(timeout, DAEMON_LOG))
+    return 1
+
+
+def daemon_command(socket_path, args):
+    parser = argparse.ArgumentParser(prog="joy.py daemon", description="Manage the warm background process.")
+    parser.add_argument("action", choices=("start", "stop", "status", "serve"))
+    parser.add_argument("--chain", action="append", default=[], help="chain opened at start, may be repeated")
+    args = parser.parse_args(args)
+
+    if args.action == "serve":
+        Daemon(socket_path, args.chain).serve()
+        return 0
+    if args.action == "start":
+        return start_daemon(socket_path, args.chain)
+
+    reply = request_daemon(socket_path, {args.action: True})
+    if reply is None:
+        print("Daemon is not running")
+        return 1 if args.action == "status" else 0
+    status = reply["status"]
+    print("Daemon pid {}, up {:.0f} s, {} commands, chains: {}".format(
+        status["pid"], status["uptime"], status["commands"], ", ".join(status["chains"]) or "-"))
+    if args.action == "stop":
+        print("Daemon stopped")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="joy.py", description="Run populus tools, in a warm daemon when it is running.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="commands:\n" + "\n".join("  {:<20} {}".format(name, description)
+                                        for name, (_, description) in COMMANDS.items())
+        + "\n  {:<20} {}".format("daemon", "start|stop|status the warm background process"))
+    parser.add_argument("--local", action="store_true", help="run in this process even when the daemon is up")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="daemon socket path")
+    parser.add_argument("command", choices=list(COMMANDS) + ["daemon"], metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="arguments of the command")
+    args = parser.parse_args()
+
+    if args.command == "daemon":
+        exit(daemon_command(args.socket, args.args))
+
+    if not args.local:
+        reply = request_daemon(args.socket, command_request([args.command] + args.args))
+        if reply is not None:
+            exit(reply["exit"])
+    exit(run_command(args.command, args.args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Definitions of events emitted by Joy Platform contracts
+
+Event ABIs mirror declarations in contracts/ directory, topics are
+keccak256 hashes of event signatures, precomputed so that decoding raw
+logs does not need contract factories nor hashing libraries.
+"""
+
+from rpc_batch import to_int
+
+
+def event_input(name, abi_type, indexed):
+    return {"name": name, "type": abi_type, "indexed": indexed}
+
+
+# contracts/game/JoyGameAbstract.sol
+NEW_GAME_SESSION = {
+    "type": "event", "name": "NewGameSession", "anonymous": False,
+    "inputs": [
+        event_input("player", "address", True),
+        event_input("start_balance", "uint256", False),
+    ],
+}
+
+REFRESH_GAME_SESSION = {
+    "type": "event", "name": "RefreshGameSession", "anonymous": False,
+    "inputs": [
+        event_input("player", "address", True),
+        event_input("increased_value", "uint256", False),
+    ],
+}
+
+END_GAME_INFO = {
+    "type": "event", "name": "EndGameInfo", "anonymous": False,
+    "inputs": [
+        event_input("player", "address", True),
+        event_input("start_balance", "uint256", False),
+        event_input("remainBalance", "uint256", False),
+        event_input("finalBalance", "uint256", False),
+        event_input("gameProcessId", "bytes32", True),
+        event_input("gameSignature", "bytes32", True),
+    ],
+}
+
+# contracts/token/JoyToken_Upgraded.sol
+ERC223_TRANSFER = {
+    "type": "event", "name": "ERC223Transfer", "anonymous": False,
+    "inputs": [
+        event_input("from", "address", True),
+        event_input("to", "address", True),
+        event_input("value", "uint256", False),
+        event_input("data", "bytes", False),
+    ],
+}
+
+CUSTOM_DEPOSIT = {
+    "type": "event", "name": "CustomDeposit", "anonymous": False,
+    "inputs": [
+        event_input("from", "address", True),
+        event_input("to", "address", True),
+        event_input("game", "address", True),
+        event_input("value", "uint256", False),
+        event_input("data", "bytes", False),
+    ],
+}
+
+# ERC20 Transfer of underlying JoyToken (openzeppelin StandardToken)
+TRANSFER = {
+    "type": "event", "name": "Transfer", "anonymous": False,
+    "inputs": [
+        event_input("from", "address", True),
+        event_input("to", "address", True),
+        event_input("value", "uint256", False),
+    ],
+}
+
+# contracts/subscribe/Subscription.sol
+NEW_SUBSCRIPTION = {
+    "type": "event", "name": "newSubscription", "anonymous": False,
+    "inputs": [
+        event_input("buyer", "address", True),
+        event_input("price", "uint256", False),
+        event_input("timepoint", "uint256", False),
+        event_input("amountOfTime", "uint256", False),
+    ],
+}
+
+
+# keccak256 of canonical event signature
+EVENT_TOPICS = {
+    "NewGameSession": "0x94ce6c357ff85092600736e47b224445c7efd07bfb0c548a2d66660ae7686e80",
+    "RefreshGameSession": "0x9b11ad4a0fc31893e827d1f28d31579446e5b020194e0a4f478ff5c5b320d6de",
+    "EndGameInfo": "0xb092f949858c15d4942b7649331f34b4f920026290d2606c7d057c0e9f7c89f2",
+    "ERC223Transfer": "0x9bfafdc2ae8835972d7b64ef3f8f307165ac22ceffde4a742c52da5487f45fd1",
+    "CustomDeposit": "0x96372007b8af586bdc26e7e24c0bb62cd5a38c99276d60954009d90eb229af10",
+    "Transfer": "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef",
+    "newSubscription": "0x91abf8c7837f891658644187392bd0d8dfbad97b0fc1cb9346b45118ca518384",
+}
+
+EVENTS = [NEW_GAME_SESSION, REFRESH_GAME_SESSION, END_GAME_INFO,
+          ERC223_TRANSFER, CUSTOM_DEPOSIT, TRANSFER, NEW_SUBSCRIPTION]
+
+EVENTS_BY_NAME = {event["name"]: event for event in EVENTS}
+EVENTS_BY_TOPIC = {EVENT_TOPICS[event["name"]]: event for event in EVENTS}
+
+
+def event_signature(event_abi):
+    return event_abi["name"] + "(" + ",".join(i["type"] for i in event_abi["inputs"]) + ")"
+
+
+def hex_to_bytes(value):
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    if value.startswith("0x"):
+        value = value[2:]
+    return bytes.fromhex(value)
+
+
+def decode_word(abi_type, word):
+    if abi_type == "address":
+        return "0x" + word[12:].hex()
+    if abi_type.startswith("uint"):
+        return int.from_bytes(word, "big")
+    if abi_type == "bool":
+        return word[-1] == 1
+    if abi_type == "bytes32":
+        return word
+    raise ValueError("Unsupported static type: " + abi_type)
+
+
+def decode_data(inputs, data):
+    """Decode non-indexed event arguments, supports static types and dynamic 'bytes'."""
+    values = {}
+    for position, event_arg in enumerate(inputs):
+        word = data[32 * position:32 * (position + 1)]
+        if event_arg["type"] == "bytes":
+            offset = int.from_bytes(word, "big")
+            length = int.from_bytes(data[offset:offset + 32], "big")
+            values[event_arg["name"]] = data[offset + 32:offset + 32 + length]
+        else:
+            values[event_arg["name"]] = decode_word(event_arg["type"], word)
+    return values
+
+
+def decode_log(log):
+    """Decode raw log returned by eth_getLogs.
+
+    :return: dict similar to web3 event data, or None for unknown events
+    """
+    topics = [topic if isinstance(topic, str) else "0x" + hex_to_bytes(topic).hex() for topic in log["topics"]]
+    if not topics or topics[0] not in EVENTS_BY_TOPIC:
+        return None
+
+    event_abi = EVENTS_BY_TOPIC[topics[0]]
+    indexed = [i for i in event_abi["inputs"] if i["indexed"]]
+    non_indexed = [i for i in event_abi["inputs"] if not i["indexed"]]
+
+    args = {}
+    for event_arg, topic in zip(indexed, topics[1:]):
+        args[event_arg["name"]] = decode_word(event_arg["type"], hex_to_bytes(topic))
+    args.update(decode_data(non_indexed, hex_to_bytes(log["data"])))
+
+    return {
+        "event": event_abi["name"],
+        "args": args,
+        "address": log["address"].lower(),
+        "blockNumber": to_int(log["blockNumber"]),
+        "blockHash": log["blockHash"],
+        "transactionHash": log["transactionHash"],
+        "logIndex": to_int(log["logIndex"]),
+    }
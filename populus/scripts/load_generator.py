@@ -0,0 +1,329 @@
+"""
+Synthetic player load on GameDeposit and JoyGamePlatform
+
+Deploys the platform on a local chain (as gas_benchmark.py does), creates N
+player accounts funded with ether and JoyToken, then drives game cycles at a
+target rate of transactions per second:
+
+    transferToGame (new session) -> transferToGame (refresh, optional)
+        -> accountGameResult or payOutGameResult by the owner
+
+Players, stakes, refreshes, settlement kinds and game results are drawn from
+a seeded generator, so runs with the same seed play the same cycles.
+Receipts are polled in batches; the report gives achieved transactions per
+second, latency percentiles of every stage (submission until receipt), gas
+used per block with block gas limit utilization and the number of reverted
+transactions.
+
+    python scripts/load_generator.py --players 200 --rate 20 --duration 120 --seed 1
+"""
+
+import argparse
+import collections
+import json
+import math
+import random
+import time
+
+from chain_context import open_chain
+from gas_benchmark import Platform, BIG_ALLOWANCE
+from rpc_batch import batch_request, chunked, poll_receipts, to_int
+
+
+STAGES = ("start", "refresh", "settle")
+
+PLAYER_PASSWORD = "load-generator"
+PLAYER_ETHER = 10 ** 18
+PLAYER_TOKENS = 10 ** 22
+
+
+class Cycle:
+    """One game session of a player, planned ahead from the seed."""
+
+    def __init__(self, player, stake, refresh_stake, pay_out, result_ratio):
+        self.player = player
+        self.stake = stake
+        self.refresh_stake = refresh_stake  # 0 without refresh
+        self.pay_out = pay_out
+        self.result_ratio = result_ratio  # final balance as a fraction of locked funds
+
+    def stages(self):
+        return [stage for stage in STAGES if stage != "refresh" or self.refresh_stake]
+
+    def final_balance(self):
+        return int((self.stake + self.refresh_stake) * self.result_ratio)
+
+
+class CyclePlanner:
+    """Reproducible stream of cycles of given players."""
+
+    def __init__(self, players, seed=0, min_stake=10 ** 17, max_stake=10 ** 19, refresh_probability=0.5,
+                 pay_out_probability=0.2, max_win=2.0):
+        self.players = list(players)
+        self.random = random.Random(seed)
+        self.min_stake = min_stake
+        self.max_stake = max_stake
+        self.refresh_probability = refresh_probability
+        self.pay_out_probability = pay_out_probability
+        self.max_win = max_win
+
+    def next_cycle(self):
+        player = self.random.choice(self.players)
+        stake = self.random.randint(self.min_stake, self.max_stake)
+        refresh_stake = self.random.randint(self.min_stake, self.max_stake) \
+            if self.random.random() < self.refresh_probability else 0
+        pay_out = self.random.random() < self.pay_out_probability
+        result_ratio = self.random.uniform(0, self.max_win)
+        return Cycle(player, stake, refresh_stake, pay_out, result_ratio)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of unsorted values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+class LoadStats:
+    """Latencies, gas and reverts collected during a run."""
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)  # stage -> seconds
+        self.sent = collections.Counter()
+        self.mined = collections.Counter()
+        self.reverted = collections.Counter()
+        self.block_gas = collections.Counter()  # block number -> gas used by generated transactions
+        self.block_limits = {}  # block number -> (gas used by all transactions, gas limit)
+        self.started = None
+        self.finished = None
+
+    def record_receipt(self, stage, latency, receipt):
+        self.mined[stage] += 1
+        self.latencies[stage].append(latency)
+        self.block_gas[receipt["blockNumber"]] += receipt["gasUsed"]
+        if receipt.get("status") == 0:
+            self.reverted[stage] += 1
+
+    def report(self):
+        elapsed = (self.finished or time.time()) - self.started if self.started else 0
+        mined = sum(self.mined.values())
+        report = {
+            "elapsed": elapsed,
+            "sent": sum(self.sent.values()),
+            "mined": mined,
+            "reverted": sum(self.reverted.values()),
+            "tps": mined / elapsed if elapsed else 0.0,
+            "stages": {},
+            "blocks": len(self.block_gas),
+        }
+        for stage in STAGES:
+            latencies = self.latencies[stage]
+            report["stages"][stage] = {
+                "sent": self.sent[stage],
+                "mined": self.mined[stage],
+                "reverted": self.reverted[stage],
+                "latency_p50": percentile(latencies, 0.5),
+                "latency_p90": percentile(latencies, 0.9),
+                "latency_p99": percentile(latencies, 0.99),
+                "latency_max": max(latencies) if latencies else None,
+            }
+        if self.block_gas:
+            gas = list(self.block_gas.values())
+            report["gas_per_block_mean"] = sum(gas) / len(gas)
+            report["gas_per_block_max"] = max(gas)
+        if self.block_limits:
+            report["block_utilization_max"] = max(used / limit for used, limit in self.block_limits.values())
+        return report
+
+
+def create_players(platform, count):
+    """New unlocked accounts with ether for gas and JoyToken approved for JoyTokenUpgraded."""
+    web3 = platform.web3
+    players = []
+    for _ in range(count):
+        player = web3.personal.newAccount(PLAYER_PASSWORD)
+        web3.personal.unlockAccount(player, PLAYER_PASSWORD)
+        platform.wait(web3.eth.sendTransaction({"from": platform.owner, "to": player, "value": PLAYER_ETHER}))
+        platform.wait(platform.token.transact({"from": platform.owner}).transfer(player, PLAYER_TOKENS))
+        platform.wait(platform.token.transact({"from": player}).approve(platform.upgraded.address, BIG_ALLOWANCE))
+        players.append(player)
+    return players
+
+
+class LoadGenerator:
+    """Sends stages of planned cycles at 'rate' transactions per second.
+
+    Every player has at most one transaction in flight, the next stage of its
+    cycle is sent after the receipt of the previous one. Cycles are started in
+    planned order; a cycle of a busy player waits until the player is idle, so
+    every player plays the same cycles in the same order for the same seed.
+    Waiting cycles are limited to the number of players, no cycle is started
+    while that many are waiting.
+    """
+
+    def __init__(self, platform, planner, rate=10.0, poll_interval=0.5):
+        self.platform = platform
+        self.web3 = platform.web3
+        self.planner = planner
+        self.rate = rate
+        self.poll_interval = poll_interval
+        self.stats = LoadStats()
+
+        self.idle = set(planner.players)
+        self.deferred = collections.defaultdict(collections.deque)  # player -> planned cycles waiting for it
+        self.deferred_count = 0
+        self.resumable = collections.deque()  # idle players with deferred cycles
+        self.ready = collections.deque()  # (cycle, stage index) waiting for a send slot
+        self.in_flight = {}  # txhash -> (cycle, stage index, send time)
+        self.process_ids = 0
+
+    def send(self, cycle, stage):
+        platform = self.platform
+        game, deposit = platform.game.address, platform.deposit.address
+        if stage == "start":
+            return platform.upgraded.transact({"from": cycle.player}).transferToGame(deposit, game, cycle.stake, b"")
+        if stage == "refresh":
+            return platform.upgraded.transact({"from": cycle.player}).transferToGame(deposit, game,
+                                                                                    cycle.refresh_stake, b"")
+        self.process_ids += 1
+        settlement = platform.game.transact({"from": platform.owner})
+        method = settlement.payOutGameResult if cycle.pay_out else settlement.accountGameResult
+        return method(cycle.player, 0, cycle.final_balance(), self.process_ids.to_bytes(32, "big"), b"\x01" * 32)
+
+    def player_done(self, player):
+        if self.deferred[player]:
+            self.resumable.append(player)
+        else:
+            self.idle.add(player)
+
+    def start_cycle(self):
+        """Next planned cycle of an idle player, None when all players are busy."""
+        if self.resumable:
+            self.deferred_count -= 1
+            return self.deferred[self.resumable.popleft()].popleft()
+        while self.deferred_count < len(self.planner.players):
+            cycle = self.planner.next_cycle()
+            if cycle.player in self.idle:
+                self.idle.discard(cycle.player)
+                return cycle
+            self.deferred[cycle.player].append(cycle)
+            self.deferred_count += 1
+        return None
+
+    def send_next(self):
+        """Send one transaction, starting a new cycle when no stage is waiting."""
+        if self.ready:
+            cycle, index = self.ready.popleft()
+        else:
+            cycle, index = self.start_cycle(), 0
+            if cycle is None:
+                return False
+
+        stage = cycle.stages()[index]
+        self.stats.sent[stage] += 1
+        start = time.perf_counter()
+        try:
+            txhash = self.send(cycle, stage)
+        except Exception:
+            # node refused the transaction, e.g. it reverts in gas estimation or in the tester chain
+            self.stats.reverted[stage] += 1
+            self.player_done(cycle.player)
+            return True
+        self.in_flight[txhash] = (cycle, index, start)
+        return True
+
+    def collect_receipts(self):
+        receipts = poll_receipts(self.web3, list(self.in_flight))
+        now = time.perf_counter()
+        for txhash, receipt in receipts.items():
+            cycle, index, start = self.in_flight.pop(txhash)
+            stages = cycle.stages()
+            self.stats.record_receipt(stages[index], now - start, receipt)
+            if receipt.get("status") == 0 or index + 1 == len(stages):
+                # reverted or settled cycle, the player starts over
+                self.player_done(cycle.player)
+            else:
+                self.ready.append((cycle, index + 1))
+
+    def run(self, duration):
+        """Generate load for 'duration' seconds, then wait for transactions in flight."""
+        stats = self.stats
+        stats.started = time.time()
+        deadline = stats.started + duration
+        next_poll = 0
+
+        while time.time() < deadline:
+            due = int((time.time() - stats.started) * self.rate) - sum(stats.sent.values())
+            while due > 0 and self.send_next():
+                due -= 1
+            if time.time() >= next_poll and self.in_flight:
+                self.collect_receipts()
+                next_poll = time.time() + self.poll_interval
+            time.sleep(min(1.0 / self.rate, self.poll_interval))
+
+        drain_deadline = time.time() + 120
+        while self.in_flight and time.time() < drain_deadline:
+            self.collect_receipts()
+            if self.in_flight:
+                time.sleep(self.poll_interval)
+        stats.finished = time.time()
+
+        self.load_block_limits()
+        return stats.report()
+
+    def load_block_limits(self):
+        numbers = sorted(self.stats.block_gas)
+        for chunk in chunked(numbers, 500):
+            blocks = batch_request(self.web3, [("eth_getBlockByNumber", [hex(number), False]) for number in chunk])
+            for number, block in zip(chunk, blocks):
+                if block is not None:
+                    self.stats.block_limits[number] = (to_int(block["gasUsed"]), to_int(block["gasLimit"]))
+
+
+def print_report(report):
+    print("{} transactions sent, {} mined, {} reverted in {:.1f} s: {:.2f} tx/s".format(
+        report["sent"], report["mined"], report["reverted"], report["elapsed"], report["tps"]))
+    for stage, values in report["stages"].items():
+        if not values["sent"]:
+            continue
+        print("  {:<8} sent {:>6} reverted {:>5}  latency ms p50 {} p90 {} p99 {}".format(
+            stage, values["sent"], values["reverted"],
+            *["{:.0f}".format(values[key] * 1000) if values[key] is not None else "-"
+              for key in ("latency_p50", "latency_p90", "latency_p99")]))
+    if "gas_per_block_mean" in report:
+        print("  {} blocks, gas per block mean {:.0f} max {}".format(
+            report["blocks"], report["gas_per_block_mean"], report["gas_per_block_max"]))
+    if "block_utilization_max" in report:
+        print("  max block gas limit utilization {:.1%}".format(report["block_utilization_max"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic player load on the game/deposit contracts.")
+    parser.add_argument("--chain", default="tester", help="populus chain name, local chain by default")
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=10.0, help="target transactions per second")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--refresh-probability", type=float, default=0.5)
+    parser.add_argument("--pay-out-probability", type=float, default=0.2)
+    parser.add_argument("--output", help="write report to JSON file")
+    args = parser.parse_args()
+
+    with open_chain(args.chain) as chain:
+        platform = Platform(chain)
+        print("Creating {} players...".format(args.players))
+        players = create_players(platform, args.players)
+        planner = CyclePlanner(players, seed=args.seed, refresh_probability=args.refresh_probability,
+                               pay_out_probability=args.pay_out_probability)
+        report = LoadGenerator(platform, planner, rate=args.rate).run(args.duration)
+
+    report["seed"] = args.seed
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Vectorized decoder of raw logs into columnar NumPy arrays
+
+Used for backfills where per-log decoding (web3 event filters or
+joy_events.decode_log) dominates run time. A topic -> layout table is built
+once from event ABIs; a batch of logs is grouped by topic and every group is
+converted with a single hex decode into a (logs x words x 32) byte array,
+from which static fields are sliced as whole columns:
+
+    address   -> S20 (raw 20 bytes)
+    bytes32   -> S32
+    bool      -> bool
+    uint256   -> object array of python ints, or (n, 4) uint64 big-endian limbs
+    bytes     -> object array of bytes, decoded per log (the only slow path)
+
+Log metadata is returned as columns too: address, blockNumber, logIndex,
+transactionHash and position (index of the log in the input batch).
+
+NumPy is optional for the rest of the scripts and required only here.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from joy_events import EVENTS, EVENT_TOPICS, event_signature
+from rpc_batch import to_int
+
+
+WORD = 32
+UINT_MODES = ("object", "limbs")
+
+
+def strip_hex(value):
+    """Hex digits of a string or bytes value, without 0x prefix."""
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).hex()
+    return value[2:] if value.startswith("0x") else value
+
+
+class EventLayout:
+    """Position of every event argument in topics or in the data words."""
+
+    def __init__(self, topic, event_abi):
+        self.topic = topic
+        self.name = event_abi["name"]
+        self.topic_fields = []  # (name, type, index in topics[1:])
+        self.data_fields = []  # (name, type, word index in data head)
+        for event_arg in event_abi["inputs"]:
+            if event_arg["indexed"]:
+                self.topic_fields.append((event_arg["name"], event_arg["type"], len(self.topic_fields)))
+            else:
+                self.data_fields.append((event_arg["name"], event_arg["type"], len(self.data_fields)))
+
+    @property
+    def head_words(self):
+        # every argument, dynamic one included, has a single word in data head
+        return len(self.data_fields)
+
+
+def words_array(hex_rows, words):
+    """Decode equally long hex strings into uint8 array of shape (rows, words, 32)."""
+    raw = bytes.fromhex("".join(hex_rows))
+    return np.frombuffer(raw, dtype=np.uint8).reshape(len(hex_rows), words, WORD)
+
+
+def fixed_column(hex_rows, size):
+    """Decode equally long hex strings into S<size> column."""
+    raw = bytes.fromhex("".join(hex_rows))
+    return np.frombuffer(raw, dtype=np.uint8).reshape(len(hex_rows), size).view("S{}".format(size)).reshape(-1)
+
+
+def column(abi_type, words, uint_mode):
+    """Convert (n, 32) uint8 words into a column of given ABI type."""
+    if abi_type == "address":
+        return np.ascontiguousarray(words[:, 12:]).view("S20").reshape(-1)
+    if abi_type == "bytes32":
+        return np.ascontiguousarray(words).view("S32").reshape(-1)
+    if abi_type == "bool":
+        return words[:, -1] != 0
+    if abi_type.startswith("uint"):
+        limbs = np.ascontiguousarray(words).view(">u8").reshape(-1, 4).astype(np.uint64)
+        if uint_mode == "limbs":
+            return limbs
+        values = limbs.astype(object)
+        return (values[:, 0] << 192) | (values[:, 1] << 128) | (values[:, 2] << 64) | values[:, 3]
+    raise ValueError("Unsupported static type: " + abi_type)
+
+
+def dynamic_bytes(data_hex, offset_words):
+    """Slow path: read dynamic 'bytes' of every log using offsets from the data head."""
+    values = np.empty(len(data_hex), dtype=object)
+    for row, (data, offset) in enumerate(zip(data_hex, offset_words)):
+        offset = int.from_bytes(offset.tobytes(), "big")
+        length = int(data[2 * offset:2 * (offset + WORD)], 16)
+        start = 2 * (offset + WORD)
+        values[row] = bytes.fromhex(data[start:start + 2 * length])
+    return values
+
+
+class LogDecoder:
+    """Decodes batches of raw logs into dict event name -> dict column name -> array.
+
+    :param events: list of (topic, event ABI) pairs, Joy Platform events by default
+    :param uint_mode: 'object' for python ints or 'limbs' for (n, 4) uint64 arrays
+    """
+
+    def __init__(self, events=None, uint_mode="object"):
+        if np is None:
+            raise ImportError("log_decoder requires numpy, install it with 'pip install numpy'")
+        if uint_mode not in UINT_MODES:
+            raise ValueError("uint_mode must be one of " + ", ".join(UINT_MODES))
+        if events is None:
+            events = [(EVENT_TOPICS[event["name"]], event) for event in EVENTS]
+
+        self.uint_mode = uint_mode
+        self.layouts = {topic.lower(): EventLayout(topic.lower(), event_abi) for topic, event_abi in events}
+        self.unknown = 0
+
+    @classmethod
+    def from_artifact_cache(cls, cache, contract_names, uint_mode="object"):
+        """Layouts for all events of contracts from ArtifactCache, topics are taken from the cache index."""
+        events = {}
+        for name in contract_names:
+            topics = cache.topics(name)
+            for entry in cache.artifact(name)["abi"]:
+                if entry.get("type") == "event" and not entry.get("anonymous"):
+                    events[topics[event_signature(entry)]] = entry
+        return cls(list(events.items()), uint_mode=uint_mode)
+
+    def group(self, logs):
+        groups = {}
+        for position, log in enumerate(logs):
+            topics = log["topics"]
+            topic = "0x" + strip_hex(topics[0]).lower() if topics else None
+            if topic not in self.layouts:
+                self.unknown += 1
+                continue
+            groups.setdefault(topic, []).append(position)
+        return groups
+
+    def decode_group(self, layout, logs):
+        count = len(logs)
+        columns = {
+            "address": fixed_column([strip_hex(log["address"]) for log in logs], 20),
+            "blockNumber": np.fromiter((to_int(log["blockNumber"]) for log in logs), dtype=np.int64, count=count),
+            "logIndex": np.fromiter((to_int(log["logIndex"]) for log in logs), dtype=np.int64, count=count),
+            "transactionHash": fixed_column([strip_hex(log["transactionHash"]) for log in logs], 32),
+        }
+
+        if layout.topic_fields:
+            topic_words = words_array(["".join(strip_hex(topic) for topic in log["topics"][1:]) for log in logs],
+                                      len(layout.topic_fields))
+            for name, abi_type, index in layout.topic_fields:
+                columns[name] = column(abi_type, topic_words[:, index], self.uint_mode)
+
+        if layout.data_fields:
+            data_hex = [strip_hex(log["data"]) for log in logs]
+            head_size = 2 * WORD * layout.head_words
+            data_words = words_array([data[:head_size] for data in data_hex], layout.head_words)
+            for name, abi_type, index in layout.data_fields:
+                if abi_type == "bytes":
+                    columns[name] = dynamic_bytes(data_hex, data_words[:, index])
+                else:
+                    columns[name] = column(abi_type, data_words[:, index], self.uint_mode)
+
+        return columns
+
+    def decode(self, logs):
+        """Decode logs returned by eth_getLogs, logs of unknown events are skipped and counted."""
+        batch = {}
+        for topic, positions in self.group(logs).items():
+            layout = self.layouts[topic]
+            columns = self.decode_group(layout, [logs[position] for position in positions])
+            columns["position"] = np.asarray(positions, dtype=np.int64)
+            batch[layout.name] = columns
+        return batch
+
+
+def address_hex(column_values):
+    """Hex strings of S20 address column, restoring trailing zero bytes dropped by numpy."""
+    return ["0x" + value.ljust(20, b"\0").hex() for value in column_values]
+
+
+def bytes32_hex(column_values):
+    return ["0x" + value.ljust(32, b"\0").hex() for value in column_values]
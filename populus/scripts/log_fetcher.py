@@ -0,0 +1,167 @@
+"""
+Parallel, adaptive eth_getLogs over large block spans
+
+A span is split into block ranges fetched concurrently by a bounded pool of
+worker threads. A range the node refuses ("query returned more than N
+results", response size limits, timeouts) is halved and both halves are
+fetched again; ranges grow again while they return few logs, so sparse
+history is covered with few requests and dense history with small ones.
+
+Ranges are yielded strictly in block order and logs inside a range are
+sorted by (blockNumber, logIndex), so the result is a stream in chain order.
+Only a bounded window of ranges is fetched ahead, memory does not depend on
+the length of the span.
+
+    fetcher = LogFetcher(web3, address=token, topics=[EVENT_TOPICS["Transfer"]])
+    for log in fetcher.stream(0, head):
+        ...
+"""
+
+import collections
+import concurrent.futures
+import socket
+
+from rpc_batch import batch_request, to_int, RPCError
+
+
+# fragments of node errors meaning the range is too large (geth, parity, infura, alchemy)
+RANGE_ERRORS = ("more than", "too many", "limit exceeded", "response size", "query timeout", "timed out",
+                "block range", "exceed")
+
+
+def is_range_error(error):
+    """True when a smaller block range could succeed."""
+    if isinstance(error, RPCError):
+        return any(fragment in str(error.error).lower() for fragment in RANGE_ERRORS)
+    # timeouts of HTTP (requests) or IPC (socket) transport
+    return isinstance(error, (TimeoutError, socket.timeout)) or "Timeout" in type(error).__name__
+
+
+def log_position(log):
+    return to_int(log["blockNumber"]), to_int(log["logIndex"])
+
+
+class BlockRange:
+    """Blocks [start, end] and the future of their logs."""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.future = None
+        self.attempts = 0
+
+    def __len__(self):
+        return self.end - self.start + 1
+
+
+class LogFetcher:
+    """Fetches logs matching address and topics over block spans.
+
+    :param workers: concurrent eth_getLogs requests
+    :param initial_range: blocks in the first ranges
+    :param target_logs: ranges grow while they return fewer logs than half of this, and shrink above it
+    :param retries: attempts of a range failing for other reasons than its size
+    """
+
+    def __init__(self, web3, address=None, topics=None, workers=4, initial_range=2000, min_range=1,
+                 max_range=100000, target_logs=2000, retries=3):
+        self.web3 = web3
+        self.address = address
+        self.topics = topics
+        self.workers = workers
+        self.range_size = initial_range
+        self.min_range = min_range
+        self.max_range = max_range
+        self.target_logs = target_logs
+        self.retries = retries
+        self.requests = 0
+        self.splits = 0
+
+    def fetch(self, block_range):
+        params = {"fromBlock": hex(block_range.start), "toBlock": hex(block_range.end)}
+        if self.address is not None:
+            params["address"] = self.address
+        if self.topics is not None:
+            params["topics"] = self.topics
+        self.requests += 1
+        logs = batch_request(self.web3, [("eth_getLogs", [params])])[0]
+        logs.sort(key=log_position)
+        return logs
+
+    def adapt(self, block_range, logs):
+        """Size of the next new range from the result of the last one."""
+        if len(logs) < self.target_logs // 2:
+            self.range_size = min(max(self.range_size, len(block_range)) * 2, self.max_range)
+        elif len(logs) > self.target_logs:
+            self.range_size = max(len(block_range) // 2, self.min_range)
+
+    def split(self, ranges, position, error):
+        block_range = ranges[position]
+        if len(block_range) <= self.min_range:
+            raise error
+        middle = block_range.start + len(block_range) // 2 - 1
+        ranges[position] = BlockRange(block_range.start, middle)
+        ranges.insert(position + 1, BlockRange(middle + 1, block_range.end))
+        self.range_size = max(len(ranges[position]), self.min_range)
+        self.splits += 1
+
+    def ranges(self, from_block, to_block):
+        """Yield (start, end, logs) of consecutive ranges covering [from_block, to_block] in order."""
+        next_start = from_block
+        ranges = collections.deque()
+        window = 2 * self.workers
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                while ranges or next_start <= to_block:
+                    while len(ranges) < window and next_start <= to_block:
+                        end = min(next_start + self.range_size - 1, to_block)
+                        ranges.append(BlockRange(next_start, end))
+                        next_start = end + 1
+
+                    running = 0
+                    for block_range in ranges:
+                        if block_range.future is None and running < self.workers:
+                            block_range.future = executor.submit(self.fetch, block_range)
+                            block_range.attempts += 1
+                        if block_range.future is not None and not block_range.future.done():
+                            running += 1
+
+                    # failed ranges are split or retried as soon as they fail, not when they reach the head
+                    for block_range in list(ranges):
+                        future = block_range.future
+                        if future is None or not future.done() or future.exception() is None:
+                            continue
+                        error = future.exception()
+                        if is_range_error(error):
+                            self.split(ranges, ranges.index(block_range), error)
+                        elif block_range.attempts < self.retries:
+                            block_range.future = None
+                        else:
+                            raise error
+
+                    head = ranges[0]
+                    if head.future is None:
+                        continue
+                    if not head.future.done():
+                        pending = [r.future for r in ranges if r.future is not None and not r.future.done()]
+                        concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                        continue
+                    if head.future.exception() is not None:
+                        continue
+
+                    ranges.popleft()
+                    logs = head.future.result()
+                    self.adapt(head, logs)
+                    yield head.start, head.end, logs
+            finally:
+                # stream abandoned by the consumer, do not start queued requests
+                for block_range in ranges:
+                    if block_range.future is not None:
+                        block_range.future.cancel()
+
+    def stream(self, from_block, to_block):
+        """Yield logs of [from_block, to_block] in (blockNumber, logIndex) order."""
+        for _, _, logs in self.ranges(from_block, to_block):
+            for log in logs:
+                yield log
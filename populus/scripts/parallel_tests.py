@@ -0,0 +1,138 @@
+"""
+Run populus tests in parallel worker processes
+
+Every worker is a separate pytest process with its own in-process tester
+chain, its own session-deployed contracts and its own accounts (see
+tests/conftest.py), so workers share nothing but the compiled contracts.
+Contracts are compiled once before workers start.
+
+Tests are assigned to workers by whole files, sorted and balanced by the
+number of tests, so the split does not depend on collection order. Each test
+starts from the same snapshot of freshly deployed contracts on a
+deterministic chain, so results do not depend on the split either.
+
+Run from the populus directory:
+
+    python scripts/parallel_tests.py -n 4
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ElementTree
+
+
+def collect(tests_dir, pytest_args):
+    """Return sorted node ids of all tests."""
+    collected = subprocess.run([sys.executable, "-m", "pytest", "--collect-only", "-q", tests_dir] + pytest_args,
+                               stdout=subprocess.PIPE, universal_newlines=True)
+    if collected.returncode not in (0, 5):
+        print(collected.stdout)
+        raise RuntimeError("Collecting tests failed")
+    return sorted(line.strip() for line in collected.stdout.splitlines() if "::" in line)
+
+
+def split_tests(node_ids, workers):
+    """Assign test files to workers, largest files first to the least loaded worker."""
+    files = {}
+    for node_id in node_ids:
+        files.setdefault(node_id.split("::")[0], []).append(node_id)
+
+    buckets = [[] for _ in range(workers)]
+    for path in sorted(files, key=lambda path: (-len(files[path]), path)):
+        bucket = min(range(workers), key=lambda i: (len(buckets[i]), i))
+        buckets[bucket].extend(files[path])
+    return [bucket for bucket in buckets if bucket]
+
+
+def compile_contracts():
+    print("Compiling contracts once for all workers...")
+    subprocess.run(["populus", "compile"], check=True, stdout=subprocess.DEVNULL)
+
+
+def start_worker(index, node_ids, basetemp, pytest_args):
+    junit_path = os.path.join(basetemp, "worker-{}.xml".format(index))
+    env = dict(os.environ, TMPDIR=os.path.join(basetemp, "tmp-{}".format(index)))
+    os.makedirs(env["TMPDIR"])
+
+    log = open(os.path.join(basetemp, "worker-{}.log".format(index)), "w")
+    process = subprocess.Popen([sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider",
+                                "--basetemp", os.path.join(basetemp, "pytest-{}".format(index)),
+                                "--junitxml", junit_path] + pytest_args + node_ids,
+                               stdout=log, stderr=subprocess.STDOUT, env=env)
+    return process, junit_path, log
+
+
+def read_results(junit_path):
+    """Return dict test name -> outcome from junit xml written by worker."""
+    results = {}
+    if not os.path.exists(junit_path):
+        return results
+    for case in ElementTree.parse(junit_path).iter("testcase"):
+        name = "{}::{}".format(case.get("classname"), case.get("name"))
+        outcome = "passed"
+        for tag in ("failure", "error", "skipped"):
+            if case.find(tag) is not None:
+                outcome = {"failure": "failed"}.get(tag, tag)
+        results[name] = outcome
+    return results
+
+
+def run(tests_dir, workers, pytest_args, compile_first=True):
+    node_ids = collect(tests_dir, pytest_args)
+    if not node_ids:
+        print("No tests collected")
+        return 0
+
+    if compile_first:
+        compile_contracts()
+
+    buckets = split_tests(node_ids, workers)
+    basetemp = tempfile.mkdtemp(prefix="joy-tests-")
+    print("Running {} tests in {} workers, logs in {}".format(len(node_ids), len(buckets), basetemp))
+
+    start = time.time()
+    running = [start_worker(index, bucket, basetemp, pytest_args) for index, bucket in enumerate(buckets)]
+
+    results = {}
+    return_code = 0
+    for index, (process, junit_path, log) in enumerate(running):
+        code = process.wait()
+        log.close()
+        results.update(read_results(junit_path))
+        # 5 means no tests collected in the worker
+        if code not in (0, 5):
+            return_code = 1
+            print("Worker {} failed, see {}".format(index, log.name))
+
+    for name in sorted(results):
+        print("{:<8} {}".format(results[name], name))
+
+    counts = {}
+    for outcome in results.values():
+        counts[outcome] = counts.get(outcome, 0) + 1
+    print(", ".join("{} {}".format(count, outcome) for outcome, count in sorted(counts.items()))
+          + " in {:.2f}s".format(time.time() - start))
+
+    if counts.get("failed") or counts.get("error"):
+        return_code = 1
+    return return_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run populus tests in parallel worker processes.")
+    parser.add_argument("-n", "--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--tests-dir", default="tests")
+    parser.add_argument("--no-compile", action="store_true", help="use already compiled contracts")
+    parser.add_argument("pytest_args", nargs=argparse.REMAINDER, help="additional pytest arguments after '--'")
+    args = parser.parse_args()
+
+    pytest_args = [arg for arg in args.pytest_args if arg != "--"]
+    exit(run(args.tests_dir, max(1, args.workers), pytest_args, compile_first=not args.no_compile))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Off-chain mirror of GameDeposit player balances
+
+PlayerLedger replays GameDeposit accounting from chain events and keeps
+'deposits' and 'lockedFunds[player][game]' maps in memory, so balance
+queries do not need eth_call round trips:
+
+ - ERC223Transfer to the deposit          -> tokenFallback, deposits[from] += value
+ - CustomDeposit to the deposit           -> customDeposit, lockedFunds[from][game] += value
+ - New/RefreshGameSession without deposit -> transferToGame, deposits moved to lockedFunds
+ - EndGameInfo                            -> accountGameResult (win/loss split and unlock)
+ - Transfer of underlying token from the deposit -> payOut / payOutGameResult
+
+Transactions are processed as a whole, because the meaning of a game event
+depends on other events emitted in the same transaction.
+"""
+
+import argparse
+import itertools
+import random
+import time
+
+from chain_context import open_chain
+from rpc_batch import batch_request, chunked
+from joy_events import EVENT_TOPICS, decode_log
+
+
+# function selectors of GameDeposit / JoyGamePlatform getters
+BALANCE_OF_PLAYER = "0x2911982e"  # balanceOfPlayer(address)
+PLAYER_LOCKED_FUNDS = "0xa2de6e8b"  # playerLockedFunds(address,address)
+GAME_DEV = "0x938a37ed"  # gameDev()
+PLATFORM_RESERVE = "0x42277097"  # platformReserve()
+
+LEDGER_EVENTS = ["ERC223Transfer", "CustomDeposit", "NewGameSession", "RefreshGameSession", "EndGameInfo",
+                 "Transfer"]
+
+
+def encode_call(selector, *addresses):
+    return selector + "".join("00" * 12 + address.lower()[2:] for address in addresses)
+
+
+def decode_address(result):
+    return "0x" + result[-40:].lower()
+
+
+class LedgerMismatch(Exception):
+    """Replayed state differs from the state of contract on chain."""
+
+
+class PlayerLedger:
+    """In-memory replica of GameDeposit 'deposits' and 'lockedFunds' mappings.
+
+    :param token: address of underlying ERC20 JoyToken
+    :param upgraded_token: address of ERC223 JoyTokenUpgraded
+    :param deposit: address of GameDeposit contract
+    :param platform_reserve: platformReserve address of the deposit
+    :param game_devs: dict game address -> gameDev address, only these games are accounted
+    """
+
+    def __init__(self, token, upgraded_token, deposit, platform_reserve, game_devs):
+        self.token = token.lower()
+        self.upgraded_token = upgraded_token.lower()
+        self.deposit = deposit.lower()
+        self.platform_reserve = platform_reserve.lower()
+        self.game_devs = {game.lower(): dev.lower() for game, dev in game_devs.items()}
+        self.deposits = {}
+        self.locked_funds = {}  # (player, game) -> value
+        self.block_number = None
+        # payOut transactions need sender of transaction to know whose deposit is decreased
+        self.tx_sender = None
+
+    # ---------------------------------------- queries ----------------------------------------
+
+    def balance_of_player(self, player):
+        return self.deposits.get(player.lower(), 0)
+
+    def player_locked_funds(self, player, game):
+        return self.locked_funds.get((player.lower(), game.lower()), 0)
+
+    # ---------------------------------------- updates ----------------------------------------
+
+    def add_deposit(self, player, value):
+        self.deposits[player] = self.deposits.get(player, 0) + value
+
+    def sub_deposit(self, player, value):
+        balance = self.deposits.get(player, 0) - value
+        if balance < 0:
+            raise LedgerMismatch("Negative deposit of {} at block {}".format(player, self.block_number))
+        if balance:
+            self.deposits[player] = balance
+        else:
+            self.deposits.pop(player, None)
+
+    def set_locked(self, player, game, value):
+        if value:
+            self.locked_funds[(player, game)] = value
+        else:
+            self.locked_funds.pop((player, game), None)
+
+    def account_game_result(self, player, game, remain_balance, final_balance):
+        # mirror of GameDeposit.accountGameResult
+        locked = self.player_locked_funds(player, game)
+
+        if final_balance > locked:
+            earnings = final_balance - locked
+            self.sub_deposit(self.platform_reserve, earnings)
+            locked += earnings
+        elif final_balance < locked:
+            loss = locked - final_balance
+            locked = final_balance
+            game_dev_part = loss // 2
+            self.add_deposit(self.game_devs[game], game_dev_part)
+            self.add_deposit(self.platform_reserve, loss - game_dev_part)
+
+        if locked != 0 and remain_balance != final_balance:
+            unlocked = final_balance - remain_balance
+            locked -= unlocked
+            self.add_deposit(player, unlocked)
+
+        self.set_locked(player, game, locked)
+
+    def apply_transaction(self, events):
+        """Apply decoded events of a single transaction, ordered by logIndex."""
+        custom_deposits = [(e["args"]["from"], e["args"]["game"], e["args"]["value"]) for e in events
+                           if e["event"] == "CustomDeposit" and e["address"] == self.upgraded_token
+                           and e["args"]["to"] == self.deposit]
+        settled_players = [e["args"]["player"] for e in events
+                           if e["event"] == "EndGameInfo" and e["address"] in self.game_devs]
+
+        for event in events:
+            args = event["args"]
+            name = event["event"]
+
+            if name == "ERC223Transfer" and event["address"] == self.upgraded_token and args["to"] == self.deposit:
+                self.add_deposit(args["from"], args["value"])
+
+            elif name in ("NewGameSession", "RefreshGameSession") and event["address"] in self.game_devs:
+                game = event["address"]
+                value = args["start_balance"] if name == "NewGameSession" else args["increased_value"]
+                key = (args["player"], game, value)
+                if key in custom_deposits:
+                    custom_deposits.remove(key)
+                else:
+                    # transferToGame moves funds from player deposit
+                    self.sub_deposit(args["player"], value)
+                self.set_locked(args["player"], game, self.player_locked_funds(args["player"], game) + value)
+
+            elif name == "EndGameInfo" and event["address"] in self.game_devs:
+                self.account_game_result(args["player"], event["address"], args["remainBalance"],
+                                         args["finalBalance"])
+
+            elif name == "Transfer" and event["address"] == self.token and args["from"] == self.deposit:
+                # payOutGameResult pays out to the settled player, payOut decreases deposit of the sender
+                if args["to"] in settled_players:
+                    self.sub_deposit(args["to"], args["value"])
+                else:
+                    self.sub_deposit(self.tx_sender(event["transactionHash"]), args["value"])
+
+    def apply_logs(self, logs):
+        """Apply raw logs ordered by (blockNumber, logIndex)."""
+        events = [event for event in map(decode_log, logs) if event is not None]
+        for _, tx_events in itertools.groupby(events, key=lambda e: e["transactionHash"]):
+            tx_events = list(tx_events)
+            self.apply_transaction(tx_events)
+            self.block_number = tx_events[-1]["blockNumber"]
+
+
+class LedgerFollower:
+    """Keeps PlayerLedger up to date with confirmed blocks of the chain."""
+
+    def __init__(self, web3, ledger, start_block=0, confirmations=12, chunk_size=2000):
+        self.web3 = web3
+        self.ledger = ledger
+        self.addresses = [ledger.token, ledger.upgraded_token] + list(ledger.game_devs)
+        self.next_block = start_block
+        self.confirmations = confirmations
+        self.chunk_size = chunk_size
+        self.senders = {}
+        ledger.tx_sender = self.tx_sender
+
+    @classmethod
+    def from_chain(cls, web3, token, upgraded_token, deposit, games, **kwargs):
+        """Build follower reading platformReserve and gameDev addresses from contracts."""
+        calls = [("eth_call", [{"to": deposit, "data": PLATFORM_RESERVE}, "latest"])]
+        calls += [("eth_call", [{"to": game, "data": GAME_DEV}, "latest"]) for game in games]
+        results = batch_request(web3, calls)
+
+        game_devs = {game: decode_address(result) for game, result in zip(games, results[1:])}
+        ledger = PlayerLedger(token, upgraded_token, deposit, decode_address(results[0]), game_devs)
+        return cls(web3, ledger, **kwargs)
+
+    def tx_sender(self, txhash):
+        if txhash not in self.senders:
+            self.senders[txhash] = batch_request(self.web3, [("eth_getTransactionByHash", [txhash])])[0]["from"]
+        return self.senders[txhash].lower()
+
+    def prefetch_senders(self, logs):
+        # senders of payOut transactions are fetched in one batch per range
+        payout_tx = sorted({log["transactionHash"] for log in logs
+                            if log["address"].lower() == self.ledger.token
+                            and log["topics"][0] == EVENT_TOPICS["Transfer"]
+                            and decode_address(log["topics"][1]) == self.ledger.deposit})
+        for chunk in chunked([txhash for txhash in payout_tx if txhash not in self.senders], 500):
+            transactions = batch_request(self.web3, [("eth_getTransactionByHash", [txhash]) for txhash in chunk])
+            for txhash, transaction in zip(chunk, transactions):
+                self.senders[txhash] = transaction["from"]
+
+    def sync(self):
+        """Apply all confirmed blocks that were not applied yet.
+
+        :return: number of the last applied block
+        """
+        head = int(batch_request(self.web3, [("eth_blockNumber", [])])[0], 16)
+        target = head - self.confirmations
+        topics = [[EVENT_TOPICS[name] for name in LEDGER_EVENTS]]
+
+        while self.next_block <= target:
+            to_block = min(self.next_block + self.chunk_size - 1, target)
+            params = {"fromBlock": hex(self.next_block), "toBlock": hex(to_block),
+                      "address": self.addresses, "topics": topics}
+            logs = batch_request(self.web3, [("eth_getLogs", [params])])[0]
+            logs.sort(key=lambda log: (int(log["blockNumber"], 16), int(log["logIndex"], 16)))
+
+            self.prefetch_senders(logs)
+            self.ledger.apply_logs(logs)
+            self.ledger.block_number = to_block
+            self.senders.clear()
+            self.next_block = to_block + 1
+
+        return self.next_block - 1
+
+    def spot_check(self, sample_size=100, seed=None):
+        """Compare sampled ledger entries with eth_call results at the last applied block.
+
+        :return: list of (description, ledger value, chain value) for mismatched entries
+        """
+        ledger = self.ledger
+        if ledger.block_number is None:
+            raise RuntimeError("Ledger has no applied blocks, call sync() before spot_check()")
+        block = hex(ledger.block_number)
+        rng = random.Random(seed)
+
+        players = rng.sample(sorted(ledger.deposits), min(sample_size, len(ledger.deposits)))
+        locked = rng.sample(sorted(ledger.locked_funds), min(sample_size, len(ledger.locked_funds)))
+
+        checks = [("balanceOfPlayer({})".format(player), ledger.balance_of_player(player),
+                   encode_call(BALANCE_OF_PLAYER, player)) for player in players]
+        checks += [("playerLockedFunds({}, {})".format(player, game), ledger.player_locked_funds(player, game),
+                    encode_call(PLAYER_LOCKED_FUNDS, player, game)) for player, game in locked]
+
+        mismatches = []
+        for chunk in chunked(checks, 500):
+            results = batch_request(self.web3, [("eth_call", [{"to": ledger.deposit, "data": data}, block])
+                                                for _, _, data in chunk])
+            for (description, expected, _), result in zip(chunk, results):
+                actual = int(result, 16)
+                if actual != expected:
+                    mismatches.append((description, expected, actual))
+        return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Follow GameDeposit balances from chain events.")
+    parser.add_argument("--chain", default="ropsten", help="populus chain name")
+    parser.add_argument("--token", required=True, help="underlying ERC20 JoyToken address")
+    parser.add_argument("--upgraded-token", required=True, help="ERC223 JoyTokenUpgraded address")
+    parser.add_argument("--deposit", required=True, help="GameDeposit address")
+    parser.add_argument("--game", action="append", required=True, help="JoyGamePlatform address")
+    parser.add_argument("--from-block", type=int, default=0)
+    parser.add_argument("--confirmations", type=int, default=12)
+    parser.add_argument("--spot-check", type=int, default=0, metavar="N",
+                        help="compare N sampled entries with the chain after every sync")
+    parser.add_argument("--poll-interval", type=int, default=15)
+    args = parser.parse_args()
+
+    with open_chain(args.chain) as chain:
+        follower = LedgerFollower.from_chain(chain.web3, args.token, args.upgraded_token, args.deposit, args.game,
+                                             start_block=args.from_block, confirmations=args.confirmations)
+        while True:
+            block = follower.sync()
+            print("Ledger at block {}: {} deposits, {} locked entries".format(
+                block, len(follower.ledger.deposits), len(follower.ledger.locked_funds)))
+
+            if args.spot_check:
+                mismatches = follower.spot_check(args.spot_check)
+                for description, expected, actual in mismatches:
+                    print("Mismatch {}: ledger {}, chain {}".format(description, expected, actual))
+                if not mismatches:
+                    print("Spot check OK")
+
+            time.sleep(args.poll_interval)
+
+
+if __name__ == "__main__":
+    main()
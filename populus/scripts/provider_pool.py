@@ -0,0 +1,462 @@
+"""
+Pooled JSON-RPC provider with failover between nodes
+
+web3.IPCProvider opens a new socket for every request and every script
+builds its own provider. PooledProvider keeps a bounded pool of persistent
+connections per node instead: IPC sockets stay open between requests and
+HTTP connections are kept alive. A connection idle for longer than
+'idle_check' seconds is pinged before it is reused and replaced when the
+node dropped it.
+
+Several nodes may be configured. Their latency is measured with
+web3_clientVersion pings and requests go to the fastest node that is up; a
+node failing to answer is skipped for 'retry_after' seconds and the request
+is sent to the next one. Requests that create transactions from node
+accounts are not resent after they reached a node, the node may have
+accepted them.
+
+The provider is thread safe, asyncio code awaits request_async() or
+make_batch_async(), which run on a thread pool as large as the connection
+pools. rpc_batch.batch_request sends batches through make_batch().
+
+    web3 = pooled_web3(["/home/user/.ethereum/geth.ipc", "http://10.0.0.2:8545"])
+    install(chain.web3, shared_provider(endpoints))
+
+JOY_RPC_ENDPOINTS=path,url,... makes chain_context.open_chain install the
+process wide provider of these nodes on every opened chain.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import http.client
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+import urllib.parse
+import weakref
+
+
+# sent once, the node may have created the transaction before the connection failed
+NOT_RESENT = {"eth_sendTransaction", "personal_sendTransaction", "personal_signAndSendTransaction"}
+
+PING = {"jsonrpc": "2.0", "id": 0, "method": "web3_clientVersion", "params": []}
+
+# failures of a single node: broken sockets, HTTP protocol errors (IncompleteRead, ...) and invalid JSON
+REQUEST_ERRORS = (OSError, ValueError, http.client.HTTPException)
+
+
+class NodeUnavailable(ConnectionError):
+    """No configured node answered the request."""
+
+
+class NodeError(ConnectionError):
+    """Request sent to one node failed, the node may have received it."""
+
+    def __init__(self, uri, error):
+        self.uri = uri
+        self.error = error
+        super().__init__("{}: {}".format(uri, error))
+
+
+class HTTPStatusError(OSError):
+    """Node answered with a HTTP status other than 200."""
+
+
+class PoolExhausted(Exception):
+    """All connections to a node stayed busy for the whole timeout."""
+
+
+class IPCConnection:
+    """Persistent Unix socket of a node."""
+
+    def __init__(self, path, timeout):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+        self.buffer = b""
+        self.decoder = json.JSONDecoder()
+        self.written = False  # the last request was sent whole, the node may have received it
+
+    def request(self, body):
+        self.written = False
+        self.sock.sendall(body)
+        self.written = True
+        while True:
+            text = self.buffer.lstrip()
+            if text[-1:] in (b"}", b"]", b"\n"):
+                try:
+                    decoded = text.decode("utf-8")
+                    result, end = self.decoder.raw_decode(decoded)
+                    self.buffer = decoded[end:].encode("utf-8")
+                    return result
+                except ValueError:
+                    # response is not complete yet
+                    pass
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("IPC connection closed by the node")
+            self.buffer += chunk
+
+    def close(self):
+        self.sock.close()
+
+
+class HTTPConnection:
+    """Keep-alive HTTP connection of a node."""
+
+    def __init__(self, uri, timeout):
+        parts = urllib.parse.urlsplit(uri)
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.connection = connection_class(parts.netloc, timeout=timeout)
+        self.path = parts.path or "/"
+        if parts.query:
+            self.path += "?" + parts.query
+        self.connection.connect()
+        self.closed = False
+        self.written = False  # the last request was sent whole, the node may have received it
+
+    def request(self, body):
+        self.written = False
+        self.connection.request("POST", self.path, body, {"Content-Type": "application/json"})
+        self.written = True
+        response = self.connection.getresponse()
+        data = response.read()
+        if response.will_close:
+            # the next request needs a new connection
+            self.closed = True
+        if response.status != 200:
+            raise HTTPStatusError("HTTP {} {}".format(response.status, response.reason))
+        return json.loads(data.decode("utf-8"))
+
+    def close(self):
+        self.connection.close()
+
+
+class Endpoint:
+    """Node with a bounded pool of connections and its measured latency.
+
+    :param size: connections open at the same time
+    :param idle_check: seconds after which an idle connection is pinged before use
+    """
+
+    def __init__(self, uri, size=8, timeout=30, idle_check=30):
+        self.uri = uri
+        self.is_http = uri.startswith(("http://", "https://"))
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.idle = []  # (last used, connection), most recently used last
+        self.busy = 0
+        self.opened = 0
+        self.latency = None  # exponentially weighted ping time, seconds
+        self.down_until = 0
+        self.failures = 0
+
+    def connect(self):
+        connection_class = HTTPConnection if self.is_http else IPCConnection
+        connection = connection_class(self.uri, self.timeout)
+        with self.lock:
+            self.opened += 1
+        return connection
+
+    def record_latency(self, seconds, weight=0.3):
+        self.latency = seconds if self.latency is None else (1 - weight) * self.latency + weight * seconds
+
+    def ping(self, connection):
+        start = time.perf_counter()
+        response = connection.request(json.dumps(PING).encode("utf-8"))
+        if "result" not in response:
+            raise ConnectionError("web3_clientVersion failed: {}".format(response.get("error")))
+        self.record_latency(time.perf_counter() - start)
+
+    def acquire(self, check=False):
+        """Idle connection still answering pings or a new one, waits while the pool is full.
+
+        :param check: ping an idle connection however short it was idle
+        """
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolExhausted("No free connection to {} in {} seconds".format(self.uri, self.timeout))
+        try:
+            while True:
+                with self.lock:
+                    if not self.idle:
+                        break
+                    last_used, connection = self.idle.pop()
+                if not check and time.monotonic() - last_used < self.idle_check:
+                    return connection, True
+                try:
+                    self.ping(connection)
+                    return connection, True
+                except REQUEST_ERRORS:
+                    # dropped by the node while idle
+                    connection.close()
+            return self.connect(), False
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, connection, reusable=True):
+        if reusable and not getattr(connection, "closed", False):
+            with self.lock:
+                self.idle.append((time.monotonic(), connection))
+        else:
+            connection.close()
+        self.slots.release()
+
+    def request(self, body, resendable=True):
+        """Send encoded request on a pooled connection.
+
+        :param resendable: the request may be sent again when the node could have received it
+        :raise NodeError: when the request was sent, OSError when no connection could be opened
+        """
+        # a connection closed while idle is found by the ping, before a request that is sent once
+        connection, reused = self.acquire(check=not resendable)
+        with self.lock:
+            self.busy += 1
+        try:
+            try:
+                response = connection.request(body)
+            except ConnectionError:
+                if not reused or (connection.written and not resendable):
+                    raise
+                # keep-alive connection closed by the node between the check and this request
+                connection.close()
+                connection = self.connect()
+                response = connection.request(body)
+        except REQUEST_ERRORS as error:
+            self.release(connection, reusable=False)
+            raise NodeError(self.uri, error)
+        finally:
+            with self.lock:
+                self.busy -= 1
+        self.release(connection)
+        return response
+
+    def probe(self):
+        """Measure latency on a fresh connection, False when the node does not answer."""
+        try:
+            connection = self.connect()
+        except OSError:
+            return False
+        try:
+            self.ping(connection)
+        except REQUEST_ERRORS:
+            return False
+        finally:
+            connection.close()
+        return True
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for _, connection in idle:
+            connection.close()
+
+    def status(self):
+        with self.lock:
+            return {"uri": self.uri, "latency_ms": None if self.latency is None else self.latency * 1000,
+                    "up": self.down_until <= time.monotonic(), "failures": self.failures,
+                    "idle": len(self.idle), "busy": self.busy, "opened": self.opened}
+
+
+class PooledProvider:
+    """web3 provider sending requests over pooled connections of the fastest available node.
+
+    :param endpoints: IPC paths and http(s) URLs of the nodes
+    :param pool_size: connections per node
+    :param retry_after: seconds a failed node is skipped
+    :param probe_interval: seconds between latency measurements of all nodes
+    """
+
+    def __init__(self, endpoints, pool_size=8, timeout=30, idle_check=30, retry_after=10, probe_interval=60):
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+        self.endpoints = [Endpoint(uri, pool_size, timeout, idle_check) for uri in endpoints]
+        self.pool_size = pool_size
+        self.retry_after = retry_after
+        self.probe_interval = probe_interval
+        self.probed = None  # monotonic time of the last probe
+        self.probe_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.request_ids = itertools.count(1)
+        self._executor = None
+        self._middlewares = ()
+        self._request_funcs = weakref.WeakKeyDictionary()  # web3 -> (middlewares, request function)
+
+    def __repr__(self):
+        return "<PooledProvider {}>".format(", ".join(endpoint.uri for endpoint in self.endpoints))
+
+    # ---------------- web3 v3 provider interface ----------------
+
+    @property
+    def middlewares(self):
+        return self._middlewares
+
+    @middlewares.setter
+    def middlewares(self, values):
+        self._middlewares = tuple(values)
+
+    def request_func(self, web3, outer_middlewares):
+        """make_request() wrapped in the middlewares, as web3 BaseProvider does."""
+        # the provider is shared by web3 instances, middlewares are bound to the one they were built for
+        middlewares = tuple(outer_middlewares) + self._middlewares
+        cached = self._request_funcs.get(web3)
+        if cached is None or cached[0] != middlewares:
+            request_func = functools.reduce(lambda request, middleware: middleware(request, web3),
+                                            reversed(middlewares), self.make_request)
+            cached = self._request_funcs[web3] = (middlewares, request_func)
+        return cached[1]
+
+    def make_request(self, method, params):
+        request = {"jsonrpc": "2.0", "id": next(self.request_ids), "method": method, "params": list(params or [])}
+        return self.send(request, [method])
+
+    def isConnected(self):
+        try:
+            return "result" in self.make_request("web3_clientVersion", [])
+        except ConnectionError:
+            return False
+
+    # ---------------- batches and asyncio ----------------
+
+    def make_batch(self, payload):
+        """Send list of JSON-RPC requests as one batch, return list of responses."""
+        return self.send(payload, [request["method"] for request in payload])
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self.lock:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        self.pool_size * len(self.endpoints), thread_name_prefix="provider-pool")
+        return self._executor
+
+    async def request_async(self, method, params):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.make_request, method, params)
+
+    async def make_batch_async(self, payload):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.make_batch, payload)
+
+    # ---------------- node selection ----------------
+
+    def probe(self):
+        """Measure latency of all nodes in parallel, mark the silent ones down."""
+        with concurrent.futures.ThreadPoolExecutor(len(self.endpoints)) as pool:
+            answers = list(pool.map(Endpoint.probe, self.endpoints))
+
+        for endpoint, answered in zip(self.endpoints, answers):
+            if answered:
+                endpoint.down_until = 0
+            else:
+                self.mark_down(endpoint)
+        self.probed = time.monotonic()
+
+    def mark_down(self, endpoint):
+        endpoint.failures += 1
+        endpoint.down_until = time.monotonic() + self.retry_after
+        endpoint.close()
+
+    def ranked(self):
+        """Endpoints in the order they are tried: nodes that are up by latency, then the others."""
+        if len(self.endpoints) > 1 and (self.probed is None or time.monotonic() - self.probed > self.probe_interval):
+            # one thread measures, the others keep using the previous ranking
+            if self.probe_lock.acquire(blocking=self.probed is None):
+                try:
+                    if self.probed is None or time.monotonic() - self.probed > self.probe_interval:
+                        self.probe()
+                finally:
+                    self.probe_lock.release()
+
+        now = time.monotonic()
+        order = {endpoint: index for index, endpoint in enumerate(self.endpoints)}
+
+        def key(endpoint):
+            latency = endpoint.latency if endpoint.latency is not None else float("inf")
+            return endpoint.down_until > now, latency, order[endpoint]
+
+        return sorted(self.endpoints, key=key)
+
+    def send(self, request, methods):
+        body = json.dumps(request).encode("utf-8")
+        resendable = NOT_RESENT.isdisjoint(methods)
+        errors = []
+        for endpoint in self.ranked():
+            try:
+                return endpoint.request(body, resendable)
+            except NodeError as error:
+                self.mark_down(endpoint)
+                errors.append(str(error))
+                if not resendable:
+                    raise
+            except OSError as error:
+                # connection refused, missing socket file
+                self.mark_down(endpoint)
+                errors.append("{}: {}".format(endpoint.uri, error))
+        raise NodeUnavailable("No node answered {}: {}".format(", ".join(sorted(set(methods))), "; ".join(errors)))
+
+    def status(self):
+        return [endpoint.status() for endpoint in self.endpoints]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        for endpoint in self.endpoints:
+            endpoint.close()
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_provider(endpoints, **kwargs):
+    """Process wide provider of given nodes, scripts and services of the process share its connections."""
+    with _shared_lock:
+        key = tuple(endpoints)
+        provider = _shared.get(key)
+        if provider is None:
+            provider = _shared[key] = PooledProvider(list(endpoints), **kwargs)
+        return provider
+
+
+def endpoints_from_env():
+    """Nodes listed in JOY_RPC_ENDPOINTS (comma separated IPC paths and URLs), empty list when unset."""
+    value = os.environ.get("JOY_RPC_ENDPOINTS", "")
+    return [endpoint.strip() for endpoint in value.split(",") if endpoint.strip()]
+
+
+def install(web3, provider):
+    """Replace providers of web3 (e.g. chain.web3 of populus) with provider, keeping its middlewares."""
+    manager = web3.manager
+    if hasattr(manager, "providers"):
+        # web3 v3 keeps list of providers
+        if list(manager.providers) != [provider]:
+            manager.providers = [provider]
+    else:
+        manager.provider = provider
+    return provider
+
+
+def install_from_env(web3):
+    """Install the shared provider of JOY_RPC_ENDPOINTS nodes, None when the variable is unset."""
+    endpoints = endpoints_from_env()
+    if not endpoints:
+        return None
+    return install(web3, shared_provider(endpoints))
+
+
+def pooled_web3(endpoints, **kwargs):
+    """Web3 instance on the shared provider of given nodes."""
+    from web3 import Web3
+
+    return Web3(shared_provider(endpoints, **kwargs))
@@ -0,0 +1,179 @@
+"""
+JSON-RPC batch requests for web3 providers
+
+web3 sends one request per call. Node endpoints accept a JSON array of
+requests and answer with an array of responses, which lets us replace N
+round trips with one. HTTP and IPC providers are sent real batches, any
+other provider falls back to sequential requests through web3.manager.
+Providers with make_batch() (provider_pool.PooledProvider) send the batch
+themselves.
+"""
+
+import itertools
+import json
+import socket
+import time
+
+
+class RPCError(ValueError):
+    """Error entry returned by the node for a single request of the batch."""
+
+    def __init__(self, method, params, error):
+        self.method = method
+        self.params = params
+        self.error = error
+        super().__init__("{}{} failed: {}".format(method, tuple(params), error))
+
+
+_request_ids = itertools.count(1)
+
+# RPCMetrics set by rpc_metrics.instrument(), batches sent directly to the node are recorded there
+metrics = None
+
+
+def get_provider(web3):
+    # web3 v3 keeps list of providers, newer versions have single one
+    providers = getattr(web3, "providers", None)
+    if providers:
+        return providers[0]
+    return web3.manager.provider
+
+
+def build_payload(calls):
+    return [{"jsonrpc": "2.0", "id": next(_request_ids), "method": method, "params": list(params)}
+            for method, params in calls]
+
+
+def send_http(provider, payload):
+    import requests
+
+    session = getattr(provider, "_batch_session", None)
+    if session is None:
+        session = requests.Session()
+        provider._batch_session = session
+
+    request_kwargs = dict(getattr(provider, "_request_kwargs", None) or {})
+    request_kwargs.setdefault("timeout", 30)
+    response = session.post(provider.endpoint_uri, data=json.dumps(payload),
+                            headers={"Content-Type": "application/json"}, **request_kwargs)
+    response.raise_for_status()
+    return response.json()
+
+
+def send_ipc(provider, payload, timeout=30):
+    decoder = json.JSONDecoder()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(provider.ipc_path)
+        sock.sendall(json.dumps(payload).encode("utf-8"))
+
+        raw = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("IPC connection closed before full batch response was received")
+            raw += chunk
+            try:
+                result, _ = decoder.raw_decode(raw.decode("utf-8").lstrip())
+                return result
+            except ValueError:
+                # response is not complete yet
+                continue
+    finally:
+        sock.close()
+
+
+def send_sequential(web3, payload):
+    responses = []
+    for request in payload:
+        try:
+            result = web3.manager.request_blocking(request["method"], request["params"])
+            responses.append({"id": request["id"], "result": result})
+        except ValueError as error:
+            responses.append({"id": request["id"], "error": str(error)})
+    return responses
+
+
+def batch_request(web3, calls, raise_errors=True):
+    """Send many JSON-RPC calls in one request.
+
+    :param calls: iterable of (method, params) tuples
+    :param raise_errors: raise RPCError for the first failed call,
+                         otherwise RPCError instances are returned in place of results
+    :return: list of results in the order of given calls
+    """
+    calls = list(calls)
+    if not calls:
+        return []
+
+    payload = build_payload(calls)
+    provider = get_provider(web3)
+
+    start = time.perf_counter()
+    if hasattr(provider, "make_batch"):
+        responses = provider.make_batch(payload)
+    elif hasattr(provider, "endpoint_uri"):
+        responses = send_http(provider, payload)
+    elif hasattr(provider, "ipc_path"):
+        responses = send_ipc(provider, payload)
+    else:
+        # requests go through web3 middlewares, metrics are recorded there
+        responses = send_sequential(web3, payload)
+        start = None
+
+    # node is allowed to answer in any order
+    by_id = {response.get("id"): response for response in responses}
+
+    if metrics is not None and start is not None:
+        metrics.record_batch(calls, [by_id.get(request["id"]) for request in payload], time.perf_counter() - start)
+
+    results = []
+    for request, (method, params) in zip(payload, calls):
+        response = by_id.get(request["id"], {"error": "missing response"})
+        if "error" in response:
+            error = RPCError(method, params, response["error"])
+            if raise_errors:
+                raise error
+            results.append(error)
+        else:
+            results.append(response.get("result"))
+    return results
+
+
+def chunked(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def to_int(value):
+    if isinstance(value, str):
+        return int(value, 16)
+    return value
+
+
+RECEIPT_INT_FIELDS = ("blockNumber", "cumulativeGasUsed", "gasUsed", "status", "transactionIndex")
+
+
+def format_receipt(receipt):
+    """Convert numeric fields of raw receipt from hex strings to integers."""
+    receipt = dict(receipt)
+    for field in RECEIPT_INT_FIELDS:
+        if receipt.get(field) is not None:
+            receipt[field] = to_int(receipt[field])
+    return receipt
+
+
+def poll_receipts(web3, txids, batch_size=500):
+    """Fetch receipts of all given transactions with batched eth_getTransactionReceipt.
+
+    :return: dict txid -> receipt, only for transactions that are already mined
+    """
+    receipts = {}
+    for chunk in chunked(txids, batch_size):
+        results = batch_request(web3, [("eth_getTransactionReceipt", [txid]) for txid in chunk])
+        for txid, receipt in zip(chunk, results):
+            if receipt is not None:
+                receipts[txid] = format_receipt(receipt)
+    return receipts
@@ -0,0 +1,296 @@
+"""
+Instrumentation of JSON-RPC requests made by scripts
+
+RPCMetrics records count, errors, request/response bytes and a latency
+histogram per JSON-RPC method and per contract function (selector of
+eth_call, eth_estimateGas and eth_sendTransaction data, named from the
+artifact cache when available). Requests sent by web3 are recorded by a
+web3 middleware, batches sent by rpc_batch are recorded there.
+
+Metrics are exported as Prometheus text exposition or JSON. Calls slower
+than a threshold can be logged (optionally sampled) as JSON lines.
+
+Nothing is installed unless instrument() is called, so disabled metrics
+cost nothing. Scripts call instrument_from_env(web3), which enables metrics
+when JOY_RPC_METRICS is set:
+
+    JOY_RPC_METRICS=rpc.json JOY_RPC_SLOW_MS=500 python scripts/web3_stats.py
+
+writes rpc.json and rpc.json.prom at exit (after every command under the joy
+daemon).
+"""
+
+import atexit
+import bisect
+import json
+import os
+import random
+import threading
+import time
+import weakref
+
+import rpc_batch
+from artifact_cache import default_cache
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# methods whose first parameter is a transaction with contract call data
+CALL_METHODS = ("eth_call", "eth_estimateGas", "eth_sendTransaction")
+
+
+class MethodStats:
+    """Counters of one (method, function) pair."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)  # last one is +Inf
+
+    def to_json(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "latency_sum": self.latency_sum,
+            "latency_buckets": dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], self.buckets)),
+        }
+
+
+def json_size(value):
+    return len(json.dumps(value, separators=(",", ":"), default=str))
+
+
+def label_value(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RPCMetrics:
+    """Thread safe collector of JSON-RPC metrics.
+
+    :param slow_threshold: seconds, calls taking longer are written to slow_log
+    :param slow_sample_rate: fraction of slow calls that are logged
+    :param measure_bytes: serialize params and results to count bytes
+    """
+
+    def __init__(self, slow_threshold=None, slow_log=None, slow_sample_rate=1.0, measure_bytes=True):
+        self.stats = {}  # (method, function) -> MethodStats
+        self.function_names = {}  # selector -> function signature
+        self.slow_threshold = slow_threshold
+        self.slow_log = slow_log
+        self.slow_sample_rate = slow_sample_rate
+        self.measure_bytes = measure_bytes
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def add_function_names(self, selectors):
+        """Name contract functions, selectors is a dict signature -> selector (as in ArtifactCache)."""
+        for signature, selector in selectors.items():
+            self.function_names.setdefault(selector.lower(), signature)
+
+    def load_artifact_names(self, artifacts):
+        for name in artifacts.contract_names():
+            self.add_function_names(artifacts.selectors(name))
+
+    def function_label(self, method, params):
+        if method not in CALL_METHODS or not params or not isinstance(params[0], dict):
+            return ""
+        data = params[0].get("data") or ""
+        if isinstance(data, (bytes, bytearray)):
+            data = "0x" + bytes(data).hex()
+        if len(data) < 10:
+            return ""
+        selector = data[:10].lower()
+        return self.function_names.get(selector, selector)
+
+    def record(self, method, params, elapsed, response=None, error=False):
+        function = self.function_label(method, params)
+        request_bytes = json_size(params) if self.measure_bytes else 0
+        response_bytes = json_size(response) if self.measure_bytes and response is not None else 0
+
+        with self.lock:
+            stats = self.stats.get((method, function))
+            if stats is None:
+                stats = self.stats[(method, function)] = MethodStats()
+            stats.count += 1
+            stats.errors += int(bool(error))
+            stats.request_bytes += request_bytes
+            stats.response_bytes += response_bytes
+            stats.latency_sum += elapsed
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+        if self.slow_threshold is not None and elapsed >= self.slow_threshold and self.slow_log:
+            if self.slow_sample_rate >= 1 or random.random() < self.slow_sample_rate:
+                self.log_slow(method, function, params, elapsed, error)
+
+    def log_slow(self, method, function, params, elapsed, error):
+        record = {"time": time.time(), "method": method, "function": function, "elapsed": elapsed,
+                  "error": bool(error), "params": params}
+        with self.lock:
+            with open(self.slow_log, "a") as log:
+                log.write(json.dumps(record, default=str) + "\n")
+
+    def record_batch(self, calls, responses, elapsed):
+        """Record calls of a JSON-RPC batch, every call waited for the whole batch."""
+        for (method, params), response in zip(calls, responses):
+            error = isinstance(response, dict) and "error" in response
+            self.record(method, params, elapsed, response.get("result") if isinstance(response, dict) else None,
+                        error)
+
+    def middleware(self, make_request, web3):
+        """web3 middleware recording every request made through web3.manager."""
+        def middleware(method, params):
+            start = time.perf_counter()
+            try:
+                response = make_request(method, params)
+            except Exception:
+                self.record(method, params, time.perf_counter() - start, error=True)
+                raise
+            self.record(method, params, time.perf_counter() - start, response.get("result"), "error" in response)
+            return response
+        return middleware
+
+    # ---------------------------------------- export ----------------------------------------
+
+    def snapshot(self):
+        with self.lock:
+            return sorted(self.stats.items())
+
+    def to_json(self):
+        return {
+            "started": self.started,
+            "elapsed": time.time() - self.started,
+            "methods": [dict(stats.to_json(), method=method, function=function)
+                        for (method, function), stats in self.snapshot()],
+        }
+
+    def to_prometheus(self, prefix="joy_rpc"):
+        items = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, values):
+            lines.append("# HELP {}_{} {}".format(prefix, name, help_text))
+            lines.append("# TYPE {}_{} {}".format(prefix, name, kind))
+            lines.extend(values)
+
+        def labels(method, function, extra=""):
+            text = 'method="{}",function="{}"'.format(label_value(method), label_value(function))
+            return "{" + text + extra + "}"
+
+        for name, attribute, help_text in (("requests_total", "count", "JSON-RPC requests."),
+                                           ("errors_total", "errors", "JSON-RPC requests that failed."),
+                                           ("request_bytes_total", "request_bytes", "Bytes of request params."),
+                                           ("response_bytes_total", "response_bytes", "Bytes of results.")):
+            metric(name, "counter", help_text, ["{}_{}{} {}".format(prefix, name, labels(method, function),
+                                                                    getattr(stats, attribute))
+                                                for (method, function), stats in items])
+
+        histogram = []
+        for (method, function), stats in items:
+            cumulative = 0
+            for bound, count in zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], stats.buckets):
+                cumulative += count
+                histogram.append("{}_latency_seconds_bucket{} {}".format(
+                    prefix, labels(method, function, ',le="{}"'.format(bound)), cumulative))
+            histogram.append("{}_latency_seconds_sum{} {}".format(prefix, labels(method, function), stats.latency_sum))
+            histogram.append("{}_latency_seconds_count{} {}".format(prefix, labels(method, function), stats.count))
+        metric("latency_seconds", "histogram", "JSON-RPC request latency.", histogram)
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """Write JSON metrics to path and Prometheus text to path + '.prom'."""
+        with open(path, "w") as fp:
+            json.dump(self.to_json(), fp, indent=4)
+        with open(path + ".prom", "w") as fp:
+            fp.write(self.to_prometheus())
+
+
+def remove_instrumentation(web3):
+    """Remove the metrics middleware installed by instrument()."""
+    stack = getattr(web3, "middleware_stack", None)
+    if stack is not None:
+        if "rpc_metrics" in stack:
+            stack.remove("rpc_metrics")
+        return
+    # web3 v3 has no named middlewares, metrics middleware is a bound method of RPCMetrics
+    middlewares = web3.manager.middlewares
+    middlewares[:] = [middleware for middleware in middlewares
+                      if not isinstance(getattr(middleware, "__self__", None), RPCMetrics)]
+
+
+def instrument(web3, metrics=None):
+    """Record requests of web3 and of rpc_batch batches into metrics (a new RPCMetrics by default).
+
+    Instrumenting web3 again, e.g. a warm web3 of the joy daemon, replaces the previous metrics.
+    """
+    metrics = metrics or RPCMetrics()
+    remove_instrumentation(web3)
+    stack = getattr(web3, "middleware_stack", None)
+    if stack is not None:
+        stack.add(metrics.middleware, name="rpc_metrics")
+    else:
+        web3.add_middleware(metrics.middleware)
+    rpc_batch.metrics = metrics
+    return metrics
+
+
+_env_metrics = None
+_env_path = None
+_env_web3s = weakref.WeakSet()
+_env_atexit = False
+
+
+def instrument_from_env(web3):
+    """Enable metrics when JOY_RPC_METRICS environment variable names the output file.
+
+    JOY_RPC_SLOW_MS, JOY_RPC_SLOW_LOG and JOY_RPC_SLOW_SAMPLE configure the slow call log.
+    All web3 instances share the same metrics until dump_env_metrics() (called at exit and
+    by the joy daemon after every command) writes them.
+    :return: RPCMetrics or None when disabled
+    """
+    global _env_metrics, _env_path, _env_atexit
+
+    path = os.environ.get("JOY_RPC_METRICS")
+    if not path:
+        return None
+    path = os.path.abspath(path)
+
+    if _env_metrics is not None and path != _env_path:
+        dump_env_metrics()
+    if _env_metrics is None:
+        slow_ms = os.environ.get("JOY_RPC_SLOW_MS")
+        _env_metrics = RPCMetrics(slow_threshold=float(slow_ms) / 1000 if slow_ms else None,
+                                  slow_log=os.path.abspath(os.environ.get("JOY_RPC_SLOW_LOG", path + ".slow")),
+                                  slow_sample_rate=float(os.environ.get("JOY_RPC_SLOW_SAMPLE", "1")))
+        _env_path = path
+        # function names are known only when compiled artifacts are cached
+        artifacts = default_cache()
+        if artifacts.is_warm():
+            _env_metrics.load_artifact_names(artifacts)
+        if not _env_atexit:
+            atexit.register(dump_env_metrics)
+            _env_atexit = True
+
+    _env_web3s.add(web3)
+    return instrument(web3, _env_metrics)
+
+
+def dump_env_metrics():
+    """Write metrics enabled by instrument_from_env() and stop recording them."""
+    global _env_metrics, _env_path
+
+    if _env_metrics is None:
+        return
+    metrics, path = _env_metrics, _env_path
+    _env_metrics = _env_path = None
+    for web3 in list(_env_web3s):
+        remove_instrumentation(web3)
+    _env_web3s.clear()
+    if rpc_batch.metrics is metrics:
+        rpc_batch.metrics = None
+    metrics.dump(path)
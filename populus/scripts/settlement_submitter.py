@@ -0,0 +1,533 @@
+"""
+Pipelined settlement of game sessions on JoyGamePlatform
+
+accountGameResult and payOutGameResult may be called only by the owner, so
+all settlements share one nonce sequence. Instead of waiting for every
+transaction, outcomes are queued and submitted in JSON-RPC batches with
+consecutive owner nonces, keeping up to 'max_in_flight' transactions pending.
+
+Before submission playerLockedFunds of every player is read in one batch;
+outcomes of players without locked funds are skipped, because they would
+revert on 'require(l_gameLockedFunds > 0)'. Settlements of the same player
+are submitted one after another, each one after the previous is mined,
+since every settlement changes locked funds of the player. An outcome queued
+again with the same gameProcessId replaces the queued one.
+
+Transactions rejected as underpriced are resent with the same nonce and a
+higher gas price, transactions not mined within 'rebid_after' blocks are
+replaced the same way. The nonce of a settlement that can not be sent is
+reused by the next one; when none is left to take it, a zero value
+transfer to the owner fills the gap, so that settlements with higher nonces
+can be mined.
+
+Outcomes are read from a CSV file with
+'player,remainBalance,finalBalance,gameProcessId,gameSignature[,payout]' rows:
+
+    python scripts/settlement_submitter.py outcomes.csv --game 0x... --chain ropsten
+    python scripts/settlement_submitter.py outcomes.csv --chain standin
+"""
+
+import argparse
+import csv
+import math
+import time
+
+from chain_context import open_chain
+from gas_oracle import GasPriceOracle, REPLACEMENT_BUMP, STRATEGIES
+from player_ledger import PlayerLedger, LedgerMismatch
+from rpc_batch import batch_request, chunked, poll_receipts, to_int, RPCError
+from rpc_metrics import instrument_from_env
+from signer import keystore_signer
+from utils import is_successful_receipt
+
+
+PLAYER_LOCKED_FUNDS = "0x0635fe90"  # JoyGamePlatform.playerLockedFunds(address)
+ACCOUNT_GAME_RESULT = "0x940505ad"  # accountGameResult(address,uint256,uint256,bytes32,bytes32)
+PAY_OUT_GAME_RESULT = "0x010495d4"  # payOutGameResult(address,uint256,uint256,bytes32,bytes32)
+
+COUNTERS = ("queued", "coalesced", "duplicates", "skipped", "submitted", "retried", "replaced", "filled", "mined",
+            "failed")
+
+FILL_GAS = 21000
+
+
+def word(value):
+    return "{:064x}".format(value)
+
+
+def bytes32_hex(value):
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).rjust(32, b"\0").hex()
+    return value[2:] if value.startswith("0x") else value
+
+
+class GameOutcome:
+    """Outcome of a game session, mirror of JoyGameAbstract.GameOutcome struct."""
+
+    def __init__(self, player, remain_balance, final_balance, game_process_id, game_signature, pay_out=False):
+        self.player = player.lower()
+        self.remain_balance = remain_balance
+        self.final_balance = final_balance
+        self.game_process_id = "0x" + bytes32_hex(game_process_id)
+        self.game_signature = "0x" + bytes32_hex(game_signature)
+        self.pay_out = pay_out
+
+    def encode(self):
+        selector = PAY_OUT_GAME_RESULT if self.pay_out else ACCOUNT_GAME_RESULT
+        return (selector + "00" * 12 + self.player[2:] + word(self.remain_balance) + word(self.final_balance)
+                + self.game_process_id[2:] + self.game_signature[2:])
+
+    def __repr__(self):
+        return "GameOutcome({}, {}, {}, {})".format(self.player, self.remain_balance, self.final_balance,
+                                                    self.game_process_id)
+
+
+class Settlement:
+    """Submitted outcome, all hashes sent with its nonce are kept, any of them can be mined."""
+
+    def __init__(self, outcome, nonce, gas_price, block):
+        self.outcome = outcome
+        self.nonce = nonce
+        self.gas_price = gas_price
+        self.submitted_block = block
+        self.txhashes = []
+        self.attempts = 0
+
+
+class SettlementSubmitter:
+    """Queue of game outcomes settled with pipelined owner transactions.
+
+    :param game: address of JoyGamePlatform
+    :param owner: owner account of the game, must be unlocked in the node unless signer holds its key
+    :param signer: signer.TransactionSigner, transactions are signed locally and sent raw
+    :param oracle: GasPriceOracle used when gas_price is not given
+    :param rebid_after: replace transactions not mined within that many blocks
+    :param batch_size: settlements sent in one batch, the signer uses its worker processes from
+                       signer.min_parallel transactions on
+    """
+
+    def __init__(self, web3, game, owner, max_in_flight=100, gas=300000, gas_price=None, oracle=None,
+                 gas_strategy="fast", rebid_after=None, max_attempts=5, batch_size=100, poll_interval=1, signer=None):
+        self.web3 = web3
+        self.game = game.lower()
+        self.owner = owner.lower()
+        self.max_in_flight = max_in_flight
+        self.gas = gas
+        self.gas_price = gas_price
+        self.oracle = oracle
+        self.gas_strategy = gas_strategy
+        self.rebid_after = rebid_after
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.signer = signer
+
+        self.queue = {}  # player -> dict gameProcessId -> outcome, in order of arrival
+        self.in_flight = {}  # player -> Settlement
+        self.settled_ids = set()
+        self.retry_nonces = []  # nonces of sends that failed and must be reused
+        self.next_nonce = None
+        self.head = 0
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.failed = []
+        self.started = None
+
+    # ---------------------------------------- queue ----------------------------------------
+
+    def add(self, outcome):
+        """Queue outcome, outcome with already queued gameProcessId replaces the queued one."""
+        key = outcome.game_process_id
+        in_flight = self.in_flight.get(outcome.player)
+        if key in self.settled_ids or (in_flight and in_flight.outcome.game_process_id == key):
+            self.counters["duplicates"] += 1
+            return
+
+        outcomes = self.queue.setdefault(outcome.player, {})
+        if key in outcomes:
+            self.counters["coalesced"] += 1
+        else:
+            self.counters["queued"] += 1
+        outcomes[key] = outcome
+
+    def pending(self):
+        return sum(len(outcomes) for outcomes in self.queue.values()) + len(self.in_flight)
+
+    def ready_players(self, limit):
+        # one settlement per player at a time, each one depends on locked funds left by the previous
+        players = []
+        for player, outcomes in self.queue.items():
+            if len(players) >= limit:
+                break
+            if outcomes and player not in self.in_flight:
+                players.append(player)
+        return players
+
+    def pop_outcome(self, player):
+        outcomes = self.queue[player]
+        outcome = outcomes.pop(next(iter(outcomes)))
+        if not outcomes:
+            del self.queue[player]
+        return outcome
+
+    # ---------------------------------------- chain ----------------------------------------
+
+    def market_gas_price(self):
+        if self.oracle:
+            return self.oracle.suggest(self.gas_strategy)
+        return to_int(batch_request(self.web3, [("eth_gasPrice", [])])[0])
+
+    def current_gas_price(self):
+        return self.gas_price or self.market_gas_price()
+
+    def bumped_gas_price(self, settlement):
+        # at least the minimal replacement bump, even when the configured price was too low
+        return int(math.ceil(max(settlement.gas_price * REPLACEMENT_BUMP, self.market_gas_price())))
+
+    def sync_nonce(self):
+        pending_nonce = to_int(batch_request(self.web3, [("eth_getTransactionCount", [self.owner, "pending"])])[0])
+        self.next_nonce = max(pending_nonce, self.next_nonce or 0)
+        self.retry_nonces = [nonce for nonce in self.retry_nonces if nonce >= pending_nonce]
+
+    def allocate_nonce(self):
+        if self.retry_nonces:
+            return self.retry_nonces.pop(0)
+        nonce = self.next_nonce
+        self.next_nonce += 1
+        return nonce
+
+    def locked_funds(self, players):
+        calls = [("eth_call", [{"to": self.game, "data": PLAYER_LOCKED_FUNDS + "00" * 12 + player[2:]}, "latest"])
+                 for player in players]
+        return [to_int(result) for result in batch_request(self.web3, calls)]
+
+    def transaction(self, settlement):
+        return {"from": self.owner, "to": self.game, "data": settlement.outcome.encode(), "gas": hex(self.gas),
+                "gasPrice": hex(settlement.gas_price), "nonce": hex(settlement.nonce)}
+
+    def send_transactions(self, transactions):
+        """Send owner transactions in one batch, return list of txhash or RPCError."""
+        if self.signer is not None:
+            return self.signer.send(self.web3, transactions)
+        return batch_request(self.web3, [("eth_sendTransaction", [transaction]) for transaction in transactions],
+                             raise_errors=False)
+
+    def send(self, settlements):
+        """Send transactions in one batch, failed sends are retried with the same nonce."""
+        results = self.send_transactions([self.transaction(settlement) for settlement in settlements])
+        for settlement, result in zip(settlements, results):
+            settlement.attempts += 1
+            if not isinstance(result, RPCError):
+                settlement.txhashes.append(result)
+                settlement.submitted_block = self.head
+                continue
+
+            message = str(result.error).lower()
+            if settlement.txhashes and "already known" in message:
+                continue
+            if "underpriced" in message and settlement.attempts < self.max_attempts:
+                self.counters["retried"] += 1
+                settlement.gas_price = self.bumped_gas_price(settlement)
+                self.send([settlement])
+            elif "nonce too low" in message and not settlement.txhashes and settlement.attempts < self.max_attempts:
+                # nonce was used outside of this submitter
+                self.counters["retried"] += 1
+                self.sync_nonce()
+                settlement.nonce = self.allocate_nonce()
+                self.send([settlement])
+            elif not settlement.txhashes:
+                print("Settlement of {} can not be sent: {}".format(settlement.outcome, result))
+                self.fail(settlement)
+                self.retry_nonces.append(settlement.nonce)
+                self.retry_nonces.sort()
+
+    def fail(self, settlement):
+        self.in_flight.pop(settlement.outcome.player, None)
+        self.counters["failed"] += 1
+        self.failed.append(settlement.outcome)
+
+    def fill_gaps(self):
+        """Send zero value transfers to the owner at failed nonces no queued outcome took.
+
+        In-flight settlements with higher nonces are not mined before the gap is filled.
+        When even the transfer can not be sent, they and all queued outcomes fail.
+        """
+        gaps = [nonce for nonce in self.retry_nonces
+                if any(settlement.nonce > nonce for settlement in self.in_flight.values())]
+        if not gaps:
+            return
+        gas_price = self.current_gas_price()
+        transactions = [{"from": self.owner, "to": self.owner, "value": "0x0", "gas": hex(FILL_GAS),
+                         "gasPrice": hex(gas_price), "nonce": hex(nonce)} for nonce in gaps]
+        for nonce, result in zip(gaps, self.send_transactions(transactions)):
+            if not isinstance(result, RPCError):
+                self.retry_nonces.remove(nonce)
+                self.counters["filled"] += 1
+                continue
+
+            print("Nonce {} can not be filled: {}; settlements sent after it are not mined".format(nonce, result))
+            for settlement in [settlement for settlement in self.in_flight.values() if settlement.nonce > nonce]:
+                self.fail(settlement)
+            for player in list(self.queue):
+                for outcome in self.queue.pop(player).values():
+                    self.counters["failed"] += 1
+                    self.failed.append(outcome)
+            self.retry_nonces = [gap for gap in self.retry_nonces if gap < nonce]
+            return
+
+    def submit_ready(self):
+        capacity = self.max_in_flight - len(self.in_flight)
+        players = self.ready_players(capacity)
+        if not players:
+            return 0
+
+        submitted = 0
+        gas_price = self.current_gas_price()
+        for chunk in chunked(players, self.batch_size):
+            settlements = []
+            for player, locked in zip(chunk, self.locked_funds(chunk)):
+                outcome = self.pop_outcome(player)
+                if locked == 0:
+                    # settlement would revert, player has no funds in the game
+                    self.counters["skipped"] += 1
+                    self.settled_ids.add(outcome.game_process_id)
+                    continue
+                settlement = Settlement(outcome, self.allocate_nonce(), gas_price, self.head)
+                self.in_flight[player] = settlement
+                settlements.append(settlement)
+
+            if settlements:
+                self.send(settlements)
+                sent = sum(1 for settlement in settlements if settlement.txhashes)
+                self.counters["submitted"] += sent
+                submitted += sent
+        return submitted
+
+    def check_receipts(self):
+        by_txhash = {txhash: settlement for settlement in self.in_flight.values() for txhash in settlement.txhashes}
+        receipts = poll_receipts(self.web3, list(by_txhash))
+        for txhash, receipt in receipts.items():
+            settlement = by_txhash[txhash]
+            if self.in_flight.get(settlement.outcome.player) is not settlement:
+                continue
+            del self.in_flight[settlement.outcome.player]
+            self.settled_ids.add(settlement.outcome.game_process_id)
+            if is_successful_receipt(receipt):
+                self.counters["mined"] += 1
+            else:
+                print("Settlement of {} reverted, txhash: {}".format(settlement.outcome, txhash))
+                self.counters["failed"] += 1
+                self.failed.append(settlement.outcome)
+        return len(receipts)
+
+    def rebid(self):
+        # replace transactions stuck for too long, using the same nonce and higher gas price
+        if not self.rebid_after:
+            return
+        stuck = [settlement for settlement in self.in_flight.values()
+                 if settlement.txhashes and self.head - settlement.submitted_block >= self.rebid_after]
+        for settlement in stuck:
+            settlement.gas_price = self.bumped_gas_price(settlement)
+            self.counters["replaced"] += 1
+        if stuck:
+            self.send(stuck)
+
+    def step(self):
+        """Check receipts, replace stuck transactions and submit ready outcomes.
+
+        :return: True when anything changed
+        """
+        self.head = to_int(batch_request(self.web3, [("eth_blockNumber", [])])[0])
+        mined = self.check_receipts()
+        self.rebid()
+        submitted = self.submit_ready()
+        # failed nonces left after the ready outcomes took theirs would block later settlements
+        self.fill_gaps()
+        return bool(mined or submitted)
+
+    def run(self, outcomes=()):
+        """Settle given outcomes together with already queued ones, returns list of failed outcomes."""
+        for outcome in outcomes:
+            self.add(outcome)
+
+        self.started = self.started or time.time()
+        if self.next_nonce is None:
+            self.sync_nonce()
+
+        while self.pending():
+            if not self.step():
+                time.sleep(self.poll_interval)
+        return self.failed
+
+    def throughput(self):
+        elapsed = time.time() - self.started if self.started else 0
+        return self.counters["mined"] / elapsed if elapsed else 0.0
+
+    def report(self):
+        counters = ", ".join("{} {}".format(name, self.counters[name]) for name in COUNTERS)
+        return "{}; {:.2f} settlements/s".format(counters, self.throughput())
+
+
+# ---------------------------------------- stand-in chain ----------------------------------------
+
+class StandInChain:
+    """In-process node with a single JoyGamePlatform, for testing without a real chain.
+
+    Settlements are executed by PlayerLedger.account_game_result, the mirror of
+    GameDeposit. Blocks of at most 'block_size' transactions are mined on every
+    eth_blockNumber request. Transactions below 'min_gas_price' are rejected as
+    underpriced, replacements must pay at least 10% more.
+    """
+
+    def __init__(self, game, owner, game_dev, platform_reserve, reserve_funds=10 ** 24, block_size=50,
+                 min_gas_price=1):
+        self.game = game.lower()
+        self.owner = owner.lower()
+        self.block_size = block_size
+        self.min_gas_price = min_gas_price
+        self.ledger = PlayerLedger(token="0x" + "00" * 20, upgraded_token="0x" + "00" * 20, deposit="0x" + "00" * 20,
+                                   platform_reserve=platform_reserve, game_devs={game: game_dev})
+        self.ledger.add_deposit(self.ledger.platform_reserve, reserve_funds)
+        self.head = 0
+        self.mined_nonce = 0
+        self.pending = {}  # nonce -> transaction
+        self.receipts = {}
+        self.hashes = 0
+
+    def lock(self, player, value):
+        """Lock player funds in the game, as transferToGame would."""
+        self.ledger.set_locked(player.lower(), self.game, self.ledger.player_locked_funds(player, self.game) + value)
+
+    def send_transaction(self, transaction):
+        nonce = to_int(transaction["nonce"]) if "nonce" in transaction else max([self.mined_nonce - 1]
+                                                                                 + list(self.pending)) + 1
+        gas_price = to_int(transaction.get("gasPrice", hex(self.min_gas_price)))
+        if nonce < self.mined_nonce:
+            raise ValueError("nonce too low")
+        if gas_price < self.min_gas_price:
+            raise ValueError("transaction underpriced")
+        if nonce in self.pending and gas_price < self.pending[nonce]["gasPrice"] * 1.1:
+            raise ValueError("replacement transaction underpriced")
+
+        self.hashes += 1
+        txhash = "0x" + word(self.hashes)
+        self.pending[nonce] = dict(transaction, hash=txhash, gasPrice=gas_price)
+        return txhash
+
+    def execute(self, transaction):
+        if not transaction.get("data") and transaction["from"].lower() == self.owner:
+            # value transfer of the owner
+            return True
+        data = transaction["data"][2:]
+        if transaction["from"].lower() != self.owner or transaction["to"].lower() != self.game:
+            return False
+        if "0x" + data[:8] not in (ACCOUNT_GAME_RESULT, PAY_OUT_GAME_RESULT):
+            return False
+
+        player = "0x" + data[32:72]
+        remain, final = int(data[72:136], 16), int(data[136:200], 16)
+        if self.ledger.player_locked_funds(player, self.game) == 0 or remain > final:
+            return False
+        try:
+            self.ledger.account_game_result(player, self.game, remain, final)
+        except LedgerMismatch:
+            # platformReserve can not cover the win
+            return False
+        if data[:8] == PAY_OUT_GAME_RESULT[2:]:
+            self.ledger.deposits.pop(player, None)
+        return True
+
+    def mine(self):
+        self.head += 1
+        for index in range(self.block_size):
+            transaction = self.pending.pop(self.mined_nonce, None)
+            if transaction is None:
+                break
+            status = self.execute(transaction)
+            self.receipts[transaction["hash"]] = {
+                "transactionHash": transaction["hash"], "blockNumber": hex(self.head), "transactionIndex": hex(index),
+                "gasUsed": hex(60000), "cumulativeGasUsed": hex(60000 * (index + 1)), "status": hex(int(status)),
+            }
+            self.mined_nonce += 1
+
+    def request_blocking(self, method, params):
+        if method == "eth_blockNumber":
+            self.mine()
+            return hex(self.head)
+        if method == "eth_gasPrice":
+            return hex(self.min_gas_price)
+        if method == "eth_getTransactionCount":
+            return hex(max([self.mined_nonce - 1] + list(self.pending)) + 1)
+        if method == "eth_sendTransaction":
+            return self.send_transaction(params[0])
+        if method == "eth_getTransactionReceipt":
+            return self.receipts.get(params[0])
+        if method == "eth_call" and params[0]["data"].startswith(PLAYER_LOCKED_FUNDS):
+            return "0x" + word(self.ledger.player_locked_funds("0x" + params[0]["data"][-40:], params[0]["to"]))
+        raise ValueError("unsupported method " + method)
+
+
+class StandInWeb3:
+    """Minimal web3 replacement routing requests to StandInChain."""
+
+    def __init__(self, chain):
+        self.providers = [object()]
+        self.manager = chain
+
+
+def read_outcomes(csv_path):
+    with open(csv_path, "r", newline="") as csv_file:
+        for row in csv.reader(csv_file):
+            if not row or row[0].startswith("#"):
+                continue
+            pay_out = len(row) > 5 and row[5].strip().lower() in ("1", "true", "payout")
+            yield GameOutcome(row[0].strip(), int(row[1]), int(row[2]), row[3].strip(), row[4].strip(), pay_out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Settle game sessions on JoyGamePlatform.")
+    parser.add_argument("outcomes", help="CSV file with 'player,remain,final,gameProcessId,gameSignature[,payout]'")
+    parser.add_argument("--chain", default="ropsten", help="populus chain name, 'standin' for in-process chain")
+    parser.add_argument("--game", help="JoyGamePlatform address")
+    parser.add_argument("--owner", help="owner of the game, web3 default account when not given")
+    parser.add_argument("--in-flight", type=int, default=100, help="maximum number of unconfirmed settlements")
+    parser.add_argument("--gas", type=int, default=300000, help="gas limit of every settlement")
+    parser.add_argument("--gas-price", type=int, help="gas price in wei, suggested from recent blocks when not given")
+    parser.add_argument("--gas-strategy", choices=sorted(STRATEGIES), default="fast")
+    parser.add_argument("--rebid-after", type=int, metavar="BLOCKS",
+                        help="replace transactions not mined within given number of blocks")
+    parser.add_argument("--keystore", help="keystore file of the owner, transactions are signed locally")
+    args = parser.parse_args()
+
+    outcomes = list(read_outcomes(args.outcomes))
+
+    if args.chain == "standin":
+        game, owner = "0x" + "99" * 20, "0x" + "01" * 20
+        chain = StandInChain(game, owner, game_dev="0x" + "02" * 20, platform_reserve="0x" + "03" * 20)
+        for outcome in outcomes:
+            chain.lock(outcome.player, max(outcome.final_balance, 1))
+        submitter = SettlementSubmitter(StandInWeb3(chain), game, owner, max_in_flight=args.in_flight,
+                                        gas=args.gas, gas_price=args.gas_price, rebid_after=args.rebid_after,
+                                        poll_interval=0)
+        submitter.run(outcomes)
+        print(submitter.report())
+        exit(1 if submitter.failed else 0)
+
+    if not args.game:
+        parser.error("--game is required")
+
+    with open_chain(args.chain) as chain:
+        web3 = chain.web3
+        instrument_from_env(web3)
+        signer = keystore_signer([args.keystore]) if args.keystore else None
+        owner = args.owner or (signer.addresses[0] if signer else web3.eth.defaultAccount)
+        submitter = SettlementSubmitter(web3, args.game, owner,
+                                        max_in_flight=args.in_flight, gas=args.gas, gas_price=args.gas_price,
+                                        oracle=GasPriceOracle(web3), gas_strategy=args.gas_strategy,
+                                        rebid_after=args.rebid_after, signer=signer)
+        submitter.run(outcomes)
+        print(submitter.report())
+        exit(1 if submitter.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
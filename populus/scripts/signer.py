@@ -0,0 +1,172 @@
+"""
+Local signing of transactions with keys from encrypted keystores
+
+Keystore files (the JSON files in geth's keystore directory) are decrypted
+once at startup; transactions are then signed in this process or, for large
+batches, across a pool of worker processes that receive the keys once when
+they start. Signed transactions are sent with batched eth_sendRawTransaction,
+so the node needs neither unlocked accounts nor the personal API and bulk
+operations are limited by the network instead of signing.
+
+Requires the eth-account package.
+
+    signer = TransactionSigner.from_keystores(["owner.json"], password)
+    txhashes = signer.send(web3, transactions)  # transactions with "from", "nonce", "gas", "gasPrice"
+"""
+
+import concurrent.futures
+import json
+import os
+import weakref
+
+from rpc_batch import batch_request, chunked, to_int, RPCError
+
+
+# transaction fields signed as integers, callers often pass them as hex strings
+INT_FIELDS = ("nonce", "gas", "gasPrice", "value", "chainId")
+SIGNED_FIELDS = INT_FIELDS + ("to", "data")
+
+
+def import_account():
+    try:
+        from eth_account import Account
+    except ImportError:
+        raise ImportError("Local signing requires eth-account package: pip install eth-account")
+    return Account
+
+
+def load_keystore(path, password):
+    """Decrypt keystore file, return (lower case address, private key bytes)."""
+    Account = import_account()
+    with open(path, "r") as keyfile:
+        keystore = json.load(keyfile)
+    key = bytes(Account.decrypt(keystore, password))
+    to_account = getattr(Account, "from_key", None) or Account.privateKeyToAccount
+    return to_account(key).address.lower(), key
+
+
+def signable(transaction, chain_id):
+    """Transaction dict in the form expected by eth_account."""
+    prepared = {field: transaction[field] for field in SIGNED_FIELDS if transaction.get(field) is not None}
+    for field in INT_FIELDS:
+        if field in prepared:
+            prepared[field] = to_int(prepared[field])
+    prepared.setdefault("value", 0)
+    prepared.setdefault("data", "0x")
+    if chain_id is not None:
+        prepared.setdefault("chainId", chain_id)
+    return prepared
+
+
+def sign_with(keys, transactions, chain_id):
+    """Return raw transactions (hex) of transactions signed by the keys of their "from" address."""
+    Account = import_account()
+    sign = getattr(Account, "sign_transaction", None) or Account.signTransaction
+    raw_transactions = []
+    for transaction in transactions:
+        key = keys.get(transaction["from"].lower())
+        if key is None:
+            raise KeyError("No key for account " + transaction["from"])
+        signed = sign(signable(transaction, chain_id), key)
+        raw = getattr(signed, "raw_transaction", None) or signed.rawTransaction
+        raw_transactions.append("0x" + bytes(raw).hex())
+    return raw_transactions
+
+
+# keys of a worker process, set once by the pool initializer
+_worker_keys = None
+
+
+def _init_worker(keys):
+    global _worker_keys
+    _worker_keys = keys
+
+
+def _sign_chunk(transactions, chain_id):
+    return sign_with(_worker_keys, transactions, chain_id)
+
+
+class TransactionSigner:
+    """Signs transactions of accounts whose keys it holds.
+
+    :param keys: dict address -> private key bytes
+    :param workers: worker processes, batches smaller than min_parallel are signed in this process;
+                    the default threshold is reached by full windows of bulk_transfer and settlement_submitter
+    :param chunk_size: most transactions signed by one worker task, a batch is spread over all workers
+    """
+
+    def __init__(self, keys, workers=None, chunk_size=100, min_parallel=50):
+        self.keys = {address.lower(): key for address, key in keys.items()}
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.min_parallel = min_parallel
+        self.pool = None
+        self.chain_ids = weakref.WeakKeyDictionary()  # web3 -> chain id
+
+    @classmethod
+    def from_keystores(cls, paths, password, **kwargs):
+        return cls(dict(load_keystore(path, password) for path in paths), **kwargs)
+
+    @property
+    def addresses(self):
+        return sorted(self.keys)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def sign(self, transactions, chain_id=None):
+        """Raw transactions in the order of given ones."""
+        transactions = list(transactions)
+        if len(transactions) < self.min_parallel or self.workers == 1:
+            return sign_with(self.keys, transactions, chain_id)
+
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                                               initargs=(self.keys,))
+        chunks = list(chunked(transactions, min(self.chunk_size, -(-len(transactions) // self.workers))))
+        signed = self.pool.map(_sign_chunk, chunks, [chain_id] * len(chunks))
+        return [raw for chunk in signed for raw in chunk]
+
+    def chain_id(self, web3):
+        """EIP-155 chain id, network id of nodes without eth_chainId (they are equal on public chains)."""
+        if web3 not in self.chain_ids:
+            chain_id = batch_request(web3, [("eth_chainId", [])], raise_errors=False)[0]
+            if isinstance(chain_id, RPCError) or chain_id is None:
+                chain_id = batch_request(web3, [("net_version", [])])[0]
+            self.chain_ids[web3] = to_int(chain_id) if str(chain_id).startswith("0x") else int(chain_id)
+        return self.chain_ids[web3]
+
+    def send(self, web3, transactions, batch_size=500):
+        """Sign transactions and send them with batched eth_sendRawTransaction.
+
+        :return: list of txhash or RPCError, in the order of transactions
+        """
+        raw_transactions = self.sign(transactions, self.chain_id(web3))
+        return send_raw_transactions(web3, raw_transactions, batch_size)
+
+
+def send_raw_transactions(web3, raw_transactions, batch_size=500):
+    """Submit signed transactions, return list of txhash or RPCError."""
+    results = []
+    for chunk in chunked(raw_transactions, batch_size):
+        results.extend(batch_request(web3, [("eth_sendRawTransaction", [raw]) for raw in chunk], raise_errors=False))
+    return results
+
+
+def keystore_signer(paths, password=None, **kwargs):
+    """Signer from keystore files, password is read from JOY_KEYSTORE_PASSWORD or asked for."""
+    if password is None:
+        password = os.environ.get("JOY_KEYSTORE_PASSWORD")
+    if password is None:
+        import getpass
+
+        password = getpass.getpass("Keystore password: ")
+    return TransactionSigner.from_keystores(paths, password, **kwargs)
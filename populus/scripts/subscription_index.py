@@ -0,0 +1,238 @@
+"""
+In-memory index of subscriptions bought in Subscription contracts
+
+Built from newSubscription(buyer, price, timepoint, amountOfTime) events of
+SubscriptionWithEther and SubscriptionWithJoyToken. Bought periods of every
+buyer are merged into sorted, non-overlapping intervals, so "is the account
+subscribed at time t" is a binary search instead of a walk over its events.
+Periods of both contracts are merged together.
+
+Note that the contracts keep only the last subscription in allSubscriptions,
+the index keeps every period that was paid for.
+
+A heap of interval ends answers "which subscriptions expire within the next
+hour". The index can be saved to a compact binary snapshot together with the
+last applied block, so a restart only replays newer blocks.
+"""
+
+import argparse
+import bisect
+import heapq
+import os
+import struct
+import time
+
+from chain_context import open_chain
+from log_fetcher import LogFetcher
+from rpc_batch import batch_request
+from joy_events import EVENT_TOPICS, decode_log
+
+
+SNAPSHOT_MAGIC = b"JOYSUB01"
+# time beyond the range of snapshot integers, amountOfTime is uint256 on chain
+MAX_TIME = 2 ** 64 - 1
+
+
+class SubscriptionIndex:
+    """Merged subscription intervals [start, end) per buyer."""
+
+    def __init__(self):
+        self.starts = {}  # buyer -> sorted list of interval starts
+        self.ends = {}  # buyer -> list of interval ends, matching starts
+        self.expiry_heap = []  # (end, buyer), entries of merged or extended intervals are dropped lazily
+        self.block_number = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    # ---------------------------------------- updates ----------------------------------------
+
+    def add(self, buyer, timepoint, amount_of_time):
+        """Add period bought at timepoint, merging it with overlapping and adjacent intervals."""
+        if amount_of_time <= 0:
+            return
+        buyer = buyer.lower()
+        start = min(timepoint, MAX_TIME)
+        end = min(timepoint + amount_of_time, MAX_TIME)
+
+        starts = self.starts.setdefault(buyer, [])
+        ends = self.ends.setdefault(buyer, [])
+
+        # intervals from first to last (exclusive) overlap or touch the new one
+        first = bisect.bisect_left(ends, start)
+        last = bisect.bisect_right(starts, end)
+        if first < last:
+            start = min(start, starts[first])
+            end = max(end, ends[last - 1])
+        starts[first:last] = [start]
+        ends[first:last] = [end]
+
+        heapq.heappush(self.expiry_heap, (end, buyer))
+
+    def apply_logs(self, logs, addresses=None):
+        """Apply raw newSubscription logs, optionally only those emitted by given contract addresses."""
+        if addresses is not None:
+            addresses = {address.lower() for address in addresses}
+        for event in map(decode_log, logs):
+            if event is None or event["event"] != "newSubscription":
+                continue
+            if addresses is not None and event["address"] not in addresses:
+                continue
+            args = event["args"]
+            self.add(args["buyer"], args["timepoint"], args["amountOfTime"])
+            self.block_number = event["blockNumber"]
+
+    # ---------------------------------------- queries ----------------------------------------
+
+    def interval_at(self, buyer, t):
+        """Return (start, end) of the subscription of buyer active at time t, or None."""
+        buyer = buyer.lower()
+        starts = self.starts.get(buyer)
+        if not starts:
+            return None
+        position = bisect.bisect_right(starts, t) - 1
+        if position >= 0 and t < self.ends[buyer][position]:
+            return starts[position], self.ends[buyer][position]
+        return None
+
+    def is_active(self, buyer, t=None):
+        return self.interval_at(buyer, time.time() if t is None else t) is not None
+
+    def expires_at(self, buyer, t=None):
+        """End of the subscription active at time t, None when buyer is not subscribed."""
+        interval = self.interval_at(buyer, time.time() if t is None else t)
+        return interval[1] if interval else None
+
+    def intervals(self, buyer):
+        buyer = buyer.lower()
+        return list(zip(self.starts.get(buyer, []), self.ends.get(buyer, [])))
+
+    def is_interval_end(self, buyer, end):
+        ends = self.ends.get(buyer, [])
+        position = bisect.bisect_left(ends, end)
+        return position < len(ends) and ends[position] == end
+
+    def expiring(self, now, within=3600):
+        """Buyers whose subscription active at 'now' ends before now + within.
+
+        :return: list of (end, buyer) sorted by end
+        """
+        heap = self.expiry_heap
+        found = []
+        keep = set()
+        while heap and heap[0][0] < now + within:
+            end, buyer = heapq.heappop(heap)
+            if end <= now:
+                # already expired, never reported again
+                continue
+            if (end, buyer) in keep or not self.is_interval_end(buyer, end):
+                # duplicate, or interval was merged or extended since
+                continue
+            keep.add((end, buyer))
+            if self.expires_at(buyer, now) == end:
+                found.append((end, buyer))
+        for entry in keep:
+            heapq.heappush(heap, entry)
+        return found
+
+    # ---------------------------------------- snapshot ----------------------------------------
+
+    def save(self, path):
+        """Write snapshot atomically, every interval takes 16 bytes."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as snapshot:
+            block_number = -1 if self.block_number is None else self.block_number
+            snapshot.write(SNAPSHOT_MAGIC + struct.pack(">qI", block_number, len(self.starts)))
+            for buyer in sorted(self.starts):
+                starts, ends = self.starts[buyer], self.ends[buyer]
+                snapshot.write(bytes.fromhex(buyer[2:]) + struct.pack(">I", len(starts)))
+                snapshot.write(struct.pack(">{}Q".format(2 * len(starts)),
+                                           *[value for interval in zip(starts, ends) for value in interval]))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with open(path, "rb") as snapshot:
+            data = snapshot.read()
+        if not data.startswith(SNAPSHOT_MAGIC):
+            raise ValueError("Not a subscription index snapshot: " + path)
+
+        offset = len(SNAPSHOT_MAGIC)
+        block_number, buyers = struct.unpack_from(">qI", data, offset)
+        offset += struct.calcsize(">qI")
+        index.block_number = None if block_number < 0 else block_number
+
+        for _ in range(buyers):
+            buyer = "0x" + data[offset:offset + 20].hex()
+            count, = struct.unpack_from(">I", data, offset + 20)
+            offset += 24
+            values = struct.unpack_from(">{}Q".format(2 * count), data, offset)
+            offset += 16 * count
+            index.starts[buyer] = list(values[0::2])
+            index.ends[buyer] = list(values[1::2])
+            index.expiry_heap.extend((end, buyer) for end in values[1::2])
+
+        heapq.heapify(index.expiry_heap)
+        return index
+
+
+class SubscriptionFollower:
+    """Keeps SubscriptionIndex up to date with confirmed blocks of the chain."""
+
+    def __init__(self, web3, index, addresses, start_block=0, confirmations=12, chunk_size=5000):
+        self.web3 = web3
+        self.index = index
+        self.addresses = [address.lower() for address in addresses]
+        self.next_block = start_block if index.block_number is None else index.block_number + 1
+        self.confirmations = confirmations
+        self.chunk_size = chunk_size
+
+    def sync(self):
+        """Apply all confirmed blocks that were not applied yet.
+
+        :return: number of the last applied block
+        """
+        head = int(batch_request(self.web3, [("eth_blockNumber", [])])[0], 16)
+        target = head - self.confirmations
+
+        fetcher = LogFetcher(self.web3, self.addresses, [EVENT_TOPICS["newSubscription"]],
+                             initial_range=self.chunk_size)
+        for _, to_block, logs in fetcher.ranges(self.next_block, target):
+            self.index.apply_logs(logs, self.addresses)
+            self.index.block_number = to_block
+            self.next_block = to_block + 1
+
+        return self.next_block - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Follow subscriptions and report the ones expiring soon.")
+    parser.add_argument("--chain", default="ropsten", help="populus chain name")
+    parser.add_argument("--subscription", action="append", required=True, help="Subscription contract address")
+    parser.add_argument("--snapshot", default="subscriptions.snapshot", help="snapshot file used on restart")
+    parser.add_argument("--from-block", type=int, default=0)
+    parser.add_argument("--confirmations", type=int, default=12)
+    parser.add_argument("--expiring-within", type=int, default=3600, help="seconds")
+    parser.add_argument("--poll-interval", type=int, default=15)
+    args = parser.parse_args()
+
+    index = SubscriptionIndex.load(args.snapshot) if os.path.exists(args.snapshot) else SubscriptionIndex()
+
+    with open_chain(args.chain) as chain:
+        follower = SubscriptionFollower(chain.web3, index, args.subscription, start_block=args.from_block,
+                                        confirmations=args.confirmations)
+        while True:
+            block = follower.sync()
+            index.save(args.snapshot)
+            now = time.time()
+            expiring = index.expiring(now, args.expiring_within)
+            print("Index at block {}: {} buyers, {} expiring within {}s".format(
+                block, len(index), len(expiring), args.expiring_within))
+            for end, buyer in expiring:
+                print("  {} expires in {}s".format(buyer, int(end - now)))
+            time.sleep(args.poll_interval)
+
+
+if __name__ == "__main__":
+    main()
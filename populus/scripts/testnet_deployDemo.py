@@ -1,43 +1,40 @@
-import populus
-from populus.utils.wait import wait_for_transaction_receipt
-from populus.utils.cli import request_account_unlock
-from populus.utils.accounts import is_account_locked
-from web3 import Web3
+import argparse
 
 import utils
+from artifact_cache import get_contract_factory
+from chain_context import open_chain
+from gas_oracle import GasPriceOracle
+from bulk_reader import BulkReader
+from rpc_metrics import instrument_from_env
 
 
-def deployDemoContracts():
+def deployDemoContracts(chain_name='ropsten'):
 
-    project = populus.Project()
+    with open_chain(chain_name) as chain:
 
-    chain_name = 'ropsten'
-
-    with project.get_chain(chain_name) as chain:
-
-        # Load Populus contract proxy classes
-        JoyToken = chain.provider.get_contract_factory('JoyToken')
-        PlatformDeposit = chain.provider.get_contract_factory('PlatformDeposit')
-        JoyGameDemo = chain.provider.get_contract_factory('JoyGameDemo')
+        # Load contract proxy classes, compiled artifacts are cached
+        JoyToken = get_contract_factory(chain, 'JoyToken')
+        PlatformDeposit = get_contract_factory(chain, 'PlatformDeposit')
+        JoyGameDemo = get_contract_factory(chain, 'JoyGameDemo')
 
         web3 = chain.web3
+        instrument_from_env(web3)
         print("Web3 provider is", web3.providers)
 
         # default account from populus perspective
         ownerAddr = web3.eth.defaultAccount;
         print("Contracts will be deployed from: {}".format(ownerAddr))
 
-        defaultGasPrice = web3.eth.gasPrice
-        print("Default Gas Price: " + str(defaultGasPrice))
-        # multiple gas price to get fast confirmations
-        #txhash = DToken.transact({'gasPrice': (defaultGasPrice*5)}).transfer(input_addr,int(input_amount))
+        # gas price expected to be mined within a block, based on recent blocks
+        gasPrice = GasPriceOracle(web3).suggest("fast")
+        print("Gas Price: " + str(gasPrice))
 
         # unlock owner account
         #timeout=100
         #print("acc locked: {}".format(is_account_locked(web3,ownerAddr)))
 
         # Deploy token contract
-        txhash_token = JoyToken.deploy(transaction={"from": ownerAddr})
+        txhash_token = JoyToken.deploy(transaction={"from": ownerAddr, "gasPrice": gasPrice})
         print("deploying token, tx hash is", txhash_token)
         receipt = utils.check_succesful_tx(web3, txhash_token)
         token_address = receipt["contractAddress"]
@@ -47,7 +44,7 @@ def deployDemoContracts():
         platformReserve_address = input ("Give platform reserve address: ")
 
         # Deploy deposit contract with token_address
-        txhash_deposit = PlatformDeposit.deploy(transaction={"from": ownerAddr}, args=[token_address, platformReserve_address])
+        txhash_deposit = PlatformDeposit.deploy(transaction={"from": ownerAddr, "gasPrice": gasPrice}, args=[token_address, platformReserve_address])
         print("Deploying deposit contract, tx hash is", txhash_deposit)
         receipt = utils.check_succesful_tx(web3, txhash_deposit)
         deposit_address = receipt["contractAddress"]
@@ -56,25 +53,38 @@ def deployDemoContracts():
         # game developer address
         gameDev = input ("Give game developer address: ")
 
-        txhash_game = JoyGameDemo.deploy(transaction={"from": ownerAddr}, args=[deposit_address, gameDev])
+        txhash_game = JoyGameDemo.deploy(transaction={"from": ownerAddr, "gasPrice": gasPrice}, args=[deposit_address, gameDev])
         print("Deploying game demo contract, tx hash is", txhash_game)
         receipt = utils.check_succesful_tx(web3, txhash_game)
         game_address = receipt["contractAddress"]
         print("DemoGame contract address is", game_address)
 
-        # Do some contract reads to see everything looks ok
+        # Do some contract reads to see everything looks ok, all of them in one batch
+        reader = BulkReader(web3)
+        checks = [
+            ("Token name: ", (JoyToken, token_address), "name"),
+            ("Token symbol: ", (JoyToken, token_address), "symbol"),
+            ("Token total supply is: ", (JoyToken, token_address), "totalSupply"),
+            ("Token decimal places: ", (JoyToken, token_address), "decimals"),
+            ("Deposit owner is: ", (PlatformDeposit, deposit_address), "owner"),
+            ("Deposit platformReserve address: ", (PlatformDeposit, deposit_address), "platformReserve"),
+            ("Deposit supported Token address: ", (PlatformDeposit, deposit_address), "m_supportedToken"),
+            ("Game developer is: ", (JoyGameDemo, game_address), "gameDev"),
+            ("Game contract using deposit (address): ", (JoyGameDemo, game_address), "m_playerDeposits"),
+        ]
+        results = reader.read([(contract, method, []) for _, contract, method in checks])
+
         print("Some checks on deployed contracts:")
-        print("Token name: ", JoyToken.call({'to':token_address}).name())
-        print("Token symbol: ", JoyToken.call({'to':token_address}).symbol())
-        print("Token total supply is: ", JoyToken.call({'to':token_address}).totalSupply())
-        print("Token decimal places: ", JoyToken.call({'to':token_address}).decimals())
-        print("Deposit owner is: ", PlatformDeposit.call({'to':deposit_address}).owner())
-        print("Deposit platformReserve address: ", PlatformDeposit.call({'to':deposit_address}).platformReserve())
-        print("Deposit supported Token address: ", PlatformDeposit.call({'to':deposit_address}).m_supportedToken())
-        print("Game developer is: ", JoyGameDemo.call({'to':game_address}).gameDev())
-        print("Game contract using deposit (address): ", JoyGameDemo.call({'to':game_address}).m_playerDeposits())
+        for (description, _, _), result in zip(checks, results):
+            print(description, result)
+
 
+def main():
+    parser = argparse.ArgumentParser(description="Deploy demo JoyToken, PlatformDeposit and JoyGameDemo contracts.")
+    parser.add_argument("--chain", default="ropsten", help="populus chain name")
+    args = parser.parse_args()
+    deployDemoContracts(args.chain)
 
 
 if __name__ == "__main__":
-    deployDemoContracts()
+    main()
@@ -1,24 +1,22 @@
-import populus
-from populus.utils.wait import wait_for_transaction_receipt
-from populus.utils.cli import request_account_unlock
-from populus.utils.accounts import is_account_locked
-from web3 import Web3
+import argparse
 
 import utils
+from artifact_cache import get_contract_factory
+from chain_context import open_chain
+from gas_oracle import GasPriceOracle
+from bulk_reader import BulkReader
+from rpc_metrics import instrument_from_env
 
 
-def deploySubscription():
+def deploySubscription(chain_name='ropsten'):
 
-    project = populus.Project()
+    with open_chain(chain_name) as chain:
 
-    chain_name = 'ropsten'
-
-    with project.get_chain(chain_name) as chain:
-
-        # Load Populus contract proxy classes
-        Subscription = chain.provider.get_contract_factory('Subscription')
+        # Load contract proxy classes, compiled artifacts are cached
+        Subscription = get_contract_factory(chain, 'Subscription')
 
         web3 = chain.web3
+        instrument_from_env(web3)
         print("Web3 provider is", web3.providers)
 
         # default account from populus perspective
@@ -26,23 +24,34 @@ def deploySubscription():
 
         print("Contracts will be deployed from: {}".format(ownerAddr))
 
-        # defaultGasPrice = web3.eth.gasPrice
-        # print("Default Gas Price: " + str(defaultGasPrice))
+        # gas price expected to be mined within a block, based on recent blocks
+        gasPrice = GasPriceOracle(web3).suggest("fast")
+        print("Gas Price: " + str(gasPrice))
 
         # Deploy subscription contract contract
-        txhash_subscribe = Subscription.deploy(transaction={"from": ownerAddr})
+        txhash_subscribe = Subscription.deploy(transaction={"from": ownerAddr, "gasPrice": gasPrice})
         print("Deploying subscription, tx hash is", txhash_subscribe)
         subscribe_receipt = utils.check_succesful_tx(web3, txhash_subscribe)
         subscribe_address = subscribe_receipt["contractAddress"]
         print("Subscription contract address is", subscribe_address)
 
-        # Do some contract reads to see everything looks ok
+        # Do some contract reads to see everything looks ok, all of them in one batch
+        reader = BulkReader(web3)
+        owner, price, funds = reader.read([((Subscription, subscribe_address), method, [])
+                                           for method in ("owner", "subscriptionPrice", "collectedFunds")])
+
         print("Some checks on deployed contract:")
-        print("Subscription token owner: ", Subscription.call({'to':subscribe_address}).owner())
-        print("Subscription initial price: ", Subscription.call({'to':subscribe_address}).subscriptionPrice())
-        print("Subscription collected funds: ", Subscription.call({'to':subscribe_address}).collectedFunds())
+        print("Subscription token owner: ", owner)
+        print("Subscription initial price: ", price)
+        print("Subscription collected funds: ", funds)
+
 
+def main():
+    parser = argparse.ArgumentParser(description="Deploy Subscription contract.")
+    parser.add_argument("--chain", default="ropsten", help="populus chain name")
+    args = parser.parse_args()
+    deploySubscription(args.chain)
 
 
 if __name__ == "__main__":
-    deploySubscription()
+    main()
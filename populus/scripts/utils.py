@@ -1,23 +1,111 @@
-import populus
-from populus.utils.wait import wait_for_transaction_receipt
-from web3 import Web3
+import asyncio
+import time
+import typing
+
+if typing.TYPE_CHECKING:
+    # web3 is needed only by callers, tools importing utils start without the eth stack
+    from web3 import Web3
+
+from rpc_batch import poll_receipts
+
+
+def is_successful_receipt(receipt: dict) -> bool:
+    """Check receipt status field (EIP-658), 1 means Solidity code did not throw.
+
+    Receipts from pre-Byzantium blocks have no status and are treated as successful.
+    """
+    status = receipt.get("status")
+    return status is None or status == 1
+
+
+def wait_for_receipts(web3: "Web3", txids, timeout=600, poll_interval=0.5, max_poll_interval=8, backoff=1.5):
+    """Wait for many transactions at once, polling all of them with one batch request per tick.
+
+    Polling interval grows by 'backoff' factor while nothing is mined
+    and drops back to 'poll_interval' as soon as some receipt arrives.
+
+    :return: generator of (txid, receipt) tuples in order of mining
+    """
+    pending = list(txids)
+    deadline = time.time() + timeout
+    interval = poll_interval
+
+    while pending:
+        receipts = poll_receipts(web3, pending)
+        for txid in pending:
+            if txid in receipts:
+                yield txid, receipts[txid]
+
+        if receipts:
+            pending = [txid for txid in pending if txid not in receipts]
+            interval = poll_interval
+            continue
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutError("Transactions not mined in {} seconds: {}".format(timeout, ", ".join(pending)))
+
+        time.sleep(min(interval, remaining))
+        interval = min(interval * backoff, max_poll_interval)
+
+
+def check_succesful_txs(web3: "Web3", txids, timeout=600, confirmations=None) -> dict:
+    """See if all transactions went through (Solidity code did not throw).
+
+    :param confirmations: wait until blocks are built on top of the transactions,
+                          receipts are then resolved by the process wide reorg-aware tracker
+    :return: dict txid -> transaction receipt
+    """
+    if confirmations:
+        from confirmation_tracker import shared_tracker
+
+        receipts = shared_tracker(web3).wait(txids, timeout=timeout, confirmations=confirmations)
+    else:
+        receipts = dict(wait_for_receipts(web3, txids, timeout=timeout))
+
+    for txid, receipt in receipts.items():
+        assert is_successful_receipt(receipt), "Transaction {} failed".format(txid)
+    return receipts
 
 
 """
 Inspiration from official populus documentation.
 http://populus.readthedocs.io
 """
-def check_succesful_tx(web3: Web3, txid: str, timeout=600) -> dict:
+def check_succesful_tx(web3: "Web3", txid: str, timeout=600, confirmations=None) -> dict:
     """See if transaction went through (Solidity code did not throw).
 
     :return: Transaction receipt
     """
+    return check_succesful_txs(web3, [txid], timeout=timeout, confirmations=confirmations)[txid]
+
+
+def receipt_futures(web3: "Web3", txids, timeout=600, loop=None) -> dict:
+    """Asyncio variant of wait_for_receipts.
+
+    Polling runs in the default executor of the loop, every future
+    is resolved with its receipt as soon as the transaction is mined.
+
+    :return: dict txid -> asyncio.Future
+    """
+    loop = loop or asyncio.get_event_loop()
+    futures = {txid: loop.create_future() for txid in txids}
+
+    def resolve(txid, receipt):
+        if not futures[txid].done():
+            futures[txid].set_result(receipt)
 
-    # http://ethereum.stackexchange.com/q/6007/620
-    receipt = wait_for_transaction_receipt(web3, txid, timeout=timeout)
-    txinfo = web3.eth.getTransaction(txid)
+    def fail_pending(error):
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(error)
 
-    # EVM has only one error mode and it's consume all gas
-    assert txinfo["gas"] != receipt["gasUsed"]
-    return receipt
+    def poll():
+        try:
+            for txid, receipt in wait_for_receipts(web3, list(futures), timeout=timeout):
+                loop.call_soon_threadsafe(resolve, txid, receipt)
+        except Exception as error:
+            loop.call_soon_threadsafe(fail_pending, error)
 
+    loop.run_in_executor(None, poll)
+    return futures
@@ -4,8 +4,11 @@ and test basic API from populus library
 Populus uses ropsten testnet
 """
 
-import populus
-from web3 import Web3, IPCProvider
+import argparse
+
+from chain_context import open_chain
+from provider_pool import endpoints_from_env, pooled_web3
+from rpc_metrics import instrument_from_env
 
 
 def load_ipcPATH():
@@ -22,30 +25,30 @@ def load_ipcPATH():
 
 
 # standard web3 need running geth node, and don't give chains choise
+# nodes listed in JOY_RPC_ENDPOINTS are used instead of gethipc.config
 def web3_standard():
-
-    gethipc_path = load_ipcPATH()
-    web3 = Web3(Web3.IPCProvider(gethipc_path))
+    endpoints = endpoints_from_env() or [load_ipcPATH()]
+    web3 = pooled_web3(endpoints)
+    # JOY_RPC_METRICS=<file> records every request of this web3 instance
+    instrument_from_env(web3)
 
     check_base_properties(web3)
 
 
 # web3 from populus library, using populus.json configuration file
-def web3_populus_project():
-    project = populus.Project()
+def web3_populus_project(chain_name='ropsten'):
 
-    # We are working on a testnet
-    chain_name = 'ropsten'
+    # We are working on a testnet by default
     print("Make sure {} chain is running, you can connect to it, or you'll get timeout".format(chain_name))
 
-    # dbg
-    ropsten_config = project.config['chains.ropsten.web3']
-    print("Ropsten config: {}".format(ropsten_config))
+    with open_chain(chain_name) as chain:
 
-    # with ropsten chain
-    with project.get_chain(chain_name) as chain:
+        # dbg
+        web3_config = chain.project.config['chains.{}.web3'.format(chain_name)]
+        print("{} config: {}".format(chain_name, web3_config))
 
         web3 = chain.web3
+        instrument_from_env(web3)
 
         check_base_properties(web3)
 
@@ -68,6 +71,10 @@ def check_base_properties(web3):
         print("Your default account address: " + default_acc)
 
 def main():
+    parser = argparse.ArgumentParser(description="Check basic properties of the node and of the populus chain.")
+    parser.add_argument("--chain", default="ropsten", help="populus chain name")
+    args = parser.parse_args()
+
     print("-------------------------------------------------------------------------")
 
     print("Trying web3 standard")
@@ -76,7 +83,7 @@ def main():
     print("-------------------------------------------------------------------------")
 
     print("Trying web3 populus")
-    web3_populus_project()
+    web3_populus_project(args.chain)
 
     print("-------------------------------------------------------------------------")
 
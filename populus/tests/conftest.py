@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+
+import pytest
+
+# make modules from scripts/ and deploy/ directories importable in tests
+POPULUS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(POPULUS_DIR, "scripts"))
+sys.path.insert(0, os.path.join(POPULUS_DIR, "deploy"))
+
+
+class FakeWeb3:
+    """web3 instance answering every request from node.request_blocking(method, params).
+
+    Its provider does not support batches, so rpc_batch sends batched requests
+    one by one through the node. Tests needing web3.eth pass their own.
+    """
+
+    def __init__(self, node, eth=None):
+        self.providers = [object()]
+        self.manager = node
+        if eth is not None:
+            self.eth = eth
+
+
+@pytest.fixture()
+def fake_web3():
+    """Factory of web3 instances on fake nodes, fake_web3(node) or fake_web3(node, eth=...)."""
+    return FakeWeb3
+
+
+# durations collected for the timing report
+DEPLOY_TIMES = {}
+SETUP_TIMES = {}
+CHAIN_TESTS = set()
+
+
+@pytest.fixture(scope="session")
+def session_chain():
+    """Tester chain shared by all tests of the session."""
+    import populus
+
+    project = populus.Project()
+    with project.get_chain("tester") as chain:
+        yield chain
+
+
+@pytest.fixture(scope="session")
+def deployed(session_chain):
+    """Contracts deployed once per session.
+
+    Contracts are registered in the chain registrar, so 'get_or_deploy_contract'
+    returns them instead of deploying again.
+    """
+    web3 = session_chain.web3
+    provider = session_chain.provider
+    contracts = {}
+
+    def deploy(name, deploy_args=None):
+        start = time.time()
+        contracts[name], _ = provider.get_or_deploy_contract(name, deploy_args=deploy_args)
+        DEPLOY_TIMES[name] = time.time() - start
+
+    deploy("JoyToken")
+    deploy("PlatformDeposit", deploy_args=[contracts["JoyToken"].address, web3.eth.accounts[1]])
+    deploy("SubscriptionWithEther")
+    return contracts
+
+
+@pytest.fixture()
+def chain(request, session_chain, deployed):
+    """Session chain reverted to the freshly deployed state after every test."""
+    CHAIN_TESTS.add(request.node.nodeid)
+    snapshot = session_chain.web3.testing.snapshot()
+    yield session_chain
+    session_chain.web3.testing.revert(snapshot)
+
+
+@pytest.fixture()
+def web3(chain):
+    return chain.web3
+
+
+@pytest.fixture()
+def joy_token(chain, deployed):
+    return deployed["JoyToken"]
+
+
+@pytest.fixture()
+def platform_deposit(chain, deployed):
+    return deployed["PlatformDeposit"]
+
+
+@pytest.fixture()
+def subscription_with_ether(chain, deployed):
+    return deployed["SubscriptionWithEther"]
+
+
+def pytest_runtest_logreport(report):
+    if report.when == "setup":
+        SETUP_TIMES[report.nodeid] = report.duration
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not DEPLOY_TIMES:
+        return
+
+    deploy_total = sum(DEPLOY_TIMES.values())
+    terminalreporter.section("contract fixtures timing")
+    for name, duration in DEPLOY_TIMES.items():
+        terminalreporter.write_line("deployed {:<40} {:8.3f}s (once per session)".format(name, duration))
+
+    saved = 0.0
+    for nodeid in sorted(CHAIN_TESTS):
+        duration = SETUP_TIMES.get(nodeid, 0.0)
+        # every test used to deploy its contracts on its own
+        saved += max(0.0, deploy_total - duration)
+        terminalreporter.write_line("setup {:<60} {:8.3f}s".format(nodeid, duration))
+    terminalreporter.write_line("estimated setup time saved: {:.3f}s".format(saved))
@@ -2,8 +2,8 @@ from populus.utils.wait import wait_for_transaction_receipt
 from ethereum.tester import TransactionFailed
 
 # test basic properties of JoyToken
-def test_baseProperties(chain):
-    JoyToken, _ = chain.provider.get_or_deploy_contract('JoyToken')
+def test_baseProperties(joy_token):
+    JoyToken = joy_token
 
     JoyToken_name = JoyToken.call().name()
     assert JoyToken_name == "JoyToken"
@@ -18,9 +18,9 @@ def test_baseProperties(chain):
     assert JoyToken_supply == 700000000 * (10 ** JoyToken_decimals)
 
 
-def test_simpleTransfer(web3, chain):
-    # deploy JoyToken from coinbase address
-    JoyToken, _ = chain.provider.get_or_deploy_contract('JoyToken')
+def test_simpleTransfer(web3, joy_token):
+    # JoyToken is deployed once per session from coinbase address
+    JoyToken = joy_token
 
     # get initial token balance == 21000000
     JoyToken_supply = JoyToken.call().totalSupply()
@@ -80,9 +80,9 @@ def test_simpleTransfer(web3, chain):
     assert JoyToken.call().balanceOf(web3.eth.accounts[3]) == (682000 - 7050)
 
 
-def test_failedTransfer(web3, chain):
-    # deploy JoyToken from coinbase address
-    JoyToken, _ = chain.provider.get_or_deploy_contract('JoyToken')
+def test_failedTransfer(web3, joy_token):
+    # JoyToken is deployed once per session from coinbase address
+    JoyToken = joy_token
 
     failed = False
     try:
@@ -94,9 +94,9 @@ def test_failedTransfer(web3, chain):
     assert failed
 
 
-def test_transferWithData(web3, chain):
-    # deploy JoyToken from coinbase address
-    JoyToken, _ = chain.provider.get_or_deploy_contract('JoyToken')
+def test_transferWithData(web3, joy_token):
+    # JoyToken is deployed once per session from coinbase address
+    JoyToken = joy_token
     # get initial token balance == 21000000
     JoyToken_supply = JoyToken.call().totalSupply()
 
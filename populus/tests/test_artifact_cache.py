@@ -0,0 +1,74 @@
+import pytest
+
+import artifact_cache
+from artifact_cache import ArtifactCache, sources_hash
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def test_hashChangesWithSourcesAndSettings(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write(tmp_path / "contracts" / "token" / "Token.sol", "contract Token {}")
+    first = sources_hash(["contracts"], ["populus.json"])
+
+    assert sources_hash(["contracts"], ["populus.json"]) == first
+
+    write(tmp_path / "populus.json", '{"compilation": {}}')
+    with_settings = sources_hash(["contracts"], ["populus.json"])
+    assert with_settings != first
+
+    write(tmp_path / "contracts" / "token" / "Token.sol", "contract Token { uint x; }")
+    assert sources_hash(["contracts"], ["populus.json"]) != with_settings
+
+
+def test_hashChangesWithCompilerVersion(tmp_path, monkeypatch):
+    write(tmp_path / "contracts" / "Token.sol", "contract Token {}")
+    monkeypatch.setattr(artifact_cache, "compiler_version", lambda: "solc 0.4.18\npopulus 1.11.0")
+    first = sources_hash(["contracts"], [], project_dir=str(tmp_path))
+
+    monkeypatch.setattr(artifact_cache, "compiler_version", lambda: "solc 0.4.24\npopulus 1.11.0")
+    assert sources_hash(["contracts"], [], project_dir=str(tmp_path)) != first
+
+
+def test_hashDoesNotDependOnCurrentDirectory(tmp_path, monkeypatch):
+    write(tmp_path / "project" / "contracts" / "Token.sol", "contract Token {}")
+    write(tmp_path / "project" / "populus.json", "{}")
+    monkeypatch.chdir(tmp_path / "project")
+    from_project = sources_hash(["contracts"], ["populus.json"])
+
+    monkeypatch.chdir(tmp_path)
+    assert sources_hash(["contracts"], ["populus.json"], project_dir="project") == from_project
+    assert ArtifactCache(source_dirs=["contracts"], settings_files=["populus.json"], project_dir="project").path \
+        == str(tmp_path / "project" / ".artifact_cache" / from_project)
+
+
+def test_warmCacheDoesNotCompile(tmp_path, monkeypatch):
+    pytest.importorskip("eth_utils")
+    monkeypatch.chdir(tmp_path)
+    write(tmp_path / "contracts" / "Token.sol", "contract Token {}")
+
+    abi = [
+        {"type": "function", "name": "transfer", "inputs": [{"type": "address"}, {"type": "uint256"}]},
+        {"type": "event", "name": "Transfer", "inputs": [{"type": "address"}, {"type": "address"}, {"type": "uint256"}]},
+    ]
+    compiled = []
+
+    def compile_contracts():
+        compiled.append(True)
+        return {"Token": {"abi": abi, "bytecode": "0x6060", "bytecode_runtime": "0x60"}}
+
+    ArtifactCache(source_dirs=["contracts"]).ensure(compile_contracts)
+    assert len(compiled) == 1
+
+    cache = ArtifactCache(source_dirs=["contracts"])
+    cache.ensure(compile_contracts)
+    assert len(compiled) == 1
+
+    assert cache.artifact("Token")["bytecode"] == "0x6060"
+    assert cache.selectors("Token")["transfer(address,uint256)"] == "0xa9059cbb"
+    assert cache.topics("Token")["Transfer(address,address,uint256)"].startswith("0xddf252ad")
+    with pytest.raises(KeyError):
+        cache.artifact("Missing")
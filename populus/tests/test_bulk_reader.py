@@ -0,0 +1,128 @@
+import pytest
+
+pytest.importorskip("eth_abi")
+
+from eth_abi import encode_abi  # noqa: E402
+
+from bulk_reader import BulkReader, balances_of  # noqa: E402
+from rpc_batch import RPCError  # noqa: E402
+
+TOKEN = "0x" + "01" * 20
+REVERTING = "0x" + "0f" * 20
+
+
+def holder(number):
+    return "0x" + "{:040x}".format(0x1000 + number)
+
+
+def function(name, inputs, outputs):
+    return {"type": "function", "name": name, "constant": True,
+            "inputs": [{"name": "", "type": abi_type} for abi_type in inputs],
+            "outputs": [{"name": "", "type": abi_type} for abi_type in outputs]}
+
+
+ABI = [
+    function("balanceOf", ["address"], ["uint256"]),
+    function("name", [], ["string"]),
+    function("info", [], ["uint256", "bool"]),
+    {"type": "event", "name": "Transfer", "inputs": []},
+]
+
+SELECTORS = {"0x70a08231": "balanceOf", "0x06fdde03": "name", "0x370158ea": "info"}
+
+
+class FakeProvider:
+    """Node answering eth_call of ABI functions, records batches."""
+
+    def __init__(self):
+        self.batches = []
+
+    def answer(self, method, params):
+        if method == "eth_blockNumber":
+            return "0x10"
+        transaction, block = params
+        assert block == "0x10"
+        if transaction["to"] == REVERTING:
+            raise ValueError("execution reverted")
+        name = SELECTORS[transaction["data"][:10]]
+        if name == "balanceOf":
+            return "0x" + encode_abi(["uint256"], [int(transaction["data"][-40:], 16)]).hex()
+        if name == "name":
+            return "0x" + encode_abi(["string"], ["Joy Token"]).hex()
+        return "0x" + encode_abi(["uint256", "bool"], [7, True]).hex()
+
+    def make_batch(self, payload):
+        self.batches.append([request["method"] for request in payload])
+        responses = []
+        for request in payload:
+            try:
+                responses.append({"id": request["id"], "result": self.answer(request["method"], request["params"])})
+            except ValueError as error:
+                responses.append({"id": request["id"], "error": str(error)})
+        return responses
+
+
+class FakeWeb3:
+    def __init__(self):
+        self.providers = [FakeProvider()]
+
+
+class Factory:
+    abi = ABI
+
+
+def test_readsAreChunkedAndPinnedToOneBlock():
+    web3 = FakeWeb3()
+    reader = BulkReader(web3, batch_size=2)
+
+    balances = reader.read([((Factory, TOKEN), "balanceOf", [holder(number)]) for number in range(5)])
+
+    assert balances == [0x1000 + number for number in range(5)]
+    assert web3.providers[0].batches == [["eth_blockNumber"], ["eth_call"] * 2, ["eth_call"] * 2, ["eth_call"]]
+    assert reader.block == 0x10
+
+
+def test_resultsAreDecodedByOutputTypes():
+    reader = BulkReader(FakeWeb3())
+
+    assert reader.read_one((Factory, TOKEN), "name") == "Joy Token"
+    assert reader.read_one((Factory, TOKEN), "info") == (7, True)
+
+
+def test_revertedCallsAreRaisedOrReturnedInPlace():
+    reader = BulkReader(FakeWeb3(), block=0x10)
+    calls = [((Factory, TOKEN), "balanceOf", [holder(1)]), ((Factory, REVERTING), "balanceOf", [holder(2)])]
+
+    with pytest.raises(RPCError):
+        reader.read(calls)
+
+    results = reader.read(calls, raise_errors=False)
+    assert results[0] == 0x1001
+    assert isinstance(results[1], RPCError)
+
+
+def test_functionsAreKeyedByContent():
+    reader = BulkReader(FakeWeb3(), block=0x10)
+
+    first = reader.function(ABI, "balanceOf", [holder(1)])
+    assert reader.function([dict(entry) for entry in ABI], "balanceOf", [holder(1)]) is first
+    assert reader.function(ABI, "name", []) is not first
+    with pytest.raises(ValueError):
+        reader.function(ABI, "balanceOf", [])
+
+
+def test_functionIsResolvedOncePerContract():
+    reader = BulkReader(FakeWeb3(), block=0x10)
+    abi = [dict(entry) for entry in ABI]
+
+    first = reader.function(abi, "balanceOf", [holder(1)])
+    # later calls of the same contract do not scan its ABI
+    abi.clear()
+    assert reader.function(abi, "balanceOf", [holder(2)]) is first
+
+
+def test_balancesOfHolders():
+    holders = [holder(number) for number in range(3)]
+
+    assert balances_of(FakeWeb3(), (Factory, TOKEN), holders, block=0x10) == {
+        address: int(address, 16) for address in holders}
@@ -0,0 +1,269 @@
+import pytest
+
+from bulk_transfer import BulkTransfer, JournalMismatch, NonceGap, TransferJournal
+from gas_oracle import DroppedTransaction
+
+TOKEN = "0x" + "01" * 20
+SENDER = "0x" + "02" * 20
+
+
+def recipient(number):
+    return "0x" + "{:040x}".format(0x1000 + number)
+
+
+def rows(count):
+    return [(row, recipient(row), 100 + row, "") for row in range(count)]
+
+
+class FakeNode:
+    """Node mining every transaction when its receipt is asked for, nonces can be used once."""
+
+    def __init__(self):
+        self.transactions = {}  # txhash -> transaction
+        self.nonces = {}  # nonce -> txhash
+        self.sent = 0
+        self.refused = set()  # nonces of transactions the sender can not pay for
+        self.mining = True
+
+    def send(self, transaction):
+        nonce = transaction["nonce"]
+        if nonce in self.nonces:
+            raise ValueError("nonce too low")
+        if nonce in self.refused:
+            raise ValueError("insufficient funds for gas * price + value")
+        self.sent += 1
+        txhash = "0x" + "{:064x}".format(self.sent)
+        self.transactions[txhash] = transaction
+        self.nonces[nonce] = txhash
+        return txhash
+
+    def drop(self, txhash):
+        del self.nonces[self.transactions.pop(txhash)["nonce"]]
+
+    def request_blocking(self, method, params):
+        if method == "eth_getTransactionByHash":
+            return self.transactions.get(params[0])
+        if method == "eth_getTransactionReceipt":
+            if params[0] not in self.transactions or not self.mining:
+                return None
+            return {"transactionHash": params[0], "blockNumber": "0x1", "status": "0x1"}
+        if method == "eth_estimateGas":
+            return hex(30000)
+        raise ValueError("unsupported method " + method)
+
+
+class FakeEth:
+    def __init__(self, node):
+        self.node = node
+        self.gasPrice = 1
+
+    def getTransactionCount(self, address, block):
+        return max(self.node.nonces, default=-1) + 1
+
+
+class FakeToken:
+    def __init__(self, node, transaction):
+        self.node = node
+        self.transaction = transaction
+
+    def transfer(self, address, amount):
+        return self.node.send(dict(self.transaction, args=[address, amount]))
+
+
+class FakeTokenFactory:
+    def __init__(self, node):
+        self.node = node
+
+    def transact(self, transaction):
+        return FakeToken(self.node, transaction)
+
+    def estimateGas(self, transaction):
+        return FakeToken(self.node, transaction)
+
+    def encodeABI(self, fn_name, args):
+        return "0x" + fn_name.encode().hex()
+
+
+@pytest.fixture
+def node():
+    return FakeNode()
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / "recipients.csv.journal")
+
+
+@pytest.fixture
+def node_web3(node, fake_web3):
+    return fake_web3(node, eth=FakeEth(node))
+
+
+def bulk_transfer(web3, journal, **kwargs):
+    return BulkTransfer(web3, FakeTokenFactory(web3.manager), TOKEN, SENDER, journal, gas=50000, **kwargs)
+
+
+def test_rowsInJournalAreNotPaidAgain(node, node_web3, journal_path):
+    journal = TransferJournal(journal_path)
+    bulk_transfer(node_web3, journal).run(rows(3))
+    journal.close()
+
+    journal = TransferJournal(journal_path)
+    assert sorted(journal.confirmed) == [0, 1, 2]
+    failed, review = bulk_transfer(node_web3, journal).run(rows(5))
+
+    assert (failed, review) == ([], [])
+    assert sorted(node.nonces) == [0, 1, 2, 3, 4]
+    assert [transaction["args"][0] for transaction in node.transactions.values()] == [recipient(row)
+                                                                                        for row in range(5)]
+
+
+def test_rowReservedBeforeCrashIsSentWithItsNonce(node, node_web3, journal_path):
+    journal = TransferJournal(journal_path)
+    # crash between reserving nonce 4 and sending
+    journal.record_submit(0, recipient(0), 100, "", 4, None)
+
+    bulk_transfer(node_web3, journal).run(rows(2))
+
+    assert node.transactions[node.nonces[4]]["args"] == [recipient(0), 100]
+    # new rows continue after the reserved nonce
+    assert node.transactions[node.nonces[5]]["args"] == [recipient(1), 101]
+    assert sorted(journal.confirmed) == [0, 1]
+
+
+def test_knownTransactionIsAwaitedNotResent(node, node_web3, journal_path):
+    txhash = node.send({"nonce": 0, "args": [recipient(0), 100]})
+    journal = TransferJournal(journal_path)
+    journal.record_submit(0, recipient(0), 100, "", 0, txhash)
+
+    bulk_transfer(node_web3, journal).run(rows(1))
+
+    assert list(node.transactions) == [txhash]
+    assert journal.confirmed[0]["txhash"] == txhash
+
+
+def test_usedNonceWithoutSavedHashNeedsReview(node, node_web3, journal_path):
+    # sent before the crash, the hash was not written to the journal
+    node.send({"nonce": 0, "args": [recipient(0), 100]})
+    journal = TransferJournal(journal_path)
+    journal.record_submit(0, recipient(0), 100, "", 0, None)
+
+    failed, review = bulk_transfer(node_web3, journal).run(rows(2))
+
+    assert review == [0]
+    assert len(node.transactions) == 2
+    assert 0 not in journal.confirmed
+
+
+def test_unsentNonceBelowInFlightOnesFailsTheRun(node, node_web3, journal_path):
+    journal = TransferJournal(journal_path)
+    journal.record_submit(0, recipient(0), 100, "", 0, None)
+    node.refused = {0}
+
+    with pytest.raises(NonceGap):
+        bulk_transfer(node_web3, journal).run(rows(2))
+
+    # the row keeps its nonce, the next run sends it again
+    assert journal.unconfirmed()[0]["nonce"] == 0
+
+
+def test_runGivesUpWithoutConfirmations(node, node_web3, journal_path):
+    node.mining = False
+
+    with pytest.raises(TimeoutError):
+        bulk_transfer(node_web3, TransferJournal(journal_path), timeout=0).run(rows(1))
+
+
+def test_changedRecipientsFileIsRejected(node_web3, journal_path):
+    journal = TransferJournal(journal_path)
+    journal.record_submit(0, recipient(0), 100, "", 0, None)
+
+    with pytest.raises(JournalMismatch):
+        bulk_transfer(node_web3, journal).run([(0, recipient(0), 999, "")])
+
+
+class StandInSigner:
+    """Requires the fields eth_account requires and hands transactions to the node."""
+
+    def __init__(self, node):
+        self.node = node
+        self.batches = []
+
+    def send(self, web3, transactions):
+        self.batches.append(len(transactions))
+        for transaction in transactions:
+            missing = {"gas", "gasPrice", "nonce"} - set(transaction)
+            if missing:
+                raise TypeError("Transaction must include these fields: {}".format(missing))
+        return [self.node.send(dict(transaction, args=[transaction["data"]])) for transaction in transactions]
+
+
+def test_signedTransferEstimatesGasWhenNotGiven(node, node_web3, journal_path):
+    journal = TransferJournal(journal_path)
+    # resubmitted by resume() before run() estimates gas
+    journal.record_submit(0, recipient(0), 100, "", 0, None)
+    bulk = BulkTransfer(node_web3, FakeTokenFactory(node), TOKEN, SENDER, journal, signer=StandInSigner(node))
+
+    bulk.run(rows(2))
+
+    assert [transaction["gas"] for transaction in node.transactions.values()] == [36000, 36000]
+    assert sorted(journal.confirmed) == [0, 1]
+
+
+def test_signedRowsOfFreeSlotsAreSentInOneBatch(node, node_web3, journal_path):
+    signer = StandInSigner(node)
+    journal = TransferJournal(journal_path)
+
+    bulk_transfer(node_web3, journal, signer=signer, max_in_flight=3).run(rows(5))
+
+    assert signer.batches == [3, 2]
+    assert sorted(node.nonces) == [0, 1, 2, 3, 4]
+    assert sorted(journal.confirmed) == [0, 1, 2, 3, 4]
+
+
+class StandInOracle:
+    """Head advances on every refresh, reports transactions the node does not know as dropped."""
+
+    def __init__(self, node):
+        self.node = node
+        self.head = 0
+
+    def refresh(self, force=False):
+        self.head += 1
+
+    def suggest(self, strategy):
+        return 2
+
+    def rebid(self, txhash, strategy, signer=None):
+        if txhash not in self.node.transactions:
+            raise DroppedTransaction("Unknown transaction: " + txhash)
+        return None
+
+
+def test_droppedTransactionIsResentWithItsNonce(node, node_web3, journal_path):
+    journal = TransferJournal(journal_path)
+    bulk = bulk_transfer(node_web3, journal, oracle=StandInOracle(node), rebid_after=1)
+    dropped = bulk.submit(0, recipient(0), 100, "", 0)
+    kept = bulk.submit(1, recipient(1), 101, "", 1)
+    node.drop(dropped)
+
+    bulk.rebid()
+
+    resent = node.nonces[0]
+    assert resent != dropped
+    assert node.transactions[resent]["args"] == [recipient(0), 100]
+    assert bulk.in_flight == {kept: 1, resent: 0}
+    assert journal.submitted[0]["txhash"] == resent
+
+
+def test_droppedTransactionWithUsedNonceNeedsReview(node, node_web3, journal_path):
+    journal = TransferJournal(journal_path)
+    bulk = bulk_transfer(node_web3, journal, oracle=StandInOracle(node), rebid_after=1)
+    dropped = bulk.submit(0, recipient(0), 100, "", 0)
+    node.drop(dropped)
+    node.send({"nonce": 0, "args": []})
+
+    bulk.rebid()
+
+    assert bulk.review == [0]
+    assert bulk.in_flight == {}
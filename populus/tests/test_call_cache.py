@@ -0,0 +1,126 @@
+from call_cache import CallCache
+
+TOKEN = "0x" + "11" * 20
+BALANCE_OF = "0x70a08231" + "00" * 12 + "22" * 20
+
+
+class FakeNode:
+    def __init__(self):
+        self.block = 100
+        self.requests = []
+        self.code = True
+
+    def make_request(self, method, params):
+        self.requests.append(method)
+        if method == "eth_blockNumber":
+            return {"result": hex(self.block)}
+        if not self.code:
+            return {"result": "0x"}
+        if params[0]["data"] == "0xdeadbeef":
+            return {"error": {"message": "reverted"}}
+        return {"result": hex(self.block * 10)}
+
+
+def test_immutableGettersAreCachedForever():
+    node = FakeNode()
+    cache = CallCache(head_ttl=0)
+    request = cache.middleware(node.make_request, None)
+
+    for block in (100, 101, 102):
+        node.block = block
+        assert request("eth_call", [{"to": TOKEN, "data": "0x313ce567"}, "latest"])["result"] == hex(1000)
+
+    # stale head is not refreshed for immutable getters
+    assert node.requests == ["eth_call"]
+    assert cache.stats()["immutable"]["hits"] == 2
+
+
+def test_stateIsDroppedOnNewHead():
+    node = FakeNode()
+    cache = CallCache(head_ttl=60)
+    request = cache.middleware(node.make_request, None)
+    call = [{"to": TOKEN, "data": BALANCE_OF}, "latest"]
+
+    assert request("eth_call", call)["result"] == hex(1000)
+    assert request("eth_call", call)["result"] == hex(1000)
+    assert node.requests == ["eth_blockNumber", "eth_call"]
+
+    # head is learned from eth_blockNumber made by anyone through web3
+    node.block = 101
+    request("eth_blockNumber", [])
+    assert request("eth_call", call)["result"] == hex(1010)
+    assert len(cache.state) == 1
+
+    # errors and pending state are not cached
+    request("eth_call", [{"to": TOKEN, "data": "0xdeadbeef"}, "latest"])
+    request("eth_call", [{"to": TOKEN, "data": "0xdeadbeef"}, "latest"])
+    request("eth_call", [{"to": TOKEN, "data": BALANCE_OF}, "pending"])
+    assert node.requests.count("eth_call") == 5
+
+
+def test_memoryBudgetEvictsLeastRecentlyUsed():
+    cache = CallCache(max_bytes=1000)
+    for block in range(20):
+        cache.store({"to": TOKEN, "data": BALANCE_OF}, hex(block), "0x" + "00" * 32)
+    stats = cache.stats()["state"]
+
+    assert stats["bytes"] <= 1000
+    assert stats["evictions"] == 20 - stats["entries"]
+    assert cache.lookup({"to": TOKEN, "data": BALANCE_OF}, hex(19)) is not None
+    assert cache.lookup({"to": TOKEN, "data": BALANCE_OF}, hex(0)) is None
+
+
+def test_emptyResultIsNotPinnedAndSentTransactionRefreshesHead():
+    node = FakeNode()
+    cache = CallCache(head_ttl=60)
+    request = cache.middleware(node.make_request, None)
+    decimals = [{"to": TOKEN, "data": "0x313ce567"}, "latest"]
+
+    # no code at the address yet
+    node.code = False
+    assert request("eth_call", decimals)["result"] == "0x"
+    node.code = True
+    assert request("eth_call", decimals)["result"] == hex(1000)
+    assert node.requests == ["eth_call", "eth_call"]
+
+    # owner() can be transferred
+    request("eth_call", [{"to": TOKEN, "data": "0x8da5cb5b"}, "latest"])
+    assert len(cache.immutable) == 1
+
+    call = [{"to": TOKEN, "data": BALANCE_OF}, "latest"]
+    request("eth_call", call)
+    node.block = 101
+    request("eth_sendTransaction", [{"to": TOKEN, "data": "0x"}])
+    assert request("eth_call", call)["result"] == hex(1010)
+
+
+def test_installFromEnv(monkeypatch):
+    import call_cache
+
+    class FakeManager:
+        def __init__(self):
+            self.middlewares = []
+
+    class FakeWeb3:
+        def __init__(self):
+            self.manager = FakeManager()
+
+        def add_middleware(self, middleware):
+            self.manager.middlewares.append(middleware)
+
+    web3 = FakeWeb3()
+    monkeypatch.delenv("JOY_CALL_CACHE", raising=False)
+    assert call_cache.install_from_env(web3) is None
+    assert web3.manager.middlewares == []
+
+    monkeypatch.setenv("JOY_CALL_CACHE", "1")
+    monkeypatch.setenv("JOY_CALL_CACHE_MB", "1")
+    cache = call_cache.install_from_env(web3)
+    assert cache.max_bytes == 1024 * 1024
+    # a warm web3 keeps its cache
+    assert call_cache.install_from_env(web3) is cache
+    assert len(web3.manager.middlewares) == 1
+
+    monkeypatch.setenv("JOY_CALL_CACHE", "0")
+    assert call_cache.install_from_env(web3) is None
+    assert web3.manager.middlewares == []
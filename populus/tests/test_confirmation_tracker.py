@@ -0,0 +1,165 @@
+import time
+
+import pytest
+
+import confirmation_tracker
+from confirmation_tracker import ConfirmationTracker, shared_tracker
+
+
+class FakeChain:
+    """Canonical chain of blocks, each block is a list of transaction hashes."""
+
+    def __init__(self):
+        self.blocks = [[]]
+        self.fork_id = 0
+        self.requests = []
+
+    def block_hash(self, number):
+        return "0x{:062x}{:02x}".format(number, self.fork_id if number >= self.fork_from else 0)
+
+    fork_from = 0
+
+    def mine(self, *txhashes):
+        self.blocks.append(list(txhashes))
+
+    def reorg(self, depth, *blocks):
+        """Replace last 'depth' blocks with given ones."""
+        self.fork_id += 1
+        self.fork_from = len(self.blocks) - depth
+        self.blocks = self.blocks[:self.fork_from] + [list(txhashes) for txhashes in blocks]
+
+    def request_blocking(self, method, params):
+        self.requests.append(method)
+        head = len(self.blocks) - 1
+        if method == "eth_blockNumber":
+            return hex(head)
+        if method == "eth_getBlockByNumber":
+            number = int(params[0], 16)
+            if number > head:
+                return None
+            return {"number": hex(number), "hash": self.block_hash(number),
+                    "parentHash": self.block_hash(number - 1), "transactions": self.blocks[number]}
+        if method == "eth_getTransactionReceipt":
+            for number, txhashes in enumerate(self.blocks):
+                if params[0] in txhashes:
+                    return {"transactionHash": params[0], "blockNumber": hex(number),
+                            "blockHash": self.block_hash(number), "status": "0x1", "gasUsed": "0x5208"}
+            return None
+        raise ValueError(method)
+
+
+def test_confirmedAfterDepth(fake_web3):
+    chain = FakeChain()
+    tracker = ConfirmationTracker(fake_web3(chain), confirmations=3)
+    future = tracker.track("0xaa")
+
+    chain.mine("0xaa")
+    tracker.step()
+    chain.mine()
+    tracker.step()
+    assert not future.done()
+
+    chain.mine()
+    tracker.step()
+    assert future.result()["blockNumber"] == 1
+    assert future.result()["status"] == 1
+
+
+def test_loadDoesNotGrowWithTrackedTransactions(fake_web3):
+    chain = FakeChain()
+    tracker = ConfirmationTracker(fake_web3(chain), confirmations=2)
+    futures = [tracker.track("0x{:04x}".format(i)) for i in range(1000)]
+    tracker.step()
+
+    chain.mine(*["0x{:04x}".format(i) for i in range(1000)])
+    chain.requests.clear()
+    tracker.step()
+    assert chain.requests == ["eth_blockNumber", "eth_getBlockByNumber", "eth_getBlockByNumber"]
+
+    chain.mine()
+    tracker.step()
+    assert all(future.done() for future in futures)
+
+
+def test_reorgedTransactionGoesBackToPending(fake_web3):
+    chain = FakeChain()
+    reorged = []
+    tracker = ConfirmationTracker(fake_web3(chain), confirmations=3)
+    future = tracker.track("0xaa", on_reorg=lambda txhash, block: reorged.append((txhash, block)))
+
+    tracker.step()
+    chain.mine("0xaa")
+    tracker.step()
+    chain.mine()
+    tracker.step()
+
+    # block with the transaction is replaced, the transaction comes back one block later
+    chain.reorg(2, [], [], ["0xaa"])
+    tracker.step()
+    assert reorged == [("0xaa", 1)]
+    assert not future.done()
+
+    chain.mine()
+    chain.mine()
+    tracker.step()
+    assert future.result()["blockNumber"] == 3
+
+
+def test_waitWithoutRunningLoop(fake_web3):
+    chain = FakeChain()
+    chain.mine("0xbb")
+    tracker = ConfirmationTracker(fake_web3(chain), confirmations=1, poll_interval=0)
+
+    assert tracker.wait(["0xbb"], timeout=1)["0xbb"]["blockNumber"] == 1
+    with pytest.raises(TimeoutError):
+        tracker.wait(["0xcc"], timeout=0.01)
+
+
+def test_depthIsPerTransaction(fake_web3):
+    chain = FakeChain()
+    tracker = ConfirmationTracker(fake_web3(chain), confirmations=3)
+    shallow = tracker.track("0xaa", confirmations=1)
+    deep = tracker.track("0xbb")
+    chain.mine("0xaa", "0xbb")
+    tracker.step()
+
+    assert shallow.done() and not deep.done()
+    chain.mine()
+    chain.mine()
+    tracker.step()
+    assert deep.result()["blockNumber"] == 1
+
+
+def test_sharedTrackerIsOnePerWeb3(fake_web3):
+    web3 = fake_web3(FakeChain())
+    tracker = shared_tracker(web3, poll_interval=60)
+    try:
+        assert shared_tracker(web3) is tracker
+        assert shared_tracker(fake_web3(FakeChain()), poll_interval=60) is not tracker
+    finally:
+        for web3, shared in list(confirmation_tracker._shared.items()):
+            shared.stop()
+            del confirmation_tracker._shared[web3]
+
+
+def test_waitHasOneDeadlineAndNodeErrorsAreLogged(fake_web3, caplog):
+    class FailingChain(FakeChain):
+        def request_blocking(self, method, params):
+            if method == "eth_blockNumber" and self.failures:
+                self.failures -= 1
+                raise ValueError("node is syncing")
+            return super().request_blocking(method, params)
+
+    chain = FailingChain()
+    chain.failures = 1
+    tracker = ConfirmationTracker(fake_web3(chain), confirmations=1, poll_interval=0.01).start()
+    try:
+        started = time.time()
+        with pytest.raises(TimeoutError):
+            tracker.wait(["0x{:04x}".format(i) for i in range(10)], timeout=0.1)
+        # not one timeout per transaction
+        assert time.time() - started < 0.5
+    finally:
+        tracker.stop()
+
+    assert "node is syncing" in caplog.text
@@ -0,0 +1,107 @@
+import json
+import os
+
+import pytest
+
+import deploy_graph
+from deploy_graph import ParallelDeployer, load_deploy_graph, plan_redeploy, critical_path, topological_order, set_field, get_field
+
+
+def load_deploy_json():
+    path = os.path.join(os.path.dirname(__file__), "..", "deploy", "deploy.json")
+    with open(path, "r") as conf_json:
+        return json.load(conf_json)
+
+
+def test_graphFromDeployJson():
+    graph = load_deploy_graph(load_deploy_json())
+
+    assert graph["deposit"].deps == ["joyToken"]
+    assert graph["demoGame"].deps == ["deposit"]
+    assert graph["subscription.ether"].deps == []
+    assert graph["subscription.joyToken"].deps == ["joyToken"]
+
+    order = topological_order(graph)
+    assert order.index("joyToken") < order.index("deposit") < order.index("demoGame")
+
+
+def test_criticalPath():
+    graph = load_deploy_graph(load_deploy_json())
+
+    # full redeploy needs only three confirmation rounds
+    assert critical_path(graph, list(graph)) == ["joyToken", "deposit", "demoGame"]
+
+
+def test_planRedeploy():
+    graph = load_deploy_graph(load_deploy_json())
+    all_given = {key: True for key in graph}
+
+    assert plan_redeploy(graph, all_given) == []
+
+    # redeployed token invalidates everything built on top of it
+    given = dict(all_given, joyToken=False)
+    assert set(plan_redeploy(graph, given)) == {"joyToken", "joyTokenUpgraded", "deposit", "demoGame",
+                                                "subscription.joyToken"}
+
+    given = dict(all_given, deposit=False)
+    assert plan_redeploy(graph, given) == ["deposit", "demoGame"]
+
+
+def test_cyclicDependency():
+    json_data = {"Deployment": {
+        "a": {"contract": "A", "args": ["ContractAddress.b"]},
+        "b": {"contract": "B", "args": ["ContractAddress.a"]},
+    }}
+
+    with pytest.raises(ValueError):
+        load_deploy_graph(json_data)
+
+
+def test_nestedFields():
+    json_data = load_deploy_json()
+    set_field(json_data, "ContractAddress.subscription.ether", "0x01")
+
+    assert get_field(json_data, "ContractAddress.subscription.ether") == "0x01"
+
+
+class FakeEth:
+    def __init__(self):
+        self.sent = []
+
+    def getTransactionCount(self, address, block):
+        return len(self.sent)
+
+
+class FakeChain:
+    def __init__(self):
+        self.web3 = type("FakeWeb3", (), {"eth": FakeEth()})()
+
+
+class FailingFactory:
+    """Node refuses the first deployment."""
+
+    def __init__(self, eth):
+        self.eth = eth
+        self.calls = 0
+
+    def deploy(self, transaction, args):
+        self.calls += 1
+        if self.calls == 1:
+            raise ValueError("insufficient funds for gas * price + value")
+        self.eth.sent.append(transaction["nonce"])
+        return "0x{:064x}".format(len(self.eth.sent))
+
+
+def test_nonceOfFailedDeploymentIsReused(monkeypatch):
+    chain = FakeChain()
+    factory = FailingFactory(chain.web3.eth)
+    monkeypatch.setattr(deploy_graph, "get_contract_factory", lambda chain, name: factory)
+    json_data = load_deploy_json()
+    deployer = ParallelDeployer(chain, "0x" + "01" * 20, json_data, load_deploy_graph(json_data))
+
+    with pytest.raises(ValueError):
+        deployer.submit("joyToken")
+    deployer.submit("joyToken")
+    deployer.submit("joyToken")
+
+    assert chain.web3.eth.sent == [0, 1]
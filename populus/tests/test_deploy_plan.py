@@ -0,0 +1,118 @@
+import json
+import os
+
+from deploy_graph import load_deploy_graph
+from deploy_plan import make_plan, strip_metadata
+
+OWNER = "0x" + "01" * 20
+RESERVE = "0x" + "02" * 20
+GAME_DEV = "0x" + "03" * 20
+METADATA = "a165627a7a72305820" + "ab" * 32 + "0029"
+
+CONTRACTS = ["JoyToken", "GameDeposit", "JoyGamePlatform", "SubscriptionWithEther", "SubscriptionWithJoyToken",
+             "JoyTokenUpgraded"]
+GETTERS = {"owner()": "0x8da5cb5b", "m_supportedToken()": "0xb602bf01", "platformReserve()": "0x42277097",
+           "m_playersDeposit()": "0x5d827459", "gameDev()": "0x938a37ed", "m_JoyToken()": "0xedc5a672",
+           "getUnderlyingTokenAddress()": "0x440f5fd2"}
+
+
+class FakeArtifacts:
+    def selectors(self, name):
+        return GETTERS
+
+    def artifact(self, name):
+        runtime = "0x6060" + "{:02x}".format(CONTRACTS.index(name)) + METADATA
+        return {"bytecode": "0x6060aa", "bytecode_runtime": runtime}
+
+
+class FakeNode:
+    def __init__(self):
+        self.code = {}
+        self.getters = {}  # (address, selector) -> address
+        self.requests = []
+
+    def deploy(self, address, name, **getters):
+        # metadata differs from the build, code is the same
+        self.code[address] = "0x6060" + "{:02x}".format(CONTRACTS.index(name)) + METADATA.replace("ab", "cd")
+        for getter, value in getters.items():
+            self.getters[(address, GETTERS[getter + "()"])] = "0x" + "00" * 12 + value[2:]
+
+    def request_blocking(self, method, params):
+        self.requests.append(method)
+        if method == "eth_getCode":
+            return self.code.get(params[0], "0x")
+        if method == "eth_call":
+            return self.getters.get((params[0]["to"], params[0]["data"]), "0x")
+        if method == "eth_estimateGas":
+            return hex(1000000)
+        raise ValueError("unsupported method " + method)
+
+
+def deployed_environment():
+    path = os.path.join(os.path.dirname(__file__), "..", "deploy", "deploy.json")
+    with open(path, "r") as conf_json:
+        json_data = json.load(conf_json)
+    json_data["AccountAddress"].update(contractsOwner=OWNER, platformReserve=RESERVE, gameDeveloper=GAME_DEV)
+
+    addresses = {"joyToken": "0x" + "a1" * 20, "deposit": "0x" + "a2" * 20, "demoGame": "0x" + "a3" * 20,
+                 "joyTokenUpgraded": "0x" + "a6" * 20}
+    json_data["ContractAddress"].update(addresses)
+    json_data["ContractAddress"]["subscription"] = {"ether": "0x" + "a4" * 20, "joyToken": "0x" + "a5" * 20}
+
+    node = FakeNode()
+    node.deploy(addresses["joyToken"], "JoyToken")
+    node.deploy(addresses["joyTokenUpgraded"], "JoyTokenUpgraded", getUnderlyingTokenAddress=addresses["joyToken"])
+    node.deploy(addresses["deposit"], "GameDeposit", owner=OWNER, m_supportedToken=addresses["joyToken"],
+                platformReserve=RESERVE)
+    node.deploy(addresses["demoGame"], "JoyGamePlatform", owner=OWNER, m_playersDeposit=addresses["deposit"],
+                gameDev=GAME_DEV)
+    node.deploy("0x" + "a4" * 20, "SubscriptionWithEther", owner=OWNER)
+    node.deploy("0x" + "a5" * 20, "SubscriptionWithJoyToken", owner=OWNER, m_JoyToken=addresses["joyToken"])
+    return json_data, node
+
+
+def plan(web3, json_data):
+    graph = load_deploy_graph(json_data)
+    given = {key: True for key in graph}
+    return make_plan(web3, graph, json_data, FakeArtifacts(), given, OWNER)
+
+
+def test_stripMetadata():
+    assert strip_metadata("0x6060" + METADATA) == "6060"
+    assert strip_metadata("0x6060") == "6060"
+
+
+def test_healthyDeploymentNeedsNothing(fake_web3):
+    json_data, node = deployed_environment()
+    problems, to_deploy, estimates = plan(fake_web3(node), json_data)
+
+    assert to_deploy == []
+    assert all(not problem for problem in problems.values())
+    # code and links of all contracts, no gas estimates
+    assert "eth_estimateGas" not in node.requests
+    assert node.requests.count("eth_getCode") == 6
+
+
+def test_wrongLinkRedeploysContractAndDependents(fake_web3):
+    json_data, node = deployed_environment()
+    # deposit was deployed for another token
+    node.deploy(json_data["ContractAddress"]["deposit"], "GameDeposit", owner=OWNER,
+                m_supportedToken="0x" + "ff" * 20, platformReserve=RESERVE)
+    problems, to_deploy, estimates = plan(fake_web3(node), json_data)
+
+    assert to_deploy == ["deposit", "demoGame"]
+    assert "m_supportedToken()" in problems["deposit"][0]
+    assert problems["demoGame"] == ["depends on redeployed deposit"]
+    assert estimates == {"deposit": 1000000, "demoGame": 1000000}
+
+
+def test_missingOrDifferentCode(fake_web3):
+    json_data, node = deployed_environment()
+    del node.code[json_data["ContractAddress"]["subscription"]["ether"]]
+    node.code[json_data["ContractAddress"]["joyToken"]] = "0x6060ff" + METADATA
+    problems, to_deploy, _ = plan(fake_web3(node), json_data)
+
+    assert problems["subscription.ether"] == ["no code at address"]
+    assert problems["joyToken"] == ["code differs from build"]
+    assert set(to_deploy) == {"joyToken", "joyTokenUpgraded", "deposit", "demoGame", "subscription.ether",
+                              "subscription.joyToken"}
@@ -0,0 +1,190 @@
+import random
+
+from deposit_reconciler import Reconciler, replay_range
+from joy_events import EVENT_TOPICS
+from player_ledger import PlayerLedger, LedgerFollower
+
+TOKEN = "0x" + "01" * 20
+UPGRADED_TOKEN = "0x" + "02" * 20
+DEPOSIT = "0x" + "03" * 20
+GAME = "0x" + "04" * 20
+RESERVE = "0x" + "05" * 20
+GAME_DEV = "0x" + "06" * 20
+PLAYERS = ["0x" + "{:040x}".format(0x1000 + number) for number in range(5)]
+
+
+def topic(address):
+    return "0x" + "00" * 12 + address[2:]
+
+
+def data(*words):
+    return "0x" + "".join(word.to_bytes(32, "big").hex() for word in words)
+
+
+class History:
+    """Raw logs of one transaction per block."""
+
+    def __init__(self):
+        self.logs = []
+        self.block = 0
+        self.senders = {}  # txhash -> sender of payOut
+
+    def tx(self, *logs):
+        self.block += 1
+        for index, (address, event, topics, log_data) in enumerate(logs):
+            self.logs.append({"address": address, "topics": [EVENT_TOPICS[event]] + topics, "data": log_data,
+                              "blockNumber": hex(self.block), "blockHash": "0x00", "logIndex": hex(index),
+                              "transactionHash": "0x" + "{:064x}".format(self.block)})
+
+    def deposit(self, player, value):
+        self.tx((TOKEN, "Transfer", [topic(player), topic(DEPOSIT)], data(value)),
+                (UPGRADED_TOKEN, "ERC223Transfer", [topic(player), topic(DEPOSIT)], data(value, 64, 0)))
+
+    def custom_deposit(self, player, value, new_session=True):
+        self.tx((TOKEN, "Transfer", [topic(player), topic(DEPOSIT)], data(value)),
+                (GAME, "NewGameSession" if new_session else "RefreshGameSession", [topic(player)], data(value)),
+                (UPGRADED_TOKEN, "CustomDeposit", [topic(player), topic(DEPOSIT), topic(GAME)], data(value, 64, 0)))
+
+    def transfer_to_game(self, player, value, new_session=True):
+        self.tx((GAME, "NewGameSession" if new_session else "RefreshGameSession", [topic(player)], data(value)))
+
+    def end_game(self, player, remain, final):
+        self.tx((GAME, "EndGameInfo", [topic(player), "0x" + "aa" * 32, "0x" + "bb" * 32], data(0, remain, final)))
+
+    def pay_out(self, player, value):
+        self.tx((TOKEN, "Transfer", [topic(DEPOSIT), topic(player)], data(value)))
+        self.senders[self.logs[-1]["transactionHash"]] = player
+
+
+def random_history(seed, sessions=60):
+    rng = random.Random(seed)
+    history = History()
+    history.deposit(RESERVE, 10 ** 6)
+    locked = {}
+    free = dict.fromkeys(PLAYERS, 0)
+    for _ in range(sessions):
+        player = rng.choice(PLAYERS)
+        if player in locked:
+            if rng.random() < 0.3:
+                value = rng.randint(1, 1000)
+                history.custom_deposit(player, value, new_session=False)
+                locked[player] += value
+            final = rng.randint(0, 2 * locked[player])
+            remain = rng.randint(0, final)
+            history.end_game(player, remain, final)
+            free[player] += final - remain if final else 0
+            locked[player] = remain
+            if not remain:
+                del locked[player]
+        elif rng.random() < 0.5:
+            value = rng.randint(1, 1000)
+            history.custom_deposit(player, value)
+            locked[player] = value
+        else:
+            history.deposit(player, 2000)
+            history.transfer_to_game(player, 1000)
+            locked[player] = 1000
+            free[player] += 1000
+        if free[player] and rng.random() < 0.3:
+            value = rng.randint(1, free[player])
+            history.pay_out(player, value)
+            free[player] -= value
+    return history
+
+
+def config():
+    return TOKEN, UPGRADED_TOKEN, DEPOSIT, RESERVE, {GAME: GAME_DEV}
+
+
+def sequential_ledger(history):
+    ledger = PlayerLedger(*config())
+    ledger.tx_sender = history.senders.get
+    ledger.apply_logs(history.logs)
+    return ledger
+
+
+def reconcile_segments(history, blocks):
+    """Replay history in segments of given number of blocks and merge them."""
+    reconciler = Reconciler(LedgerFollower(None, PlayerLedger(*config())))
+    for first in range(1, history.block + 1, blocks):
+        segment = [log for log in history.logs if first <= int(log["blockNumber"], 16) < first + blocks]
+        reconciler.merge(replay_range(config(), segment, history.senders))
+    return reconciler
+
+
+def test_segmentedReplayMatchesSequentialLedger():
+    history = random_history(seed=7)
+    ledger = sequential_ledger(history)
+
+    for size in (1, 7, 50, len(history.logs)):
+        reconciler = reconcile_segments(history, size)
+        assert reconciler.violations == []
+        assert {key: value for key, value in reconciler.deposits.items() if value} == ledger.deposits
+        assert reconciler.locked_funds == ledger.locked_funds
+
+
+def test_winNotCoveredByReserveIsReported():
+    history = History()
+    history.deposit(RESERVE, 100)
+    history.custom_deposit(PLAYERS[0], 50)
+    history.end_game(PLAYERS[0], 0, 120)
+    history.custom_deposit(PLAYERS[1], 50)
+    history.end_game(PLAYERS[1], 0, 500)
+
+    reconciler = reconcile_segments(history, 2)
+
+    assert [(block, invariant) for block, invariant, _ in reconciler.violations] == [(5, "reserve")]
+
+
+def test_tokensSentWithoutDepositBreakBalance():
+    history = History()
+    history.deposit(PLAYERS[0], 100)
+    history.tx((TOKEN, "Transfer", [topic(PLAYERS[1]), topic(DEPOSIT)], data(30)))
+    history.deposit(PLAYERS[1], 100)
+
+    reconciler = reconcile_segments(history, 1)
+
+    assert [(block, invariant) for block, invariant, _ in reconciler.violations] == [(2, "balance")]
+
+
+def test_negativeDepositIsReportedAtFirstBreakingBlock():
+    history = History()
+    history.deposit(PLAYERS[1], 100)
+    history.deposit(PLAYERS[0], 100)
+    # next segment: the deposit goes to -20 first, the lowest point -70 comes later
+    history.transfer_to_game(PLAYERS[0], 120)
+    history.pay_out(PLAYERS[0], 50)
+
+    reconciler = reconcile_segments(history, 2)
+
+    assert [(block, invariant) for block, invariant, _ in reconciler.violations] == [(3, "deposit")]
+    assert reconciler.violations[0][2].endswith("goes to -20")
+
+
+class FakeNode:
+    def __init__(self, history, balance):
+        self.history = history
+        self.balance = balance
+
+    def request_blocking(self, method, params):
+        if method == "eth_getLogs":
+            start, end = int(params[0]["fromBlock"], 16), int(params[0]["toBlock"], 16)
+            return [log for log in self.history.logs if start <= int(log["blockNumber"], 16) <= end]
+        if method == "eth_getTransactionByHash":
+            return {"from": self.history.senders[params[0]]}
+        if method == "eth_call":
+            return data(self.balance)
+        raise ValueError("unsupported method " + method)
+
+
+def test_runReplaysSegmentsInWorkerProcesses(fake_web3):
+    history = random_history(seed=3)
+    ledger = sequential_ledger(history)
+    balance = sum(ledger.deposits.values()) + sum(ledger.locked_funds.values())
+
+    follower = LedgerFollower(fake_web3(FakeNode(history, balance)), PlayerLedger(*config()))
+    reconciler = Reconciler(follower, workers=2, segment_logs=20, chunk_size=5)
+
+    assert reconciler.run(0, history.block) == []
+    assert reconciler.segments > 2
+    assert reconciler.locked_funds == ledger.locked_funds
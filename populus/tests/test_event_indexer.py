@@ -0,0 +1,114 @@
+import json
+import sqlite3
+
+from event_indexer import EventIndexer, load_addresses
+from joy_events import EVENT_TOPICS, decode_log
+
+PLAYER = "0x" + "11" * 20
+GAME = "0x" + "22" * 20
+
+
+def word(value):
+    return value.to_bytes(32, "big").hex()
+
+
+def address_topic(address):
+    return "0x" + "00" * 12 + address[2:]
+
+
+class FakeChain:
+    """Minimal JSON-RPC node answering requests used by the indexer."""
+
+    def __init__(self):
+        self.blocks = []  # list of block hashes
+        self.logs = []
+
+    def mine(self, logs=(), fork="a"):
+        number = len(self.blocks)
+        block_hash = "0x" + fork * 2 + "{:062x}".format(number)
+        self.blocks.append(block_hash)
+        for log_index, log in enumerate(logs):
+            self.logs.append(dict(log, blockNumber=hex(number), blockHash=block_hash, logIndex=hex(log_index),
+                                  transactionHash="0x" + "{:064x}".format(number * 100 + log_index)))
+
+    def reorg(self, block_number):
+        self.blocks = self.blocks[:block_number]
+        self.logs = [log for log in self.logs if int(log["blockNumber"], 16) < block_number]
+
+    def request_blocking(self, method, params):
+        if method == "eth_blockNumber":
+            return hex(len(self.blocks) - 1)
+        if method == "eth_getBlockByNumber":
+            number = int(params[0], 16)
+            return {"hash": self.blocks[number]} if number < len(self.blocks) else None
+        if method == "eth_getLogs":
+            start, end = int(params[0]["fromBlock"], 16), int(params[0]["toBlock"], 16)
+            return [log for log in self.logs if start <= int(log["blockNumber"], 16) <= end]
+        raise ValueError("unsupported method " + method)
+
+
+def new_game_session(value):
+    return {"address": GAME, "data": "0x" + word(value),
+            "topics": [EVENT_TOPICS["NewGameSession"], address_topic(PLAYER)]}
+
+
+def test_decodeLog():
+    log = dict(new_game_session(5000), blockNumber="0x1", blockHash="0x01", logIndex="0x0", transactionHash="0x02")
+
+    decoded = decode_log(log)
+
+    assert decoded["event"] == "NewGameSession"
+    assert decoded["args"] == {"player": PLAYER, "start_balance": 5000}
+
+
+def test_indexAndResume(tmpdir, fake_web3):
+    chain = FakeChain()
+    for value in range(1, 11):
+        chain.mine([new_game_session(value)])
+
+    db_path = str(tmpdir.join("events.sqlite"))
+    indexer = EventIndexer(fake_web3(chain), db_path, [GAME], chunk_size=3, confirmations=4)
+    assert indexer.run_once() == 9
+
+    # new indexer continues from saved checkpoint
+    chain.mine([new_game_session(11)])
+    indexer = EventIndexer(fake_web3(chain), db_path, [GAME], chunk_size=3, confirmations=4)
+    assert indexer.checkpoint() == 9
+    assert indexer.run_once() == 10
+
+    rows = sqlite3.connect(db_path).execute("SELECT start_balance FROM event_NewGameSession ORDER BY block_number")
+    assert [int(row[0]) for row in rows] == list(range(1, 12))
+
+
+def test_reorgRollback(tmpdir, fake_web3):
+    chain = FakeChain()
+    for value in range(1, 9):
+        chain.mine([new_game_session(value)])
+
+    db_path = str(tmpdir.join("events.sqlite"))
+    indexer = EventIndexer(fake_web3(chain), db_path, [GAME], confirmations=4)
+    indexer.run_once()
+
+    # last two blocks replaced with a different branch
+    chain.reorg(6)
+    chain.mine([new_game_session(100)], fork="b")
+    chain.mine([], fork="b")
+    chain.mine([new_game_session(200)], fork="b")
+    indexer.run_once()
+
+    rows = sqlite3.connect(db_path).execute("SELECT start_balance FROM event_NewGameSession ORDER BY block_number")
+    assert [int(row[0]) for row in rows] == [1, 2, 3, 4, 5, 6, 100, 200]
+
+
+def test_loadAddressesIncludesUpgradedToken(tmpdir):
+    config = tmpdir.join("config.json")
+    contracts = {"joyToken": "0x01", "joyTokenUpgraded": "0x02", "demoGame": "0x03", "deposit": "0x04",
+                 "subscription": {"ether": "0x05", "joyToken": ""}}
+    config.write(json.dumps({"ContractAddress": contracts}))
+
+    assert load_addresses(str(config)) == ["0x01", "0x02", "0x03", "0x04", "0x05"]
+
+    # written before JoyTokenUpgraded was deployed
+    del contracts["joyTokenUpgraded"]
+    config.write(json.dumps({"ContractAddress": contracts}))
+    assert load_addresses(str(config)) == ["0x01", "0x03", "0x04", "0x05"]
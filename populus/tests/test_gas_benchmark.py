@@ -0,0 +1,58 @@
+import types
+
+import pytest
+
+from gas_benchmark import Platform, compare, measure
+
+
+def test_compareReportsGasAboveThreshold():
+    baseline = {"transfer": {"gas": 50000}, "settle": {"gas": 80000}, "removed": {"gas": 1}}
+    results = {"transfer": {"gas": 50400}, "settle": {"gas": 81000}, "new": {"gas": 10 ** 6}}
+
+    assert compare(results, baseline, threshold=0.01) == [("settle", 80000, 81000)]
+    assert compare(results, baseline, threshold=0.02) == []
+
+
+class FakeNode:
+    """Mines a transaction after its receipt was asked for 'delay' times."""
+
+    def __init__(self, delay=0, status=1):
+        self.delay = delay
+        self.status = status
+        self.polls = {}
+
+    def request_blocking(self, method, params):
+        assert method == "eth_getTransactionReceipt"
+        txhash = params[0]
+        self.polls[txhash] = self.polls.get(txhash, 0) + 1
+        if self.polls[txhash] <= self.delay:
+            return None
+        return {"transactionHash": txhash, "blockNumber": "0x1", "gasUsed": hex(21000 + int(txhash, 16)),
+                "status": hex(self.status)}
+
+
+def fake_platform(node):
+    platform = types.SimpleNamespace(web3=types.SimpleNamespace(providers=[object()], manager=node))
+    platform.wait = lambda txhash: Platform.wait(platform, txhash)
+    return platform
+
+
+def test_waitPollsUntilMined():
+    node = FakeNode(delay=2)
+
+    assert fake_platform(node).wait("0x01")["gasUsed"] == 21001
+    assert node.polls["0x01"] == 3
+
+    with pytest.raises(ValueError):
+        fake_platform(FakeNode(status=0)).wait("0x01")
+
+
+def test_measureRecordsGasOfEveryRound():
+    prepared = []
+
+    result = measure(fake_platform(FakeNode()), "transfer", lambda round_number: hex(round_number * 10),
+                     prepare=prepared.append, rounds=3)
+
+    assert prepared == [0, 1, 2]
+    assert (result["gas"], result["gas_min"], result["rounds"]) == (21020, 21000, 3)
+    assert result["time_ms_max"] >= result["time_ms_median"]
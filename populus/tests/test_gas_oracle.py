@@ -0,0 +1,94 @@
+import pytest
+
+from gas_oracle import DroppedTransaction, GasPriceOracle, rebid_stuck
+
+GWEI = 10 ** 9
+
+
+class FakeNode:
+    def __init__(self, min_prices, block_time=15):
+        # one block per given minimum price, every block has two transactions
+        self.blocks = [{"timestamp": hex(1000 + number * block_time),
+                        "transactions": [{"gasPrice": hex(price)}, {"gasPrice": hex(price * 2)}]}
+                       for number, price in enumerate(min_prices)]
+        self.requests = []
+        self.transactions = {}  # txhash -> transaction
+        self.sent = []
+
+    def request_blocking(self, method, params):
+        self.requests.append(method)
+        if method == "eth_blockNumber":
+            return hex(len(self.blocks) - 1)
+        if method == "eth_getBlockByNumber":
+            return self.blocks[int(params[0], 16)]
+        if method == "eth_getTransactionByHash":
+            return self.transactions.get(params[0])
+        raise ValueError("unsupported method " + method)
+
+
+class FakeEth:
+    def __init__(self, node):
+        self.node = node
+
+    def sendTransaction(self, transaction):
+        self.node.sent.append(transaction)
+        return "0x" + "{:064x}".format(len(self.node.sent))
+
+
+def test_fasterTargetPaysMore(fake_web3):
+    node = FakeNode([price * GWEI for price in range(1, 21)])
+    oracle = GasPriceOracle(fake_web3(node, eth=FakeEth(node)), window=20, refresh_interval=0)
+
+    fast = oracle.suggest("fast")
+    standard = oracle.suggest("standard")
+    slow = oracle.suggest("slow")
+
+    assert fast >= standard >= slow
+    # included in the next block with 90% confidence
+    assert fast == 18 * GWEI
+    assert oracle.block_time() == 15
+
+
+def test_blocksAreFetchedOnce(fake_web3):
+    node = FakeNode([5 * GWEI] * 10)
+    oracle = GasPriceOracle(fake_web3(node, eth=FakeEth(node)), window=10, refresh_interval=0)
+    oracle.suggest()
+    assert node.requests.count("eth_getBlockByNumber") == 10
+
+    node.blocks.append(node.blocks[-1])
+    oracle.suggest()
+    assert node.requests.count("eth_getBlockByNumber") == 11
+    assert len(oracle.blocks) == 10
+
+
+def pending(txhash, gas_price, block_number=None):
+    return {"hash": txhash, "from": "0x" + "01" * 20, "to": "0x" + "02" * 20, "value": "0x0", "gas": hex(50000),
+            "gasPrice": hex(gas_price), "nonce": "0x7", "input": "0xa9059cbb", "blockNumber": block_number}
+
+
+def test_rebidReplacesPendingTransactionWithSameNonce(fake_web3):
+    node = FakeNode([GWEI] * 10)
+    node.transactions["0x01"] = pending("0x01", 20 * GWEI)
+    node.transactions["0x02"] = pending("0x02", 20 * GWEI, block_number="0x5")
+    oracle = GasPriceOracle(fake_web3(node, eth=FakeEth(node)), window=10, refresh_interval=0)
+
+    assert oracle.rebid("0x01") is not None
+    assert oracle.rebid("0x02") is None
+    with pytest.raises(DroppedTransaction):
+        oracle.rebid("0x03")
+
+    replacement, = node.sent
+    # node price suggestion is lower than the bump required for a replacement
+    assert replacement["gasPrice"] == 22500000000
+    assert (replacement["nonce"], replacement["gas"], replacement["data"]) == (7, 50000, "0xa9059cbb")
+
+
+def test_droppedTransactionsDoNotStopRebids(fake_web3):
+    node = FakeNode([GWEI] * 10)
+    node.transactions["0x01"] = pending("0x01", 20 * GWEI)
+    oracle = GasPriceOracle(fake_web3(node, eth=FakeEth(node)), window=10, refresh_interval=0)
+
+    replaced, dropped = rebid_stuck(oracle, ["0x03", "0x01"], {"0x01": 0, "0x03": 0}, max_wait_blocks=5)
+
+    assert list(replaced) == ["0x01"]
+    assert dropped == ["0x03"]
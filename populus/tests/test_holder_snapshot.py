@@ -0,0 +1,84 @@
+import pytest
+
+from holder_snapshot import HolderSnapshot, export, verify
+from joy_events import EVENT_TOPICS
+
+TOKEN = "0x" + "77" * 20
+CREATOR = "0x" + "aa" * 20
+ALICE = "0x" + "bb" * 20
+BOB = "0x" + "0c" * 20
+SUPPLY = 700000000 * 10 ** 18
+
+
+def transfer_log(block, sender, receiver, value):
+    return {"blockNumber": hex(block), "logIndex": "0x0", "data": hex(value),
+            "topics": [EVENT_TOPICS["Transfer"], "0x" + "00" * 12 + sender[2:], "0x" + "00" * 12 + receiver[2:]]}
+
+
+class FakeToken:
+    def __init__(self, logs):
+        self.logs = logs
+        self.requests = []
+
+    def balances_at(self, block):
+        balances = {CREATOR[2:]: SUPPLY}
+        for log in self.logs:
+            if int(log["blockNumber"], 16) <= block:
+                value = int(log["data"], 16)
+                balances[log["topics"][1][-40:]] -= value
+                balances[log["topics"][2][-40:]] = balances.get(log["topics"][2][-40:], 0) + value
+        return balances
+
+    def request_blocking(self, method, params):
+        self.requests.append((method, params))
+        if method == "eth_getLogs":
+            start, end = int(params[0]["fromBlock"], 16), int(params[0]["toBlock"], 16)
+            return [log for log in self.logs if start <= int(log["blockNumber"], 16) <= end]
+        if method == "eth_call":
+            data, block = params[0]["data"], int(params[1], 16)
+            if data == "0x18160ddd":
+                return hex(SUPPLY)
+            return hex(self.balances_at(block).get(data[-40:], 0))
+        raise ValueError(method)
+
+
+def test_exportAndExtend(tmp_path, fake_web3):
+    token = FakeToken([transfer_log(10, CREATOR, ALICE, 500), transfer_log(20, ALICE, BOB, 200),
+                       transfer_log(30, BOB, CREATOR, 200)])
+    web3 = fake_web3(token)
+    path = str(tmp_path / "joy.balances")
+
+    assert export(web3, TOKEN, 25, path, from_block=5, creator=CREATOR, chunk_size=7) == 3
+    with HolderSnapshot(path) as snapshot:
+        assert snapshot.block_number == 25
+        assert snapshot.balance_of(ALICE) == 300
+        assert snapshot.balance_of(BOB) == 200
+        assert snapshot.balance_of(CREATOR) == SUPPLY - 500
+        assert [key for key, _ in snapshot.items()] == sorted(key for key, _ in snapshot.items())
+        assert verify(web3, TOKEN, snapshot, sample_size=10) == []
+
+    # extension fetches only logs after the snapshot block, holders with zero balance disappear
+    token.requests.clear()
+    assert export(web3, TOKEN, 40, path, previous=path, chunk_size=100) == 2
+    assert token.requests == [("eth_getLogs", [{"fromBlock": hex(26), "toBlock": hex(40), "address": TOKEN,
+                                                "topics": [EVENT_TOPICS["Transfer"]]}])]
+    with HolderSnapshot(path) as snapshot:
+        assert snapshot.balance_of(BOB) == 0
+        assert snapshot.balance_of(CREATOR) == SUPPLY - 300
+        assert verify(web3, TOKEN, snapshot) == []
+
+
+def test_verifyReportsMismatches(tmp_path, fake_web3):
+    path = str(tmp_path / "joy.balances")
+    # initial supply is not in the logs, folding without the creator fails
+    with pytest.raises(ValueError):
+        export(fake_web3(FakeToken([transfer_log(10, CREATOR, ALICE, 500)])), TOKEN, 10, path)
+
+    export(fake_web3(FakeToken([transfer_log(10, CREATOR, ALICE, 500)])), TOKEN, 10, path, creator=CREATOR)
+
+    # chain where the snapshot missed a transfer
+    token = FakeToken([transfer_log(10, CREATOR, ALICE, 500), transfer_log(10, ALICE, BOB, 100)])
+    with HolderSnapshot(path) as snapshot:
+        mismatches = verify(fake_web3(token), TOKEN, snapshot)
+
+    assert mismatches == [("balanceOf " + ALICE, 500, 400)]
@@ -0,0 +1,69 @@
+import io
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import chain_context
+import joy
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+
+TOOL = """
+import os
+import sys
+
+
+def main():
+    print("args", " ".join(sys.argv[1:]), os.environ.get("JOY_TEST_VALUE"))
+    if "--fail" in sys.argv:
+        exit(3)
+"""
+
+
+@pytest.fixture
+def tool(tmp_path, monkeypatch):
+    (tmp_path / "joy_test_tool.py").write_text(TOOL)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setitem(joy.COMMANDS, "echo", ("joy_test_tool", "test tool"))
+    return "echo"
+
+
+def test_importDoesNotLoadEthStack():
+    code = "import sys, joy; joy.COMMANDS; print('web3' in sys.modules or 'populus' in sys.modules)"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=SCRIPTS_DIR)
+    assert output.strip() == b"False"
+
+
+def test_commandRunsMainWithArguments(tool, capsys):
+    assert joy.run_command(tool, ["--chain", "tester"]) == 0
+    assert capsys.readouterr().out.startswith("args --chain tester")
+    assert joy.run_command(tool, ["--fail"]) == 3
+
+
+def test_daemonRunsCommandsWithClientEnvironment(tool, tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "joy.sock")
+    daemon = joy.Daemon(socket_path)
+    thread = threading.Thread(target=daemon.serve, daemon=True)
+    thread.start()
+    assert daemon.ready.wait(5)
+
+    try:
+        monkeypatch.setenv("JOY_TEST_VALUE", "forwarded")
+        output = io.StringIO()
+        reply = joy.request_daemon(socket_path, joy.command_request([tool, "--fail"]), stdout=output)
+        assert reply == {"exit": 3}
+        assert output.getvalue() == "args --fail forwarded\n"
+
+        status = joy.request_daemon(socket_path, {"status": True})["status"]
+        assert status["commands"] == 1
+        assert status["pid"] == os.getpid()
+    finally:
+        joy.request_daemon(socket_path, {"stop": True}, stdout=io.StringIO())
+        thread.join(5)
+
+    assert not os.path.exists(socket_path)
+    assert chain_context._warm is None
+    assert joy.request_daemon(socket_path, {"status": True}) is None
@@ -0,0 +1,94 @@
+from load_generator import CyclePlanner, LoadGenerator, percentile
+
+
+class FakeNode:
+    """Mines every sent transaction in the next poll, one block per poll."""
+
+    def __init__(self, revert_stage=None):
+        self.sent = {}  # txhash -> stage
+        self.revert_stage = revert_stage
+        self.block = 0
+
+    def request_blocking(self, method, params):
+        if method == "eth_getTransactionReceipt":
+            stage = self.sent[params[0]]
+            return {"blockNumber": hex(self.block), "gasUsed": hex(50000),
+                    "status": "0x0" if stage == self.revert_stage else "0x1"}
+        if method == "eth_getBlockByNumber":
+            return {"gasUsed": hex(100000), "gasLimit": hex(4000000)}
+        raise ValueError(method)
+
+
+class FakePlatform:
+    def __init__(self, web3):
+        self.web3 = web3
+
+
+class FakeGenerator(LoadGenerator):
+    def send(self, cycle, stage):
+        node = self.web3.manager
+        txhash = "0x{:064x}".format(len(node.sent))
+        node.sent[txhash] = stage
+        return txhash
+
+
+def test_plannerIsReproducible():
+    first = CyclePlanner(["0xa", "0xb", "0xc"], seed=7)
+    second = CyclePlanner(["0xa", "0xb", "0xc"], seed=7)
+    for _ in range(20):
+        a, b = first.next_cycle(), second.next_cycle()
+        assert (a.player, a.stake, a.refresh_stake, a.pay_out, a.result_ratio) == \
+               (b.player, b.stake, b.refresh_stake, b.pay_out, b.result_ratio)
+
+
+def test_percentile():
+    assert percentile([], 0.5) is None
+    assert percentile([5, 1, 4, 2, 3], 0.5) == 3
+    assert percentile(list(range(1, 101)), 0.99) == 99
+
+
+def test_cyclesRunThroughStages(fake_web3):
+    node = FakeNode()
+    generator = FakeGenerator(FakePlatform(fake_web3(node)), CyclePlanner(["0xa", "0xb"], seed=1), rate=1000,
+                              poll_interval=0)
+
+    for _ in range(30):
+        while generator.send_next():
+            pass
+        node.block += 1
+        generator.collect_receipts()
+    generator.load_block_limits()
+    report = generator.stats.report()
+
+    stages = report["stages"]
+    # at most one cycle per player is open, every started cycle is settled or in flight
+    assert stages["start"]["mined"] - stages["settle"]["mined"] in (0, 1, 2)
+    assert stages["settle"]["mined"] > 5
+    assert report["reverted"] == 0
+    assert report["gas_per_block_max"] == 100000
+    assert report["block_utilization_max"] == 100000 / 4000000
+
+
+def test_revertedCycleStartsOver(fake_web3):
+    web3 = fake_web3(FakeNode(revert_stage="start"))
+    generator = FakeGenerator(FakePlatform(web3), CyclePlanner(["0xa"], seed=1), rate=1000, poll_interval=0)
+
+    for _ in range(3):
+        generator.send_next()
+        generator.collect_receipts()
+
+    assert generator.stats.reverted["start"] == 3
+    assert generator.stats.sent["settle"] == 0
+
+
+def test_deferredCyclesOfBusyPlayersAreBounded(fake_web3):
+    web3 = fake_web3(FakeNode())
+    generator = FakeGenerator(FakePlatform(web3), CyclePlanner(["0xa", "0xb", "0xc"], seed=1), rate=1000,
+                              poll_interval=0)
+
+    # receipts never come, every player stays busy
+    for _ in range(100):
+        generator.send_next()
+
+    assert 1 <= len(generator.in_flight) <= 3
+    assert generator.deferred_count == sum(len(cycles) for cycles in generator.deferred.values()) == 3
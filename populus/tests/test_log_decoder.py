@@ -0,0 +1,69 @@
+import pytest
+
+from joy_events import EVENT_TOPICS, decode_log
+
+np = pytest.importorskip("numpy")
+
+from log_decoder import LogDecoder, address_hex, bytes32_hex  # noqa: E402
+
+PLAYER = "0x" + "11" * 19 + "00"
+DEPOSIT = "0x" + "33" * 20
+GAME = "0x" + "22" * 20
+
+
+def word(value):
+    return value.to_bytes(32, "big").hex()
+
+
+def address_topic(address):
+    return "0x" + "00" * 12 + address[2:]
+
+
+def with_meta(log, number, log_index):
+    return dict(log, blockNumber=hex(number), blockHash="0x" + "ab" * 32, logIndex=hex(log_index),
+                transactionHash="0x" + "{:064x}".format(number))
+
+
+def end_game_info(number, locked, remain, final):
+    return with_meta({
+        "address": GAME,
+        "data": "0x" + word(locked) + word(remain) + word(final),
+        "topics": [EVENT_TOPICS["EndGameInfo"], address_topic(PLAYER), "0x" + "{:064x}".format(number), "0x" + "ff" * 32],
+    }, number, 0)
+
+
+def custom_deposit(number, value, data):
+    return with_meta({
+        "address": DEPOSIT,
+        "data": "0x" + word(value) + word(64) + word(len(data)) + data.ljust(32, b"\0").hex(),
+        "topics": [EVENT_TOPICS["CustomDeposit"], address_topic(PLAYER), address_topic(DEPOSIT), address_topic(GAME)],
+    }, number, 1)
+
+
+def test_columnsMatchDecodeLog():
+    logs = [end_game_info(1, 10 ** 18, 2 ** 255, 3), custom_deposit(1, 5, b"game data"),
+            end_game_info(2, 7, 0, 2 ** 256 - 1), {"topics": ["0x" + "00" * 32], "data": "0x"}]
+
+    decoder = LogDecoder()
+    batch = decoder.decode(logs)
+    assert decoder.unknown == 1
+
+    games = batch["EndGameInfo"]
+    assert list(games["position"]) == [0, 2]
+    assert list(games["blockNumber"]) == [1, 2]
+    assert address_hex(games["player"]) == [PLAYER, PLAYER]
+    assert bytes32_hex(games["gameSignature"]) == ["0x" + "ff" * 32] * 2
+    for row, position in enumerate(games["position"]):
+        expected = decode_log(logs[position])["args"]
+        for name in ("start_balance", "remainBalance", "finalBalance"):
+            assert games[name][row] == expected[name]
+
+    deposits = batch["CustomDeposit"]
+    assert list(deposits["value"]) == [5]
+    assert list(deposits["data"]) == [b"game data"]
+    assert address_hex(deposits["address"]) == [DEPOSIT]
+
+
+def test_limbsMode():
+    batch = LogDecoder(uint_mode="limbs").decode([end_game_info(1, 2 ** 64 + 3, 0, 0)])
+    assert batch["EndGameInfo"]["start_balance"].tolist() == [[0, 0, 1, 3]]
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from log_fetcher import LogFetcher
+from rpc_batch import RPCError
+
+
+class FakeNode:
+    """Node refusing eth_getLogs queries with more than 'limit' results."""
+
+    def __init__(self, logs_per_block, limit=10, delay=0.0):
+        self.logs_per_block = logs_per_block  # block number -> number of logs
+        self.limit = limit
+        self.delay = delay
+        self.queries = []
+
+    def request_blocking(self, method, params):
+        start, end = int(params[0]["fromBlock"], 16), int(params[0]["toBlock"], 16)
+        self.queries.append((start, end))
+        time.sleep(self.delay)
+        logs = [{"blockNumber": hex(number), "logIndex": hex(index)}
+                for number in range(start, end + 1) for index in range(self.logs_per_block.get(number, 0))]
+        if len(logs) > self.limit:
+            raise ValueError("query returned more than {} results".format(self.limit))
+        # node does not guarantee any order
+        return list(reversed(logs))
+
+
+def positions(logs):
+    return [(int(log["blockNumber"], 16), int(log["logIndex"], 16)) for log in logs]
+
+
+def test_streamIsOrderedAndComplete(fake_web3):
+    # dense region in the middle of sparse history
+    logs_per_block = {number: 1 for number in range(0, 5000, 97)}
+    logs_per_block.update({number: 4 for number in range(2000, 2050)})
+    node = FakeNode(logs_per_block, limit=10, delay=0.001)
+    fetcher = LogFetcher(fake_web3(node), workers=4, initial_range=100, target_logs=8)
+
+    logs = positions(fetcher.stream(0, 4999))
+
+    expected = [(number, index) for number in sorted(logs_per_block) for index in range(logs_per_block[number])]
+    assert logs == expected
+    assert fetcher.splits > 0
+    # sparse history is covered by ranges larger than the initial one
+    assert max(end - start + 1 for start, end in node.queries) > 100
+
+
+def test_rangeThatCannotBeSplit(fake_web3):
+    node = FakeNode({5: 20}, limit=10)
+    fetcher = LogFetcher(fake_web3(node), workers=2, initial_range=8)
+
+    with pytest.raises(RPCError):
+        list(fetcher.stream(0, 10))
+
+
+def test_abandonedStreamStopsFetching(fake_web3):
+    node = FakeNode({number: 1 for number in range(100000)}, limit=1000)
+    fetcher = LogFetcher(fake_web3(node), workers=2, initial_range=10, max_range=10)
+
+    stream = fetcher.stream(0, 99999)
+    assert positions([next(stream) for _ in range(25)])[-1] == (24, 0)
+    stream.close()
+
+    # only a bounded window was requested ahead
+    assert len(node.queries) <= 3 + 2 * 2
@@ -0,0 +1,28 @@
+import random
+
+from parallel_tests import split_tests
+
+
+NODE_IDS = ["tests/test_a.py::test_{}".format(i) for i in range(5)] + \
+           ["tests/test_b.py::test_{}".format(i) for i in range(3)] + \
+           ["tests/test_c.py::test_{}".format(i) for i in range(2)] + \
+           ["tests/test_d.py::test_0"]
+
+
+def test_splitKeepsFilesTogether():
+    buckets = split_tests(sorted(NODE_IDS), 3)
+
+    assert sorted(node_id for bucket in buckets for node_id in bucket) == sorted(NODE_IDS)
+    for bucket in buckets:
+        files = {node_id.split("::")[0] for node_id in bucket}
+        for other in buckets:
+            if other is not bucket:
+                assert not files & {node_id.split("::")[0] for node_id in other}
+
+
+def test_splitIsDeterministic():
+    shuffled = list(NODE_IDS)
+    random.Random(1).shuffle(shuffled)
+
+    assert split_tests(sorted(shuffled), 3) == split_tests(sorted(NODE_IDS), 3)
+    assert len(split_tests(NODE_IDS, 10)) == 4
@@ -0,0 +1,141 @@
+import pytest
+
+from player_ledger import LedgerFollower, PlayerLedger
+from joy_events import EVENT_TOPICS
+
+TOKEN = "0x" + "01" * 20
+UPGRADED_TOKEN = "0x" + "02" * 20
+DEPOSIT = "0x" + "03" * 20
+GAME = "0x" + "04" * 20
+RESERVE = "0x" + "05" * 20
+GAME_DEV = "0x" + "06" * 20
+PLAYER = "0x" + "07" * 20
+
+
+def topic(address):
+    return "0x" + "00" * 12 + address[2:]
+
+
+def data(*words):
+    return "0x" + "".join(word.to_bytes(32, "big").hex() for word in words)
+
+
+def empty_bytes_data(value):
+    # uint256 value followed by empty dynamic bytes
+    return data(value, 64, 0)
+
+
+class Tx:
+    """Builds raw logs of a single transaction."""
+    counter = 0
+
+    def __init__(self):
+        Tx.counter += 1
+        self.hash = "0x" + "{:064x}".format(Tx.counter)
+        self.logs = []
+
+    def log(self, address, event, topics, log_data):
+        self.logs.append({"address": address, "topics": [EVENT_TOPICS[event]] + topics, "data": log_data,
+                          "blockNumber": hex(Tx.counter), "blockHash": "0x00", "logIndex": hex(len(self.logs)),
+                          "transactionHash": self.hash})
+        return self
+
+
+def deposit_tx(player, value):
+    return Tx() \
+        .log(TOKEN, "Transfer", [topic(player), topic(DEPOSIT)], data(value)) \
+        .log(UPGRADED_TOKEN, "ERC223Transfer", [topic(player), topic(DEPOSIT)], empty_bytes_data(value)).logs
+
+
+def transfer_to_game_tx(player, value, new_session=True):
+    event = "NewGameSession" if new_session else "RefreshGameSession"
+    return Tx().log(GAME, event, [topic(player)], data(value)).logs
+
+
+def custom_deposit_tx(player, value):
+    return Tx() \
+        .log(TOKEN, "Transfer", [topic(player), topic(DEPOSIT)], data(value)) \
+        .log(GAME, "NewGameSession", [topic(player)], data(value)) \
+        .log(UPGRADED_TOKEN, "CustomDeposit", [topic(player), topic(DEPOSIT), topic(GAME)],
+             empty_bytes_data(value)).logs
+
+
+def end_game_tx(player, locked, remain, final, pay_out=0):
+    tx = Tx().log(GAME, "EndGameInfo", [topic(player), "0x" + "aa" * 32, "0x" + "bb" * 32],
+                  data(locked, remain, final))
+    if pay_out:
+        tx.log(TOKEN, "Transfer", [topic(DEPOSIT), topic(player)], data(pay_out))
+    return tx.logs
+
+
+def new_ledger():
+    ledger = PlayerLedger(TOKEN, UPGRADED_TOKEN, DEPOSIT, RESERVE, {GAME: GAME_DEV})
+    ledger.apply_logs(deposit_tx(RESERVE, 100000))
+    return ledger
+
+
+def test_depositAndTransferToGame():
+    ledger = new_ledger()
+    ledger.apply_logs(deposit_tx(PLAYER, 5000))
+    ledger.apply_logs(transfer_to_game_tx(PLAYER, 3000))
+    ledger.apply_logs(transfer_to_game_tx(PLAYER, 500, new_session=False))
+
+    assert ledger.balance_of_player(PLAYER) == 1500
+    assert ledger.player_locked_funds(PLAYER, GAME) == 3500
+
+
+def test_customDepositDoesNotTouchDeposit():
+    ledger = new_ledger()
+    ledger.apply_logs(custom_deposit_tx(PLAYER, 2000))
+
+    assert ledger.balance_of_player(PLAYER) == 0
+    assert ledger.player_locked_funds(PLAYER, GAME) == 2000
+
+
+def test_playerWins():
+    ledger = new_ledger()
+    ledger.apply_logs(custom_deposit_tx(PLAYER, 2000))
+    # finished with 2500, keeps 1000 in game
+    ledger.apply_logs(end_game_tx(PLAYER, 2000, 1000, 2500))
+
+    assert ledger.balance_of_player(RESERVE) == 100000 - 500
+    assert ledger.player_locked_funds(PLAYER, GAME) == 1000
+    assert ledger.balance_of_player(PLAYER) == 1500
+
+
+def test_playerLosesOddAmount():
+    ledger = new_ledger()
+    ledger.apply_logs(custom_deposit_tx(PLAYER, 2000))
+    ledger.apply_logs(end_game_tx(PLAYER, 2000, 0, 1997))
+
+    assert ledger.balance_of_player(GAME_DEV) == 1
+    assert ledger.balance_of_player(RESERVE) == 100000 + 2
+    assert ledger.player_locked_funds(PLAYER, GAME) == 0
+    assert ledger.balance_of_player(PLAYER) == 1997
+
+
+def test_payOutGameResult():
+    ledger = new_ledger()
+    ledger.apply_logs(deposit_tx(PLAYER, 100))
+    ledger.apply_logs(custom_deposit_tx(PLAYER, 2000))
+    ledger.apply_logs(end_game_tx(PLAYER, 2000, 0, 2000, pay_out=2100))
+
+    assert ledger.balance_of_player(PLAYER) == 0
+    assert ledger.player_locked_funds(PLAYER, GAME) == 0
+
+
+def test_payOutUsesTransactionSender():
+    ledger = new_ledger()
+    ledger.apply_logs(deposit_tx(PLAYER, 700))
+    ledger.tx_sender = lambda txhash: PLAYER
+
+    other = "0x" + "08" * 20
+    ledger.apply_logs(Tx().log(TOKEN, "Transfer", [topic(DEPOSIT), topic(other)], data(300)).logs)
+
+    assert ledger.balance_of_player(PLAYER) == 400
+
+
+def test_spotCheckRequiresSync():
+    follower = LedgerFollower(None, PlayerLedger(TOKEN, UPGRADED_TOKEN, DEPOSIT, RESERVE, {GAME: GAME_DEV}))
+    with pytest.raises(RuntimeError):
+        follower.spot_check()
@@ -0,0 +1,329 @@
+import asyncio
+import http.server
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import provider_pool
+from provider_pool import PooledProvider, NodeError, NodeUnavailable, install
+from rpc_batch import batch_request
+
+
+class FakeNode:
+    """IPC node answering many requests per connection, 'delay' seconds per request.
+
+    A request of a method in 'drop' is read and the connection closed without an answer, once.
+    """
+
+    def __init__(self, path, name, delay=0.0):
+        self.path = path
+        self.name = name
+        self.delay = delay
+        self.connections = []
+        self.requests = []
+        self.drop = set()
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(64)
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections.append(connection)
+            threading.Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+    def answer(self, request):
+        self.requests.append(request["method"])
+        if request["method"] == "web3_clientVersion":
+            return {"jsonrpc": "2.0", "id": request["id"], "result": self.name}
+        return {"jsonrpc": "2.0", "id": request["id"], "result": [self.name] + request["params"]}
+
+    def serve(self, connection):
+        decoder = json.JSONDecoder()
+        raw = ""
+        with connection:
+            while True:
+                try:
+                    chunk = connection.recv(65536)
+                except OSError:
+                    return
+                if not chunk:
+                    return
+                raw += chunk.decode()
+                try:
+                    request, end = decoder.raw_decode(raw)
+                except ValueError:
+                    continue
+                raw = raw[end:]
+                if isinstance(request, dict) and request["method"] in self.drop:
+                    self.drop.discard(request["method"])
+                    self.requests.append(request["method"])
+                    return
+                time.sleep(self.delay)
+                if isinstance(request, list):
+                    response = [self.answer(item) for item in request]
+                else:
+                    response = self.answer(request)
+                try:
+                    connection.sendall((json.dumps(response) + "\n").encode())
+                except OSError:
+                    # dropped by stop()
+                    return
+
+    def drop_connections(self):
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                # closed by the client
+                pass
+
+    def stop(self):
+        self.server.close()
+        os.remove(self.path)
+        self.drop_connections()
+
+
+@pytest.fixture
+def nodes(tmp_path):
+    started = []
+
+    def start(name, delay=0.0):
+        node = FakeNode(str(tmp_path / (name + ".ipc")), name, delay)
+        started.append(node)
+        return node
+
+    yield start
+    for node in started:
+        if os.path.exists(node.path):
+            node.stop()
+
+
+@pytest.fixture
+def pooled():
+    providers = []
+
+    def create(endpoints, **kwargs):
+        providers.append(PooledProvider(endpoints, **kwargs))
+        return providers[-1]
+
+    yield create
+    for provider in providers:
+        provider.close()
+
+
+def test_connectionsAreReused(nodes, pooled):
+    node = nodes("a")
+    provider = pooled([node.path])
+
+    for number in range(20):
+        assert provider.make_request("eth_getBalance", [number]) == {"jsonrpc": "2.0", "id": number + 1,
+                                                                     "result": ["a", number]}
+
+    assert len(node.connections) == 1
+    assert provider.isConnected()
+
+
+def test_concurrentRequestsAreBoundedByPoolSize(nodes, pooled):
+    node = nodes("a", delay=0.01)
+    provider = pooled([node.path], pool_size=3)
+    results = {}
+
+    def run(number):
+        results[number] = provider.make_request("eth_call", [number])["result"]
+
+    threads = [threading.Thread(target=run, args=(number,)) for number in range(24)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {number: ["a", number] for number in range(24)}
+    assert len(node.connections) == 3
+
+
+def test_asyncioRequests(nodes, pooled):
+    node = nodes("a", delay=0.01)
+    provider = pooled([node.path], pool_size=4)
+
+    async def run():
+        return await asyncio.gather(*[provider.request_async("eth_call", [number]) for number in range(12)],
+                                    provider.make_batch_async([{"jsonrpc": "2.0", "id": 1, "method": "eth_call",
+                                                                "params": ["batch"]}]))
+
+    responses = asyncio.run(run())
+
+    assert [response["result"][1] for response in responses[:12]] == list(range(12))
+    assert responses[12][0]["result"] == ["a", "batch"]
+    assert len(node.connections) <= 4
+
+
+def test_fastestNodeIsUsedAndFailedNodeSkipped(nodes, pooled):
+    slow, fast = nodes("slow", delay=0.05), nodes("fast")
+    provider = pooled([slow.path, fast.path], retry_after=60)
+
+    assert provider.make_request("eth_blockNumber", [])["result"] == ["fast"]
+
+    fast.stop()
+    assert provider.make_request("eth_blockNumber", [])["result"] == ["slow"]
+    assert [status["up"] for status in provider.status()] == [True, False]
+
+    slow.stop()
+    with pytest.raises(NodeUnavailable):
+        provider.make_request("eth_blockNumber", [])
+
+
+def test_nodeTransactionsAreNotResent(nodes, pooled):
+    first, second = nodes("first"), nodes("second")
+    provider = pooled([first.path, second.path], idle_check=60)
+    provider.make_request("eth_blockNumber", [])
+    provider.make_request("eth_blockNumber", [])
+    used = first if "eth_blockNumber" in first.requests else second
+
+    # the node takes the request and goes away without answering
+    used.drop = {"eth_sendTransaction"}
+    with pytest.raises(NodeError):
+        provider.make_request("eth_sendTransaction", [{"from": "0x01"}])
+    assert "eth_sendTransaction" not in (first if used is second else second).requests
+
+
+def test_nodeTransactionsAreNotResentOnReusedConnection(nodes, pooled):
+    node = nodes("a")
+    provider = pooled([node.path], idle_check=60)
+    provider.make_request("eth_blockNumber", [])
+
+    # read requests are sent again on a new connection
+    node.drop = {"eth_call"}
+    assert provider.make_request("eth_call", [1])["result"] == ["a", 1]
+    assert node.requests.count("eth_call") == 2
+
+    node.drop = {"eth_sendTransaction"}
+    with pytest.raises(NodeError):
+        provider.make_request("eth_sendTransaction", [{"from": "0x01"}])
+    assert node.requests.count("eth_sendTransaction") == 1
+
+
+def test_idleConnectionDroppedByNodeIsReplaced(nodes, pooled):
+    node = nodes("a")
+    provider = pooled([node.path], idle_check=0)
+    provider.make_request("eth_blockNumber", [])
+
+    node.drop_connections()
+
+    assert provider.make_request("eth_blockNumber", [])["result"] == ["a"]
+    assert len(node.connections) == 2
+
+
+def test_batchRequestUsesPooledConnection(nodes, pooled):
+    node = nodes("a")
+
+    class FakeWeb3:
+        providers = [pooled([node.path])]
+
+    assert batch_request(FakeWeb3(), [("eth_call", [1]), ("eth_call", [2])]) == [["a", 1], ["a", 2]]
+    assert batch_request(FakeWeb3(), [("eth_call", [3])]) == [["a", 3]]
+    assert len(node.connections) == 1
+
+
+def test_middlewaresWrapRequests(nodes, pooled):
+    node = nodes("a")
+    provider = pooled([node.path])
+    seen = []
+
+    def middleware(make_request, web3):
+        def request(method, params):
+            seen.append((web3, method))
+            return make_request(method, params)
+        return request
+
+    class FakeManager:
+        providers = ()
+
+    class FakeWeb3:
+        def __init__(self):
+            self.manager = FakeManager()
+
+    first, second = FakeWeb3(), FakeWeb3()
+    for web3 in (first, second):
+        install(web3, provider)
+        request_func = web3.manager.providers[0].request_func(web3, (middleware,))
+        assert request_func("eth_call", [7])["result"] == ["a", 7]
+
+    assert seen == [(first, "eth_call"), (second, "eth_call")]
+    assert provider_pool.shared_provider([node.path]) is provider_pool.shared_provider([node.path])
+
+
+class RPCHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.respond(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+
+    def respond(self, request):
+        body = json.dumps({"jsonrpc": "2.0", "id": request["id"], "result": request["params"]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TruncatingHandler(RPCHandler):
+    """Announces a longer body than it sends for the 'truncate' parameter, the client gets IncompleteRead."""
+
+    def respond(self, request):
+        if request["params"] != ["truncate"]:
+            return super().respond(request)
+        self.send_response(200)
+        self.send_header("Content-Length", "1000")
+        self.end_headers()
+        self.wfile.write(b'{"jsonrpc"')
+        self.close_connection = True
+
+
+def test_httpProtocolErrorReleasesConnection(pooled):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), TruncatingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    provider = pooled(["http://127.0.0.1:{}/".format(server.server_address[1])], pool_size=1, timeout=1)
+    try:
+        with pytest.raises(NodeUnavailable):
+            provider.make_request("eth_call", ["truncate"])
+        assert provider.status()[0]["failures"] == 1
+        # the only connection slot was given back
+        assert provider.make_request("eth_call", [1])["result"] == [1]
+    finally:
+        provider.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_httpKeepAlive(pooled):
+    connections = []
+
+    class Server(http.server.ThreadingHTTPServer):
+        def process_request(self, request, client_address):
+            connections.append(client_address)
+            super().process_request(request, client_address)
+
+    server = Server(("127.0.0.1", 0), RPCHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    provider = pooled(["http://127.0.0.1:{}/".format(server.server_address[1])])
+    try:
+        for number in range(5):
+            assert provider.make_request("eth_call", [number])["result"] == [number]
+        assert len(connections) == 1
+    finally:
+        provider.close()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,49 @@
+import pytest
+
+from rpc_batch import batch_request, poll_receipts, RPCError
+
+
+class FakeManager:
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def request_blocking(self, method, params):
+        self.requests.append((method, params))
+        result = self.responses[(method, tuple(params))]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def test_batchRequestKeepsOrder(fake_web3):
+    web3 = fake_web3(FakeManager({("eth_blockNumber", ()): "0x10", ("eth_gasPrice", ()): "0x3b9aca00"}))
+
+    results = batch_request(web3, [("eth_gasPrice", []), ("eth_blockNumber", [])])
+
+    assert results == ["0x3b9aca00", "0x10"]
+
+
+def test_batchRequestErrors(fake_web3):
+    web3 = fake_web3(FakeManager({("eth_call", ("bad",)): ValueError("execution reverted"),
+                                  ("eth_blockNumber", ()): "0x1"}))
+
+    with pytest.raises(RPCError):
+        batch_request(web3, [("eth_call", ["bad"]), ("eth_blockNumber", [])])
+
+    results = batch_request(web3, [("eth_call", ["bad"]), ("eth_blockNumber", [])], raise_errors=False)
+    assert isinstance(results[0], RPCError)
+    assert results[1] == "0x1"
+
+
+def test_pollReceipts(fake_web3):
+    web3 = fake_web3(FakeManager({
+        ("eth_getTransactionReceipt", ("0xaa",)): {"status": "0x1", "gasUsed": "0x5208", "blockNumber": "0x2"},
+        ("eth_getTransactionReceipt", ("0xbb",)): None,
+    }))
+
+    receipts = poll_receipts(web3, ["0xaa", "0xbb"])
+
+    assert list(receipts) == ["0xaa"]
+    assert receipts["0xaa"]["status"] == 1
+    assert receipts["0xaa"]["gasUsed"] == 21000
@@ -0,0 +1,123 @@
+import json
+
+import rpc_batch
+import rpc_metrics
+from rpc_metrics import RPCMetrics, LATENCY_BUCKETS
+
+
+class FakeHTTPProvider:
+    endpoint_uri = "http://localhost:8545"
+
+
+class FakeWeb3:
+    def __init__(self):
+        self.providers = [FakeHTTPProvider()]
+
+
+def test_middlewareRecordsMethodsAndFunctions(tmp_path):
+    metrics = RPCMetrics(slow_threshold=0, slow_log=str(tmp_path / "slow.log"))
+    metrics.add_function_names({"balanceOf(address)": "0x70a08231"})
+
+    def make_request(method, params):
+        if method == "eth_sendTransaction":
+            return {"error": {"message": "insufficient funds"}}
+        return {"result": "0x01"}
+
+    request = metrics.middleware(make_request, None)
+    request("eth_blockNumber", [])
+    request("eth_call", [{"to": "0x" + "11" * 20, "data": "0x70a08231" + "00" * 32}, "latest"])
+    request("eth_call", [{"to": "0x" + "11" * 20, "data": "0x70a08231" + "00" * 32}, "latest"])
+    request("eth_sendTransaction", [{"data": "0xdeadbeef"}])
+
+    methods = {(entry["method"], entry["function"]): entry for entry in metrics.to_json()["methods"]}
+    assert methods[("eth_blockNumber", "")]["count"] == 1
+    assert methods[("eth_call", "balanceOf(address)")]["count"] == 2
+    assert methods[("eth_call", "balanceOf(address)")]["response_bytes"] == 2 * len('"0x01"')
+    assert methods[("eth_sendTransaction", "0xdeadbeef")]["errors"] == 1
+
+    with open(str(tmp_path / "slow.log")) as log:
+        assert len([json.loads(line) for line in log]) == 4
+
+
+def test_prometheusExposition():
+    metrics = RPCMetrics(measure_bytes=False)
+    metrics.record("eth_call", [], 0.003)
+    metrics.record("eth_call", [], 20.0, error=True)
+
+    text = metrics.to_prometheus()
+    assert 'joy_rpc_requests_total{method="eth_call",function=""} 2' in text
+    assert 'joy_rpc_errors_total{method="eth_call",function=""} 1' in text
+    assert 'joy_rpc_latency_seconds_bucket{method="eth_call",function="",le="0.005"} 1' in text
+    assert 'joy_rpc_latency_seconds_bucket{method="eth_call",function="",le="+Inf"} 2' in text
+    assert "# TYPE joy_rpc_latency_seconds histogram" in text
+    assert len(metrics.stats[("eth_call", "")].buckets) == len(LATENCY_BUCKETS) + 1
+
+
+def test_batchesAreRecorded(monkeypatch):
+    metrics = RPCMetrics()
+    monkeypatch.setattr(rpc_batch, "metrics", metrics)
+    monkeypatch.setattr(rpc_batch, "send_http", lambda provider, payload: [
+        {"id": request["id"], "result": "0x10"} for request in payload])
+
+    rpc_batch.batch_request(FakeWeb3(), [("eth_getBalance", ["0x" + "11" * 20, "latest"])] * 3)
+
+    assert metrics.stats[("eth_getBalance", "")].count == 3
+
+
+class V3Manager:
+    def __init__(self):
+        self.middlewares = []
+
+    def request_blocking(self, method, params):
+        request = lambda method, params: {"result": "0x10"}  # noqa: E731
+        for middleware in reversed(self.middlewares):
+            request = middleware(request, None)
+        return request(method, params)["result"]
+
+
+class V3Web3:
+    """web3 v3 without middleware_stack."""
+
+    def __init__(self):
+        self.manager = V3Manager()
+
+    def add_middleware(self, middleware):
+        self.manager.middlewares.append(middleware)
+
+
+def test_warmWeb3IsInstrumentedOnce(monkeypatch):
+    monkeypatch.setattr(rpc_batch, "metrics", None)
+    web3 = V3Web3()
+    rpc_metrics.instrument(web3)
+    metrics = rpc_metrics.instrument(web3)
+
+    web3.manager.request_blocking("eth_blockNumber", [])
+
+    assert len(web3.manager.middlewares) == 1
+    assert metrics.stats[("eth_blockNumber", "")].count == 1
+
+
+class ColdCache:
+    def is_warm(self):
+        return False
+
+
+def test_envMetricsAreDumpedPerCommand(tmp_path, monkeypatch):
+    monkeypatch.setattr(rpc_batch, "metrics", None)
+    monkeypatch.setattr(rpc_metrics, "default_cache", ColdCache)
+    monkeypatch.setattr(rpc_metrics, "_env_atexit", True)
+    web3 = V3Web3()
+
+    # two commands of the joy daemon on the same warm web3
+    for command, requests in (("first", 2), ("second", 1)):
+        monkeypatch.setenv("JOY_RPC_METRICS", str(tmp_path / (command + ".json")))
+        rpc_metrics.instrument_from_env(web3)
+        for _ in range(requests):
+            web3.manager.request_blocking("eth_blockNumber", [])
+        rpc_metrics.dump_env_metrics()
+
+    assert web3.manager.middlewares == []
+    for command, requests in (("first", 2), ("second", 1)):
+        with open(str(tmp_path / (command + ".json"))) as fp:
+            assert [entry["count"] for entry in json.load(fp)["methods"]] == [requests]
+        assert (tmp_path / (command + ".json.prom")).exists()
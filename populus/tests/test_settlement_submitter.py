@@ -0,0 +1,147 @@
+from settlement_submitter import GameOutcome, SettlementSubmitter, StandInChain, StandInWeb3
+
+GAME = "0x" + "99" * 20
+OWNER = "0x" + "01" * 20
+GAME_DEV = "0x" + "02" * 20
+RESERVE = "0x" + "03" * 20
+
+
+def player(number):
+    return "0x" + "{:040x}".format(0x1000 + number)
+
+
+def process_id(number):
+    return number.to_bytes(32, "big")
+
+
+def new_chain(**kwargs):
+    return StandInChain(GAME, OWNER, GAME_DEV, RESERVE, **kwargs)
+
+
+def new_submitter(chain, **kwargs):
+    kwargs.setdefault("gas_price", 10)
+    return SettlementSubmitter(StandInWeb3(chain), GAME, OWNER, poll_interval=0, **kwargs)
+
+
+def test_settlesManyPlayersInFewBlocks():
+    chain = new_chain(block_size=100)
+    outcomes = []
+    for number in range(200):
+        chain.lock(player(number), 100)
+        outcomes.append(GameOutcome(player(number), 0, 150 if number % 2 else 40, process_id(number), b"\x01" * 32))
+
+    submitter = new_submitter(chain, max_in_flight=100)
+    assert submitter.run(outcomes) == []
+
+    assert submitter.counters["mined"] == 200
+    assert chain.head <= 6
+    assert chain.ledger.balance_of_player(player(1)) == 150
+    assert chain.ledger.balance_of_player(player(2)) == 40
+    assert chain.ledger.player_locked_funds(player(1), GAME) == 0
+
+
+def test_skipsPlayersWithoutLockedFunds():
+    chain = new_chain()
+    chain.lock(player(1), 100)
+    submitter = new_submitter(chain)
+    submitter.run([GameOutcome(player(1), 0, 100, process_id(1), b"\x01" * 32),
+                   GameOutcome(player(2), 0, 100, process_id(2), b"\x01" * 32)])
+
+    assert submitter.counters["mined"] == 1
+    assert submitter.counters["skipped"] == 1
+    assert submitter.failed == []
+
+
+def test_coalescesAndSerializesOutcomesOfOnePlayer():
+    chain = new_chain()
+    chain.lock(player(1), 100)
+    submitter = new_submitter(chain)
+    submitter.add(GameOutcome(player(1), 50, 80, process_id(1), b"\x01" * 32))
+    # the same game process reported again with updated balances
+    submitter.add(GameOutcome(player(1), 50, 90, process_id(1), b"\x02" * 32))
+    submitter.add(GameOutcome(player(1), 0, 60, process_id(2), b"\x01" * 32))
+    submitter.run()
+
+    assert submitter.counters["coalesced"] == 1
+    assert submitter.counters["mined"] == 2
+    # first settlement leaves 50 locked and unlocks 40, second one loses 50 -> 60 win and unlocks all
+    assert chain.ledger.balance_of_player(player(1)) == 40 + 60
+    assert chain.ledger.player_locked_funds(player(1), GAME) == 0
+
+
+def test_underpricedTransactionsAreResent():
+    chain = new_chain(min_gas_price=100)
+    chain.lock(player(1), 100)
+    submitter = new_submitter(chain, gas_price=50)
+    submitter.run([GameOutcome(player(1), 0, 100, process_id(1), b"\x01" * 32)])
+
+    assert submitter.counters["retried"] >= 1
+    assert submitter.counters["mined"] == 1
+
+
+class StandInSigner:
+    """Records transactions and hands them to the stand-in chain as if they were signed raw."""
+
+    def __init__(self, chain):
+        self.chain = chain
+        self.sent = []
+
+    def send(self, web3, transactions):
+        self.sent.extend(transactions)
+        return [self.chain.send_transaction(transaction) for transaction in transactions]
+
+
+def test_signerSendsOwnerTransactions():
+    chain = new_chain()
+    for number in range(5):
+        chain.lock(player(number), 100)
+    signer = StandInSigner(chain)
+    submitter = new_submitter(chain, signer=signer)
+
+    assert submitter.run([GameOutcome(player(number), 0, 50, process_id(number), b"\x01" * 32)
+                          for number in range(5)]) == []
+    assert submitter.counters["mined"] == 5
+    assert sorted(int(transaction["nonce"], 16) for transaction in signer.sent) == list(range(5))
+
+
+class UnfundedChain(StandInChain):
+    """Stand-in chain rejecting transactions at given nonces, value transfers too when 'fill' is False."""
+
+    def __init__(self, nonces, fill=True, **kwargs):
+        super().__init__(GAME, OWNER, GAME_DEV, RESERVE, **kwargs)
+        self.rejected = set(nonces)
+        self.fill = fill
+
+    def send_transaction(self, transaction):
+        nonce = int(transaction["nonce"], 16)
+        if nonce in self.rejected and (transaction.get("data") or not self.fill):
+            raise ValueError("insufficient funds for gas * price + value")
+        return super().send_transaction(transaction)
+
+
+def test_failedNonceIsFilledWhenNoOutcomeIsLeft():
+    chain = UnfundedChain({1})
+    for number in range(3):
+        chain.lock(player(number), 100)
+    submitter = new_submitter(chain)
+
+    failed = submitter.run([GameOutcome(player(number), 0, 50, process_id(number), b"\x01" * 32)
+                            for number in range(3)])
+
+    assert [outcome.player for outcome in failed] == [player(1)]
+    assert submitter.counters["filled"] == 1
+    assert submitter.counters["mined"] == 2
+    assert chain.mined_nonce == 3
+
+
+def test_settlementsAfterUnfillableNonceFail():
+    chain = UnfundedChain({1}, fill=False)
+    for number in range(3):
+        chain.lock(player(number), 100)
+    submitter = new_submitter(chain)
+
+    failed = submitter.run([GameOutcome(player(number), 0, 50, process_id(number), b"\x01" * 32)
+                            for number in range(3)])
+
+    assert sorted(outcome.player for outcome in failed) == [player(1), player(2)]
+    assert submitter.counters["mined"] == 1
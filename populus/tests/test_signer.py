@@ -0,0 +1,97 @@
+import pytest
+
+from rpc_batch import RPCError
+from signer import TransactionSigner, send_raw_transactions, signable
+
+
+KEY = bytes.fromhex("4c0883a69102937d6231471b5dbb6204fe5129617082792ae468d01a3f362318")
+ADDRESS = "0x2c7536e3605d9c16a7a3d7b1898e529396a65c23"
+
+
+class FakeNode:
+    def __init__(self, chain_id="0x539"):
+        self.raw_transactions = []
+        self.chain_id = chain_id
+
+    def request_blocking(self, method, params):
+        if method == "eth_chainId":
+            if self.chain_id is None:
+                raise ValueError({"message": "the method eth_chainId does not exist/is not available"})
+            return self.chain_id
+        if method == "net_version":
+            return "3"
+        assert method == "eth_sendRawTransaction"
+        if params[0] == "0xbad":
+            raise ValueError({"message": "nonce too low"})
+        self.raw_transactions.append(params[0])
+        return "0x" + "%064x" % len(self.raw_transactions)
+
+
+def test_signableConvertsHexFields():
+    transaction = {"from": ADDRESS, "to": "0x" + "11" * 20, "nonce": "0x10", "gas": "0x5208", "gasPrice": 10 ** 9}
+
+    prepared = signable(transaction, 3)
+
+    assert prepared == {"to": "0x" + "11" * 20, "nonce": 16, "gas": 21000, "gasPrice": 10 ** 9, "value": 0,
+                        "data": "0x", "chainId": 3}
+
+
+def test_rawTransactionsAreSentInBatchesWithErrorsInPlace(fake_web3):
+    node = FakeNode()
+
+    results = send_raw_transactions(fake_web3(node), ["0x01", "0xbad", "0x02"], batch_size=2)
+
+    assert results[0] == "0x" + "%064x" % 1
+    assert isinstance(results[1], RPCError)
+    assert results[2] == "0x" + "%064x" % 2
+    assert node.raw_transactions == ["0x01", "0x02"]
+
+
+def test_chainIdPrefersEthChainId(fake_web3):
+    signer = TransactionSigner({ADDRESS: KEY}, workers=1)
+
+    # ganache: network id 3 differs from chain id 1337
+    assert signer.chain_id(fake_web3(FakeNode())) == 1337
+    assert signer.chain_id(fake_web3(FakeNode(chain_id=None))) == 3
+
+
+def test_signedTransactionsRecoverSender():
+    eth_account = pytest.importorskip("eth_account")
+    signer = TransactionSigner({ADDRESS: KEY}, workers=1)
+    transactions = [{"from": ADDRESS, "to": "0x" + "11" * 20, "nonce": nonce, "gas": 21000, "gasPrice": 10 ** 9}
+                    for nonce in range(3)]
+
+    raw_transactions = signer.sign(transactions, chain_id=3)
+
+    recover = getattr(eth_account.Account, "recover_transaction", None) or eth_account.Account.recoverTransaction
+    assert len(set(raw_transactions)) == 3
+    assert all(recover(raw).lower() == ADDRESS for raw in raw_transactions)
+
+
+def test_poolSignsInOrder():
+    pytest.importorskip("eth_account")
+    transactions = [{"from": ADDRESS, "to": "0x" + "11" * 20, "nonce": nonce, "gas": 21000, "gasPrice": 10 ** 9}
+                    for nonce in range(12)]
+
+    with TransactionSigner({ADDRESS: KEY}, workers=2, chunk_size=5, min_parallel=10) as signer:
+        parallel = signer.sign(transactions, chain_id=3)
+    assert parallel == TransactionSigner({ADDRESS: KEY}, workers=1).sign(transactions, chain_id=3)
+
+
+def test_bulkTransferWindowIsSignedInWorkers():
+    pytest.importorskip("eth_account")
+    # full window of bulk_transfer with its default --in-flight
+    transactions = [{"from": ADDRESS, "to": "0x" + "11" * 20, "nonce": nonce, "gas": 21000, "gasPrice": 10 ** 9}
+                    for nonce in range(50)]
+
+    with TransactionSigner({ADDRESS: KEY}, workers=2) as signer:
+        signer.sign(transactions, chain_id=3)
+        assert signer.pool is not None
+
+
+def test_unknownSenderIsRejected():
+    pytest.importorskip("eth_account")
+    signer = TransactionSigner({ADDRESS: KEY}, workers=1)
+
+    with pytest.raises(KeyError):
+        signer.sign([{"from": "0x" + "22" * 20, "nonce": 0, "gas": 21000, "gasPrice": 1}])
@@ -0,0 +1,91 @@
+from joy_events import EVENT_TOPICS
+from subscription_index import SubscriptionIndex
+
+BUYER = "0x" + "11" * 20
+OTHER = "0x" + "22" * 20
+SUBSCRIPTION = "0x" + "33" * 20
+
+
+def word(value):
+    return value.to_bytes(32, "big").hex()
+
+
+def new_subscription(buyer, timepoint, amount_of_time, block=1, address=SUBSCRIPTION):
+    return {"address": address, "blockNumber": hex(block), "blockHash": "0x" + "00" * 32, "logIndex": "0x0",
+            "transactionHash": "0x" + "00" * 32,
+            "topics": [EVENT_TOPICS["newSubscription"], "0x" + "00" * 12 + buyer[2:]],
+            "data": "0x" + word(10) + word(timepoint) + word(amount_of_time)}
+
+
+def test_mergesOverlappingAndAdjacentPeriods():
+    index = SubscriptionIndex()
+    index.add(BUYER, 100, 50)
+    index.add(BUYER, 300, 100)
+    index.add(BUYER, 140, 20)
+    assert index.intervals(BUYER) == [(100, 160), (300, 400)]
+
+    # fills the gap and touches both intervals
+    index.add(BUYER, 160, 140)
+    assert index.intervals(BUYER) == [(100, 400)]
+
+    index.add(BUYER, 500, 10)
+    assert index.intervals(BUYER) == [(100, 400), (500, 510)]
+
+
+def test_isActive():
+    index = SubscriptionIndex()
+    index.add(BUYER, 100, 50)
+    index.add(BUYER, 200, 50)
+
+    assert not index.is_active(BUYER, 99)
+    assert index.is_active(BUYER, 100)
+    assert index.is_active(BUYER.upper().replace("0X", "0x"), 149)
+    assert not index.is_active(BUYER, 150)
+    assert index.expires_at(BUYER, 210) == 250
+    assert not index.is_active(OTHER, 120)
+
+
+def test_expiringSweep():
+    index = SubscriptionIndex()
+    index.add(BUYER, 0, 1000)
+    index.add(OTHER, 0, 5000)
+    index.add(OTHER, 100, 100)
+
+    assert index.expiring(now=500, within=1000) == [(1000, BUYER)]
+    assert index.expiring(now=500, within=1000) == [(1000, BUYER)]
+    # extended subscription is not expiring anymore
+    index.add(BUYER, 1000, 5000)
+    assert index.expiring(now=500, within=1000) == []
+    assert index.expiring(now=5500, within=1000) == [(6000, BUYER)]
+
+
+def test_supersededExpiryEntriesAreDropped():
+    index = SubscriptionIndex()
+    index.add(BUYER, 0, 100)
+    index.add(BUYER, 100, 100)
+    index.add(BUYER, 200, 100)
+    # interval that starts later stays in the heap although it is not active yet
+    index.add(OTHER, 500, 100)
+    assert len(index.expiry_heap) == 4
+
+    assert index.expiring(now=50, within=1000) == [(300, BUYER)]
+    assert sorted(index.expiry_heap) == [(300, BUYER), (600, OTHER)]
+    assert index.expiring(now=550, within=100) == [(600, OTHER)]
+
+
+def test_logsAndSnapshot(tmp_path):
+    index = SubscriptionIndex()
+    index.apply_logs([new_subscription(BUYER, 100, 50, block=3), new_subscription(OTHER, 10, 2 ** 200, block=4),
+                      new_subscription(BUYER, 120, 50, block=5, address="0x" + "44" * 20)],
+                     addresses=[SUBSCRIPTION])
+    assert index.block_number == 4
+    assert index.intervals(BUYER) == [(100, 150)]
+
+    path = str(tmp_path / "subscriptions.snapshot")
+    index.save(path)
+    loaded = SubscriptionIndex.load(path)
+
+    assert loaded.block_number == 4
+    assert loaded.intervals(BUYER) == [(100, 150)]
+    assert loaded.is_active(OTHER, 10 ** 12)
+    assert loaded.expiring(now=120, within=60) == [(150, BUYER)]
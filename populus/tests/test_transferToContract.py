@@ -1,80 +1,55 @@
-from populus.utils.wait import wait_for_transaction_receipt
 from ethereum.tester import TransactionFailed
 
 # Test erc223_token transfer to supporting contract
-def test_sendToContract(web3, chain):
-    # deploy JoyToken and contract that support receiving erc223 Tokens, from coinbase address
-    JoyToken = chain.provider.get_contract_factory('JoyToken')
-    PlatformDeposit = chain.provider.get_contract_factory('PlatformDeposit')
-
-    txhash_token = JoyToken.deploy(transaction={"from": web3.eth.coinbase})
-    token_receipt = wait_for_transaction_receipt(web3, txhash_token)
-    token_address = token_receipt["contractAddress"]
-
-    txhash_deposit = PlatformDeposit.deploy(transaction={"from": web3.eth.coinbase}, args=[token_address, web3.eth.accounts[1]])
-    deposit_receipt = wait_for_transaction_receipt(web3, txhash_deposit)
-    deposit_address = deposit_receipt["contractAddress"]
+def test_sendToContract(web3, joy_token, platform_deposit):
+    # JoyToken and contract that support receiving erc223 Tokens are deployed once per session from coinbase address
+    JoyToken = joy_token
+    PlatformDeposit = platform_deposit
+    deposit_address = platform_deposit.address
 
     # send some JoyTokens to another address, player
     player = web3.eth.accounts[1]
 
     # check preconditions
-    assert JoyToken.call({ 'to': token_address }).balanceOf(player) == 0
-    assert PlatformDeposit.call({ 'to': deposit_address }).balanceOfPlayer(player) == 0
+    assert JoyToken.call().balanceOf(player) == 0
+    assert PlatformDeposit.call().balanceOfPlayer(player) == 0
 
-    JoyToken.transact({ 'from': web3.eth.coinbase, 'to': token_address }).transfer(player, 50000);
+    JoyToken.transact({ 'from': web3.eth.coinbase }).transfer(player, 50000);
 
-    assert JoyToken.call({ 'to': token_address }).balanceOf(player) == 50000
+    assert JoyToken.call().balanceOf(player) == 50000
 
     # transfer to contract
-    JoyToken.transact({ 'from': player, 'to': token_address }).transfer(deposit_address, 50000);
+    JoyToken.transact({ 'from': player }).transfer(deposit_address, 50000);
 
-    assert JoyToken.call({ 'to': token_address }).balanceOf(player) == 0
-    assert PlatformDeposit.call({ 'to': deposit_address }).balanceOfPlayer(player) == 50000
+    assert JoyToken.call().balanceOf(player) == 0
+    assert PlatformDeposit.call().balanceOfPlayer(player) == 50000
 
     # payOut from contract to regular address
-    PlatformDeposit.transact({ 'from':player, 'to': deposit_address }).payOut(player, 50000);
+    PlatformDeposit.transact({ 'from':player }).payOut(player, 50000);
 
     # check postconditions
-    assert JoyToken.call({ 'to': token_address }).balanceOf(player) == 50000
-    assert PlatformDeposit.call({ 'to': deposit_address }).balanceOfPlayer(player) == 0
+    assert JoyToken.call().balanceOf(player) == 50000
+    assert PlatformDeposit.call().balanceOfPlayer(player) == 0
 
 # Test erc223_token transfer to not supporting contract
-def test_sendToContract(web3, chain):
-    # deploy JoyToken and contract that not support receiving erc223 Tokens
-    JoyToken = chain.provider.get_contract_factory('JoyToken')
-    SubscriptionWithEther = chain.provider.get_contract_factory('SubscriptionWithEther')
-
-    txhash_token = JoyToken.deploy(transaction={"from": web3.eth.coinbase})
-    token_receipt = wait_for_transaction_receipt(web3, txhash_token)
-    token_address = token_receipt["contractAddress"]
-
-    txhash_subscribe = SubscriptionWithEther.deploy(transaction={"from": web3.eth.coinbase})
-    subscribe_receipt = wait_for_transaction_receipt(web3, txhash_subscribe)
-    subscribe_address = subscribe_receipt["contractAddress"]
+def test_sendToNotSupportingContract(web3, joy_token, subscription_with_ether):
+    # JoyToken and contract that not support receiving erc223 Tokens are deployed once per session
+    JoyToken = joy_token
+    subscribe_address = subscription_with_ether.address
 
     failed = False
     try:
-        JoyToken.transact({ 'from': web3.eth.coinbase, 'to': token_address }).transfer(subscribe_address, 10000);
+        JoyToken.transact({ 'from': web3.eth.coinbase }).transfer(subscribe_address, 10000);
     except TransactionFailed:
         failed = True
 
     assert failed
 
-def test_transferToContractWithData(web3, chain):
-    # deploy JoyToken and contract that support receiving erc223 Tokens, from coinbase address
-    JoyToken = chain.provider.get_contract_factory('JoyToken')
-    PlatformDeposit = chain.provider.get_contract_factory('PlatformDeposit')
-
-    txhash_token = JoyToken.deploy(transaction={"from": web3.eth.coinbase})
-    token_receipt = wait_for_transaction_receipt(web3, txhash_token)
-    token_address = token_receipt["contractAddress"]
-
-    txhash_deposit = PlatformDeposit.deploy(transaction={"from": web3.eth.coinbase}, args=[token_address, web3.eth.accounts[1]])
-    deposit_receipt = wait_for_transaction_receipt(web3, txhash_deposit)
-    deposit_address = deposit_receipt["contractAddress"]
+def test_transferToContractWithData(web3, joy_token, platform_deposit):
+    # JoyToken and contract that support receiving erc223 Tokens are deployed once per session
+    JoyToken = joy_token
 
-    JoyToken.transact({ 'from': web3.eth.coinbase, 'to': token_address }).transfer(web3.eth.accounts[1], 60000, 'test_data');
+    JoyToken.transact({ 'from': web3.eth.coinbase }).transfer(web3.eth.accounts[1], 60000, 'test_data');
 
     eventFilter = JoyToken.pastEvents("ERC223Transfer", {'filter': {'from': web3.eth.coinbase} });
     found_logs = eventFilter.get()